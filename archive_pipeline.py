@@ -0,0 +1,97 @@
+"""
+Walks the archive once and passes every entry to a list of stages.
+
+Maintenance used to walk the archive once per script: garbage_clean.py, get_hash.py and
+sort_by_exif.py each did their own os.walk. Here the tree is listed once with os.scandir and
+each directory and file is handed to all stages in turn, so directory listings and stat data
+(cached on the os.DirEntry) are shared between them.
+
+Stages subclass Stage and override the methods they need:
+- enter_directory(dirpath, entries) is called before the files of a directory, with all its
+  os.DirEntry objects. Returning False skips the directory and everything below it for this
+  stage; a directory is not listed at all when no stage wants it.
+- process_file(entry) is called for every file, in the order of the stages. Returning False
+  means the file was removed, so later stages do not see it.
+- close() is called once at the end, also after an error.
+
+Directories are walked depth first in name order, so a top-level directory (a volume) is
+finished before the next one starts. Time spent by each stage is reported under its name
+by checksums.stats (see --stats of maintain_archive.py).
+
+Stages: garbage_clean.CleanStage, get_hash.HashStage, sort_by_exif/exif_index.ExifIndexStage.
+"""
+
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "checksums"))
+from checksums.stats import phase
+
+
+class Stage:
+    """
+    Base class of pipeline stages, all methods do nothing.
+    """
+    name = "stage"
+
+    def enter_directory(self, dirpath, entries):
+        return True
+
+    def process_file(self, entry):
+        return True
+
+    def close(self):
+        pass
+
+def run_stages(root, stages):
+    """
+    Walks root once, passing directories and files to stages.
+    A stage that fails on a file is logged and counted, and the walk goes on.
+    Returns {"directories": ..., "files": ..., "errors": ...}.
+    """
+    counts = {"directories": 0, "files": 0, "errors": 0}
+    stack = [(os.path.abspath(root), list(stages))]
+    try:
+        while stack:
+            dirpath, active = stack.pop()
+            try:
+                with phase("walk"):
+                    with os.scandir(dirpath) as it:
+                        entries = sorted(it, key=lambda entry: entry.name)
+            except OSError as e:
+                logging.error("Unable to list directory [%s]. %s" % (dirpath, e))
+                counts["errors"] += 1
+                continue
+            counts["directories"] += 1
+
+            entered = []
+            for stage in active:
+                with phase(stage.name):
+                    if stage.enter_directory(dirpath, entries) is not False:
+                        entered.append(stage)
+            if len(entered) == 0:
+                continue
+
+            subdirs = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+                counts["files"] += 1
+                for stage in entered:
+                    try:
+                        with phase(stage.name):
+                            if stage.process_file(entry) is False:
+                                break
+                    except Exception as e:
+                        logging.exception("Stage [%s] failed on file [%s]" % (stage.name, entry.path))
+                        print("Stage [%s] failed on file [%s]. %s" % (stage.name, entry.path, e))
+                        counts["errors"] += 1
+            stack.extend((path, entered) for path in reversed(subdirs))
+    finally:
+        for stage in stages:
+            stage.close()
+    return counts
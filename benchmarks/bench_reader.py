@@ -0,0 +1,117 @@
+"""
+Compares throughput of the file reading strategies used for hashing.
+
+The old loops read 4 KiB (get_hash.py) or 8 KiB (checksums) per call. They are
+timed against checksums.reader, which reads into a reused buffer with a block
+size adapted to the file size, with and without reading ahead on a background
+thread (for a single file, and over all files with Prefetcher), and against
+hashing a memory-mapped file.
+
+How to use this script:
+python bench_reader.py [--size-mb 64] [--files 4] [--algorithm md5] [--repeat 3]
+
+The files are read from the page cache after a warm-up pass, so the numbers show
+interpreter overhead rather than disk speed. Point --dir at a directory on the
+disk of interest and drop caches between runs to measure cold reads instead.
+"""
+import os
+import sys
+import mmap
+import time
+import hashlib
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "checksums"))
+from checksums import reader
+from checksums.reader import Prefetcher, update_hashes
+
+
+def hash_read_loop(fname, algorithm, block_size):
+    hash = hashlib.new(algorithm)
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(block_size), b""):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+def hash_reader(fname, algorithm, prefetch=False):
+    reader.PREFETCH = prefetch
+    hash = hashlib.new(algorithm)
+    update_hashes(fname, [hash])
+    return hash.hexdigest()
+
+def hash_prefetcher(fnames, algorithm):
+    digests = []
+    with Prefetcher(fnames) as prefetcher:
+        for fname, stat, blocks in prefetcher:
+            hash = hashlib.new(algorithm)
+            update_hashes(fname, [hash], blocks=blocks)
+            digests.append(hash.hexdigest())
+    return digests
+
+def hash_mmap(fname, algorithm):
+    hash = hashlib.new(algorithm)
+    with open(fname, "rb") as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                hash.update(m)
+    return hash.hexdigest()
+
+STRATEGIES = {
+    "read 4 KiB": lambda fname, algorithm: hash_read_loop(fname, algorithm, 4096),
+    "read 8 KiB": lambda fname, algorithm: hash_read_loop(fname, algorithm, 8192),
+    "readinto (reader)": hash_reader,
+    "read-ahead (reader)": lambda fname, algorithm: hash_reader(fname, algorithm, True),
+    "mmap": hash_mmap,
+}
+# Strategies hashing all files at once
+MULTI_FILE_STRATEGIES = {
+    "Prefetcher": hash_prefetcher,
+}
+
+def run(fnames, algorithm, repeat):
+    total_bytes = sum(os.path.getsize(fname) for fname in fnames)
+    results = {}
+    strategies = dict(STRATEGIES)
+    for name, strategy in MULTI_FILE_STRATEGIES.items():
+        strategies[name] = strategy
+    for name, strategy in strategies.items():
+        if name in MULTI_FILE_STRATEGIES:
+            hash_files = lambda: strategy(fnames, algorithm)
+        else:
+            hash_files = lambda: [strategy(fname, algorithm) for fname in fnames]
+        digests = hash_files()  # warm-up
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            hash_files()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = (total_bytes / best / 1e6, digests)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark file reading strategies for hashing.")
+    parser.add_argument("--dir", default=None, help="directory for test files (default: temporary directory)")
+    parser.add_argument("--size-mb", type=int, default=64, help="size of each test file in MB")
+    parser.add_argument("--files", type=int, default=4, help="number of test files")
+    parser.add_argument("--algorithm", default="md5", help="hashlib algorithm")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs, best is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        fnames = []
+        for i in range(args.files):
+            fname = os.path.join(tmp_dir, "blob_%d.bin" % i)
+            with open(fname, "wb") as f:
+                f.write(os.urandom(args.size_mb * 1024 * 1024))
+            fnames.append(fname)
+
+        results = run(fnames, args.algorithm, args.repeat)
+
+    baseline = results["read 4 KiB"][0]
+    print("%d x %d MB, %s" % (args.files, args.size_mb, args.algorithm))
+    for name, (throughput, digests) in results.items():
+        assert digests == results["read 4 KiB"][1], "%s gives different digests" % name
+        print("%-20s %8.1f MB/s  %5.2fx" % (name, throughput, throughput / baseline))
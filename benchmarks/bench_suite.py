@@ -0,0 +1,218 @@
+"""
+Times the main operations of the tools on a synthetic archive and writes the results as JSON.
+
+The archive is generated by gen_archive.py with the given arguments (see --help), so runs
+with the same arguments are comparable across versions of the code and across machines.
+Results can be saved per version and compared to track regressions:
+
+python bench_suite.py --output results_$(git rev-parse --short HEAD).json
+
+Benchmarks:
+- compute_hashes:        checksums.compute_hashes over the whole archive
+- read_hashes:           checksums.read_hashes of the resulting checksum file
+- check_hashes:          checksums.check_hashes of all files
+- save_hashes_for_volume: get_hash.save_hashes_for_volume for every volume
+- exif_dates:            sort_by_exif date extraction (exif_date.get_date) of all photos and sidecars
+- sort_by_exif_import:   sort_by_exif.run_pipeline copying the first volume into an empty destination
+- garbage_clean:         garbage_clean.clean walk in dry-run mode
+- maintenance_pipeline:  archive_pipeline.run_stages with clean (dry-run), hash and exif stages,
+                         to compare with garbage_clean + save_hashes_for_volume + exif_dates
+
+Each benchmark is run --repeat times and the best time is reported. Right after generation
+the archive is in the page cache, so by default the numbers show CPU and interpreter cost.
+With --drop-caches (Linux, root) the page cache is dropped before every run to measure
+cold reads.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import shutil
+import platform
+import argparse
+import datetime
+import tempfile
+import contextlib
+import subprocess
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(REPO_DIR, "checksums"))
+sys.path.insert(0, os.path.join(REPO_DIR, "sort_by_exif"))
+sys.path.insert(0, REPO_DIR)
+
+import get_hash
+import garbage_clean
+import sort_by_exif
+from exif_date import get_date
+from exif_index import ExifIndexStage
+from archive_pipeline import run_stages
+from dest_index import DestIndex
+from import_journal import ImportJournal
+from checksums.checksums import compute_hashes, print_hashes, read_hashes, check_hashes
+from gen_archive import VOLUME_NAME, add_arguments, generate_archive_from_args
+
+PHOTO_EXTENSIONS = (".JPG", ".NEF", ".xmp")
+
+# exifread warns about every file that is not an image, e.g. in the Lightroom catalog
+logging.getLogger("exifread").setLevel(logging.ERROR)
+
+
+def drop_caches():
+    subprocess.run(["sync"], check=True)
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+def list_files(root, extensions=None):
+    paths = []
+    for path, directories, files in os.walk(root):
+        for file in files:
+            if extensions is None or os.path.splitext(file)[1] in extensions:
+                paths.append(os.path.join(path, file))
+    return sorted(paths)
+
+def get_git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def timed(func, repeat, cold, setup=None):
+    """
+    Runs func() repeat times, calling setup() before each run outside of the timing.
+    Returns list of run times in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        if cold:
+            drop_caches()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return times
+
+def get_benchmarks(archive_root, work_dir, jobs):
+    """
+    Returns {name: (func, setup, paths of processed files, whether their content is read)}.
+    """
+    volumes = sorted(os.path.join(archive_root, name) for name in os.listdir(archive_root))
+    all_files = list_files(archive_root)
+    photos = list_files(archive_root, PHOTO_EXTENSIONS)
+    checksums_path = os.path.join(work_dir, ".checksums.sha512")
+    with open(checksums_path, "w") as f:
+        hashes = compute_hashes([os.path.join(archive_root, "**")], True, "sha512")
+        print_hashes(hashes, "sha512", "**", True, None, f)
+    dest_root = os.path.join(work_dir, "sorted")
+
+    def save_hashes_for_volumes():
+        for volume_dir in volumes:
+            hashes_file = os.path.join(work_dir, os.path.basename(volume_dir) + "_hashes.json")
+            get_hash.save_hashes_for_volume(archive_root, volume_dir, hashes_file)
+
+    def extract_dates():
+        for path in photos:
+            get_date(path)
+
+    def run_maintenance():
+        hash_dir_root = os.path.join(work_dir, "hashes")
+        os.makedirs(hash_dir_root, exist_ok=True)
+        run_stages(archive_root, [garbage_clean.CleanStage(dry_run=True),
+                                  get_hash.HashStage(archive_root, hash_dir_root),
+                                  ExifIndexStage(archive_root, os.path.join(hash_dir_root, "exif_index.json"))])
+
+    def reset_dest_root():
+        shutil.rmtree(dest_root, ignore_errors=True)
+        os.makedirs(dest_root)
+
+    def import_volume():
+        dest_index = DestIndex(dest_root)
+        journal = ImportJournal(dest_root)
+        try:
+            sort_by_exif.run_pipeline(os.path.join(archive_root, VOLUME_NAME % 0), dest_root,
+                                      sort_by_exif.DEFAULT_EXIF_WORKERS, sort_by_exif.DEFAULT_COPY_WORKERS,
+                                      sort_by_exif.DEFAULT_QUEUE_SIZE, dest_index, journal)
+        finally:
+            dest_index.close()
+            journal.close()
+
+    return {
+        "compute_hashes": (lambda: compute_hashes([os.path.join(archive_root, "**")], True, "sha512", None, jobs),
+                           None, all_files, True),
+        "read_hashes": (lambda: read_hashes(checksums_path), None, [checksums_path], True),
+        "check_hashes": (lambda: check_hashes(read_hashes(checksums_path), "sha512"), None, all_files, True),
+        "save_hashes_for_volume": (save_hashes_for_volumes, None, all_files, True),
+        "exif_dates": (extract_dates, None, photos, False),
+        "sort_by_exif_import": (import_volume, reset_dest_root,
+                                list_files(os.path.join(archive_root, VOLUME_NAME % 0)), True),
+        "garbage_clean": (lambda: garbage_clean.clean(archive_root, dry_run=True), None, all_files, False),
+        "maintenance_pipeline": (run_maintenance, None, all_files, True),
+    }
+
+def run(archive_root, work_dir, names, repeat, cold, jobs):
+    benchmarks = get_benchmarks(archive_root, work_dir, jobs)
+    results = {}
+    for name in names:
+        func, setup, paths, reads_content = benchmarks[name]
+        times = timed(func, repeat, cold, setup)
+        best = min(times)
+        n_bytes = sum(os.path.getsize(path) for path in paths) if reads_content else 0
+        results[name] = {
+            "seconds": best,
+            "runs": times,
+            "files": len(paths),
+            "bytes": n_bytes,
+            "files_per_second": len(paths) / best if best > 0 else None,
+            "mb_per_second": n_bytes / best / 1e6 if best > 0 and reads_content else None,
+        }
+        print("%-24s %8.3f s  %8.1f files/s  %8.1f MB/s" % (
+            name, best, results[name]["files_per_second"] or 0, results[name]["mb_per_second"] or 0), file=sys.stderr)
+    return results
+
+
+if __name__ == "__main__":
+    all_names = ["compute_hashes", "read_hashes", "check_hashes", "save_hashes_for_volume", "exif_dates",
+                 "sort_by_exif_import", "garbage_clean", "maintenance_pipeline"]
+    parser = argparse.ArgumentParser(description="Benchmark the tools on a synthetic photo archive.")
+    parser.add_argument("--dir", default=None, help="directory for the archive (default: temporary directory)")
+    parser.add_argument("--only", default=",".join(all_names), help="comma-separated benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs, best is reported")
+    parser.add_argument("--jobs", type=int, default=1, help="jobs for compute_hashes")
+    parser.add_argument("--drop-caches", action="store_true", help="drop the page cache before each run (Linux, root)")
+    parser.add_argument("--output", default=None, help="JSON file for the results (default: standard output)")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(names) - set(all_names)
+    if unknown:
+        parser.error("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        archive_root = os.path.join(tmp_dir, "archive")
+        work_dir = os.path.join(tmp_dir, "work")
+        os.makedirs(work_dir)
+        print("Generating archive in [%s]..." % archive_root, file=sys.stderr)
+        archive = generate_archive_from_args(archive_root, args)
+        results = run(archive_root, work_dir, names, args.repeat, args.drop_caches, args.jobs)
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "git_revision": get_git_revision(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"repeat": args.repeat, "jobs": args.jobs, "drop_caches": args.drop_caches},
+        "archive": dict(archive, **{key: value for key, value in vars(args).items()
+                                    if key not in ("dir", "only", "repeat", "jobs", "drop_caches", "output")}),
+        "results": results,
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
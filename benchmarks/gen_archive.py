@@ -0,0 +1,145 @@
+"""
+Generates a reproducible synthetic photo archive for the benchmarks.
+
+The archive has the layout expected by get_hash.py (volumes in the archive root) and
+contains what the tools meet in a real archive:
+- small JPEGs with an EXIF header carrying DateTimeOriginal,
+- large RAW (.NEF) blobs, TIFF-based with the same EXIF date, next to some JPEGs,
+- XMP sidecars next to some photos,
+- Lightroom catalog directories (*.lrcat and the previews tree),
+- a deep directory tree,
+- thumbnail cache files removed by garbage_clean.py.
+
+File contents come from a seeded random generator, so the same arguments give the same
+archive, byte for byte, on any machine.
+
+How to use this script:
+python gen_archive.py ARCHIVE_ROOT [--volumes 2] [--jpegs 500] [--raws 20] [--seed 0] ...
+"""
+import os
+import struct
+import random
+import argparse
+
+VOLUME_NAME = "vol_%02d"
+DATE_RANGE = (2012, 2023)  # years of DateTimeOriginal
+PHOTOS_PER_DAY = 40
+GARBAGE_FILES = ("Thumbs.db", "ZbThumbnail.info", ".picasa.ini")
+
+XMP_TEMPLATE = """<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description xmlns:exif="http://ns.adobe.com/exif/1.0/" exif:DateTimeOriginal="%s"/>
+ </rdf:RDF>
+</x:xmpmeta>
+"""
+
+
+def tiff_with_date(date_time):
+    """
+    Returns a big-endian TIFF structure with IFD0 pointing to an Exif IFD with DateTimeOriginal.
+    """
+    date_time = date_time.encode("ascii") + b"\0"
+    ifd0 = struct.pack(">H", 1) + struct.pack(">HHII", 0x8769, 4, 1, 8 + 2 + 12 + 4) + struct.pack(">I", 0)
+    data_offset = 8 + len(ifd0) + 2 + 12 + 4
+    exif_ifd = struct.pack(">H", 1) + struct.pack(">HHII", 0x9003, 2, len(date_time), data_offset) + struct.pack(">I", 0)
+    return b"MM\0*" + struct.pack(">I", 8) + ifd0 + exif_ifd + date_time
+
+def jpeg_with_exif(date_time, payload):
+    """
+    Returns a JPEG with an APP1 EXIF segment, followed by payload as image data.
+    """
+    app1 = b"Exif\0\0" + tiff_with_date(date_time)
+    return (b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1
+            + b"\xff\xdb\x00\x04\x00\x00" + payload + b"\xff\xd9")
+
+def raw_with_exif(date_time, payload):
+    return tiff_with_date(date_time) + payload
+
+def write_file(path, data, stats):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    stats["files"] += 1
+    stats["bytes"] += len(data)
+
+def random_date_time(rng):
+    year = rng.randint(*DATE_RANGE)
+    return "%04d:%02d:%02d %02d:%02d:%02d" % (year, rng.randint(1, 12), rng.randint(1, 28),
+                                              rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+
+def generate_volume(volume_dir, rng, stats, jpegs, jpeg_size, raws, raw_size, xmp_fraction):
+    """
+    Writes photos of one volume in <year>/<date>/ directories.
+    """
+    raw_indices = set(rng.sample(range(jpegs), min(raws, jpegs)))
+    date_time = random_date_time(rng)
+    for i in range(jpegs):
+        if i % PHOTOS_PER_DAY == 0:
+            date_time = random_date_time(rng)
+            day_dir = os.path.join(volume_dir, date_time[:4], date_time[:10].replace(":", "-"))
+            if rng.random() < 0.5:
+                write_file(os.path.join(day_dir, rng.choice(GARBAGE_FILES)), rng.randbytes(1024), stats)
+        name = os.path.join(day_dir, "DSC_%05d" % i)
+        write_file(name + ".JPG", jpeg_with_exif(date_time, rng.randbytes(jpeg_size)), stats)
+        if i in raw_indices:
+            write_file(name + ".NEF", raw_with_exif(date_time, rng.randbytes(raw_size)), stats)
+        if rng.random() < xmp_fraction:
+            write_file(name + ".xmp", (XMP_TEMPLATE % date_time).encode("utf-8"), stats)
+
+def generate_lightroom_catalog(catalog_dir, rng, stats, previews=200):
+    """
+    Writes a Lightroom catalog: the .lrcat database and the nested previews directory.
+    """
+    write_file(os.path.join(catalog_dir, "Catalog.lrcat"), rng.randbytes(4 * 1024 * 1024), stats)
+    previews_dir = os.path.join(catalog_dir, "Catalog Previews.lrdata")
+    for i in range(previews):
+        uuid = "%032x" % rng.getrandbits(128)
+        write_file(os.path.join(previews_dir, uuid[0], uuid[:4], uuid + ".lrprev"), rng.randbytes(16 * 1024), stats)
+
+def generate_deep_tree(root_dir, rng, stats, depth, files_per_dir=2):
+    path = root_dir
+    for level in range(depth):
+        path = os.path.join(path, "level_%02d" % level)
+        for i in range(files_per_dir):
+            write_file(os.path.join(path, "note_%d.txt" % i), rng.randbytes(512), stats)
+
+def generate_archive(archive_root, volumes=2, jpegs=500, jpeg_size=64 * 1024, raws=20, raw_size=8 * 1024 * 1024,
+                     xmp_fraction=0.3, catalogs=1, depth=32, seed=0):
+    """
+    Generates the archive. Returns {"files": number of files, "bytes": total size}.
+    """
+    rng = random.Random(seed)
+    stats = {"files": 0, "bytes": 0}
+    for v in range(volumes):
+        volume_dir = os.path.join(archive_root, VOLUME_NAME % v)
+        generate_volume(volume_dir, rng, stats, jpegs, jpeg_size, raws, raw_size, xmp_fraction)
+        if v < catalogs:
+            generate_lightroom_catalog(os.path.join(volume_dir, "Lightroom"), rng, stats)
+        if v == 0:
+            generate_deep_tree(os.path.join(volume_dir, "deep"), rng, stats, depth)
+    return stats
+
+def add_arguments(parser):
+    parser.add_argument("--volumes", type=int, default=2, help="number of volumes")
+    parser.add_argument("--jpegs", type=int, default=500, help="number of JPEGs per volume")
+    parser.add_argument("--jpeg-kb", type=int, default=64, help="size of JPEG image data in KiB")
+    parser.add_argument("--raws", type=int, default=20, help="number of RAW files per volume")
+    parser.add_argument("--raw-mb", type=int, default=8, help="size of RAW files in MiB")
+    parser.add_argument("--xmp-fraction", type=float, default=0.3, help="fraction of photos with XMP sidecar")
+    parser.add_argument("--catalogs", type=int, default=1, help="number of volumes with a Lightroom catalog")
+    parser.add_argument("--depth", type=int, default=32, help="depth of the deep directory tree")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+
+def generate_archive_from_args(archive_root, args):
+    return generate_archive(archive_root, args.volumes, args.jpegs, args.jpeg_kb * 1024, args.raws,
+                            args.raw_mb * 1024 * 1024, args.xmp_fraction, args.catalogs, args.depth, args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic photo archive.")
+    parser.add_argument("archive_root", help="directory to create the archive in")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    stats = generate_archive_from_args(args.archive_root, args)
+    print("Generated [%d] files, [%d] bytes in [%s]" % (stats["files"], stats["bytes"], args.archive_root))
@@ -0,0 +1,196 @@
+"""Compact binary manifests, searched in place through a memory map.
+
+A text manifest has to be parsed completely before a single path can be looked
+up. A binary manifest is sorted when it is written, so lookups by path or by
+digest are binary searches over the mapped file: only the few pages touched by
+the search are read, and no Python objects are created for the other entries.
+
+Layout, with little-endian integers:
+
+- Header: magic `CHKSUMB1`, algorithm name (16 bytes, NUL padded), digest
+  size (u32), number of entries (u64).
+- Path table: one row per entry, sorted by path (UTF-8 bytes), with the
+  offset (u64) and length (u64) of the path in the string table and the raw
+  digest.
+- Digest table: one row per entry, sorted by digest, with the raw digest and
+  the index (u64) of the row in the path table.
+- String table: paths, UTF-8 encoded, one after the other.
+"""
+import mmap
+import bisect
+import struct
+from typing import Iterable, Iterator, Optional
+from .checksums import get_algorithm_from_str
+
+MAGIC = b"CHKSUMB1"
+_HEADER = struct.Struct("<8s16sIQ")
+_PATH_ROW = struct.Struct("<QQ")  # followed by the digest
+_DIGEST_ROW = struct.Struct("<Q")  # preceded by the digest
+
+
+def is_binary_manifest(filepath: str) -> bool:
+    """Returns whether file at path is a binary manifest."""
+    with open(filepath, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_binary_manifest(entries: Iterable[tuple[str, str]], filepath: str,
+                          algorithm: str) -> int:
+    """Writes a binary manifest.
+
+    Entries are sorted in memory as compact tuples of bytes, so the text
+    manifest does not need to be loaded as dictionaries.
+
+    Args:
+        entries: tuples `(path, hash)` with hex hashes, e.g., from
+            `diff.iter_entries`. For a path listed twice the last hash wins.
+        filepath: path to the binary manifest to write.
+        algorithm: name of the hashing algorithm, e.g., from
+            `diff.read_algorithm`. Digest sizes are not enough to tell
+            algorithms apart, e.g., sha256 and blake2b-tree.
+
+    Returns:
+        Number of entries written.
+
+    Raises:
+        ValueError: if hashes have different sizes, or a size other than
+            the one of the algorithm.
+        NotImplementedError: if the algorithm is unknown.
+    """
+    expected_size = get_algorithm_from_str(algorithm)().digest_size
+
+    by_path = {}
+    for path, hash in entries:
+        by_path[path.encode("utf-8")] = bytes.fromhex(hash)
+    rows = sorted(by_path.items())
+    del by_path
+
+    digest_sizes = {len(digest) for path, digest in rows}
+    if len(digest_sizes) > 1:
+        msg = f"Hashes of different sizes: {sorted(digest_sizes)}."
+        raise ValueError(msg)
+    digest_size = digest_sizes.pop() if digest_sizes else expected_size
+    if digest_size != expected_size:
+        msg = (f"Hashes of {digest_size:d} bytes are not {algorithm:s} "
+               f"hashes, which have {expected_size:d} bytes.")
+        raise ValueError(msg)
+
+    digest_order = sorted(range(len(rows)), key=lambda i: rows[i][1])
+    with open(filepath, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, algorithm.lower().encode("ascii"),
+                             digest_size, len(rows)))
+        offset = 0
+        for path, digest in rows:
+            f.write(_PATH_ROW.pack(offset, len(path)) + digest)
+            offset += len(path)
+        for i in digest_order:
+            f.write(rows[i][1] + _DIGEST_ROW.pack(i))
+        for path, digest in rows:
+            f.write(path)
+    return len(rows)
+
+
+class _Column:
+    """Read-only sequence of the keys of a table, for `bisect`."""
+
+    def __init__(self, get, length: int) -> None:
+        self._get = get
+        self._length = length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, i: int) -> bytes:
+        return self._get(i)
+
+
+class BinaryManifest:
+    """Memory-mapped binary manifest.
+
+    Use it as a context manager, or call `close` when done.
+
+    Args:
+        filepath: path to a manifest written by `write_binary_manifest`.
+    """
+
+    def __init__(self, filepath: str) -> None:
+        self.filepath = filepath
+        with open(filepath, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, algorithm, digest_size, n_entries = _HEADER.unpack_from(
+            self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{filepath:s} is not a binary manifest.")
+        self.algorithm = algorithm.rstrip(b"\0").decode("ascii")
+        self.digest_size = digest_size
+        self._n_entries = n_entries
+        self._path_row_size = _PATH_ROW.size + digest_size
+        self._digest_row_size = digest_size + _DIGEST_ROW.size
+        self._path_table = _HEADER.size
+        self._digest_table = (self._path_table +
+                              n_entries * self._path_row_size)
+        self._string_table = (self._digest_table +
+                              n_entries * self._digest_row_size)
+
+    def __len__(self) -> int:
+        return self._n_entries
+
+    def _path_row(self, i: int) -> tuple[bytes, bytes]:
+        """Returns path and digest of the i-th row of the path table."""
+        row = self._path_table + i * self._path_row_size
+        offset, length = _PATH_ROW.unpack_from(self._map, row)
+        start = self._string_table + offset
+        digest_start = row + _PATH_ROW.size
+        return (self._map[start:start + length],
+                self._map[digest_start:digest_start + self.digest_size])
+
+    def _digest_row(self, i: int) -> bytes:
+        """Returns digest of the i-th row of the digest table."""
+        row = self._digest_table + i * self._digest_row_size
+        return self._map[row:row + self.digest_size]
+
+    def get(self, path: str) -> Optional[str]:
+        """Returns hex hash of the file at path, or None if it is not listed."""
+        key = path.encode("utf-8")
+        paths = _Column(lambda i: self._path_row(i)[0], len(self))
+        i = bisect.bisect_left(paths, key)
+        if i < len(self):
+            row_path, digest = self._path_row(i)
+            if row_path == key:
+                return digest.hex()
+        return None
+
+    def __contains__(self, path: str) -> bool:
+        return self.get(path) is not None
+
+    def find(self, hash: str) -> list[str]:
+        """Returns paths of all files with the given hex hash."""
+        key = bytes.fromhex(hash)
+        if len(key) != self.digest_size:
+            return []
+        digests = _Column(self._digest_row, len(self))
+        paths = []
+        i = bisect.bisect_left(digests, key)
+        while i < len(self) and self._digest_row(i) == key:
+            row = (self._digest_table + i * self._digest_row_size +
+                   self.digest_size)
+            path_index, = _DIGEST_ROW.unpack_from(self._map, row)
+            paths.append(self._path_row(path_index)[0].decode("utf-8"))
+            i += 1
+        return sorted(paths)
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        """Iterates over tuples `(path, hash)` sorted by path."""
+        for i in range(len(self)):
+            path, digest = self._path_row(i)
+            yield path.decode("utf-8"), digest.hex()
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self) -> "BinaryManifest":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,158 @@
+"""Persistent cache of file hashes.
+
+Hashes are stored in an SQLite database together with the stat signature of
+the file they were computed for: device, inode, size and modification time.
+A file whose signature has not changed is answered from the cache without
+being read.
+
+The cache is shared by `checksums` and `get_hash.py`, which spell algorithm
+names differently, e.g., `blake2b-tree` and `BLAKE2B_TREE`. Names are
+normalized with `normalize_algorithm`, so both tools reuse each other's
+entries.
+"""
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+# Number of new entries after which pending changes are committed to disk
+COMMIT_INTERVAL = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    algorithm TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (device, inode, algorithm)
+);
+CREATE INDEX IF NOT EXISTS hashes_path ON hashes (path);
+"""
+
+
+def normalize_algorithm(algorithm: str) -> str:
+    """Returns the name of an algorithm as used by `checksums`, e.g.,
+    `blake2b-tree` for `BLAKE2B_TREE`."""
+    return algorithm.lower().replace("_", "-")
+
+
+class HashCache:
+    """On-disk cache of file hashes keyed on stat metadata and algorithm.
+
+    The cache may be shared between threads. Use it as a context manager, or
+    call `close` when done, so that pending entries are committed.
+
+    Args:
+        filepath: path to the SQLite database, created if it does not exist.
+        rebuild: drop all cached entries and ignore them for lookups, so that
+            every file is hashed again and the cache is repopulated.
+    """
+
+    def __init__(self, filepath: str, rebuild: bool = False) -> None:
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        self._n_pending = 0
+        self._connection = sqlite3.connect(filepath, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+        if rebuild:
+            self._connection.execute("DELETE FROM hashes")
+            self._connection.commit()
+
+    def get(self, filepath: str, algorithm: str,
+            stat: os.stat_result = None) -> Optional[str]:
+        """Returns cached hash of a file, if the file has not changed.
+
+        Args:
+            filepath: path to the file.
+            algorithm: name of the algorithm, e.g., md5 or sha512.
+            stat: result of `os.stat` for the file, taken if not provided.
+
+        Returns:
+            Hex value of hash or None if it is not in the cache.
+        """
+        if stat is None:
+            stat = os.stat(filepath)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, digest FROM hashes "
+                "WHERE device = ? AND inode = ? AND algorithm = ?",
+                (stat.st_dev, stat.st_ino, normalize_algorithm(algorithm))
+            ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, digest = row
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return None
+        return digest
+
+    def put(self, filepath: str, algorithm: str, digest: str,
+            stat: os.stat_result = None) -> None:
+        """Stores hash of a file.
+
+        Args:
+            filepath: path to the file.
+            algorithm: name of the algorithm, e.g., md5 or sha512.
+            digest: hex value of hash.
+            stat: result of `os.stat` taken before the file was read, so that
+                a file modified while being hashed is not cached as unchanged.
+        """
+        if stat is None:
+            stat = os.stat(filepath)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (stat.st_dev, stat.st_ino, normalize_algorithm(algorithm),
+                 stat.st_size, stat.st_mtime_ns, os.path.abspath(filepath),
+                 digest))
+            self._n_pending += 1
+            if self._n_pending >= COMMIT_INTERVAL:
+                self._connection.commit()
+                self._n_pending = 0
+
+    def evict_missing(self) -> int:
+        """Removes entries for files that no longer exist.
+
+        Entries whose path now refers to a different file are removed too.
+
+        Returns:
+            Number of removed entries.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT device, inode, path FROM hashes").fetchall()
+        stale = []
+        for device, inode, path in rows:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stale.append((device, inode))
+                continue
+            if (stat.st_dev, stat.st_ino) != (device, inode):
+                stale.append((device, inode))
+
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM hashes WHERE device = ? AND inode = ?", stale)
+            self._connection.commit()
+            self._n_pending = 0
+        return len(stale)
+
+    def commit(self) -> None:
+        """Writes pending entries to disk."""
+        with self._lock:
+            self._connection.commit()
+            self._n_pending = 0
+
+    def close(self) -> None:
+        """Commits pending entries and closes the database."""
+        self.commit()
+        self._connection.close()
+
+    def __enter__(self) -> "HashCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,25 +1,39 @@
 #!/usr/bin/env python
 import os
-import glob
+import stat as stat_module
 import hashlib
+import random
 import logging
 import datetime
-from tqdm import tqdm
-from typing import Callable
+from collections import deque
+from concurrent.futures import (ThreadPoolExecutor, FIRST_COMPLETED,
+                                as_completed, wait)
+from typing import Callable, Iterable, Iterator, Optional, TextIO, Union
+from .cache import HashCache
+from .discovery import iter_files
+from .reader import Prefetcher, update_hashes
+from .stats import get_stats, phase, timed_iter
+from .tree import TreeHash, chunk_ranges, find_damaged_chunks, is_tree_algorithm
 
-BLOCK_SIZE = 8192
+BLOCK_SIZE = None  # read block size in bytes, None to adapt to file size
+
+# Prefix of comment lines with file metadata, ignored by `sha512sum --check`
+STAT_PREFIX = "#:"
 
 
 def get_algorithm_from_str(algorithm: str) -> Callable:
     """Returns function hashlib based on hash algorithm name.
     
     Args:
-        algorithm: name of the algorithm, e.g., md5 or sha512.
+        algorithm: name of the algorithm, e.g., md5, sha512 or blake2b-tree
+            (see `tree`).
 
     Returns:
         Function that computes hash.
     """
-    if algorithm.lower() == "md5":
+    if is_tree_algorithm(algorithm):
+        return TreeHash
+    elif algorithm.lower() == "md5":
         return hashlib.md5
     elif algorithm.lower() == "sha1":
         return hashlib.sha1
@@ -32,73 +46,250 @@ def get_algorithm_from_str(algorithm: str) -> Callable:
         raise NotImplementedError(msg)
 
 
-def compute_file_hash(filepath: str, algorithm: Callable) -> str:
+def get_algorithms_from_str(algorithms: str) -> list[Callable]:
+    """Returns hashlib functions for a comma-separated list of algorithm names.
+
+    Args:
+        algorithms: names of the algorithms, e.g., md5,sha256,sha512.
+
+    Returns:
+        Functions that compute hash, without duplicates, in the given order.
+    """
+    names = [name.strip().lower() for name in algorithms.split(",")]
+    names = list(dict.fromkeys(name for name in names if name))
+    if not names:
+        raise ValueError("No algorithm specified.")
+    return [get_algorithm_from_str(name) for name in names]
+
+
+def compute_file_hashes(filepath: str, algorithms: list[Callable],
+                        cache: HashCache = None,
+                        stat: os.stat_result = None,
+                        chunk_records: dict = None,
+                        blocks: Iterable[memoryview] = None
+                        ) -> dict[str, str]:
+    """Computes hashes of a single file with several algorithms at once.
+
+    The file is read once and each block is fed to all hash objects.
+    
+    Args:
+        filepath: path of a file for which to compute hashes.
+        algorithms: functions that compute hash.
+        cache: hash cache consulted before reading the file and updated after.
+        stat: `os.stat` of the file if already known, to save a system call.
+        chunk_records: if given, filled with sidecar records of tree hashes
+            (see `tree.TreeHash.record`) by algorithm name. Tree hashes are
+            then always computed, as the cache has no chunk digests.
+        blocks: blocks of the file if already being read, e.g. by a
+            `reader.Prefetcher`.
+
+    Returns:
+        Hex values of hashes by algorithm name, e.g., `{"md5": ...}`.
+    """
+    if stat is None:
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            raise ValueError(f"{filepath:s} does not exist.")
+    if stat_module.S_ISDIR(stat.st_mode):
+        raise ValueError(f"{filepath:s} is a directory.")
+
+    hashes = [algorithm() for algorithm in algorithms]
+    names = [hash.name for hash in hashes]
+    digests = {}
+    if cache is not None:
+        with phase("cache"):
+            for hash in hashes:
+                if chunk_records is not None and isinstance(hash, TreeHash):
+                    continue
+                digest = cache.get(filepath, hash.name, stat)
+                if digest is not None:
+                    digests[hash.name] = digest
+        hashes = [hash for hash in hashes if hash.name not in digests]
+        stats = get_stats()
+        if stats is not None:
+            stats.count("cache_hits" if not hashes else "cache_misses")
+
+    if hashes:
+        update_hashes(filepath, hashes, BLOCK_SIZE, blocks)
+
+    for hash in hashes:
+        digests[hash.name] = hash.hexdigest()
+        if cache is not None:
+            with phase("cache"):
+                cache.put(filepath, hash.name, digests[hash.name], stat)
+        if chunk_records is not None and isinstance(hash, TreeHash):
+            chunk_records[hash.name] = hash.record(filepath)
+
+    return {name: digests[name] for name in names}
+
+
+def compute_file_hash(filepath: str, algorithm: Callable,
+                      cache: HashCache = None,
+                      stat: os.stat_result = None,
+                      blocks: Iterable[memoryview] = None) -> str:
     """Computes hash of a single file.
     
     Args:
         filepath: path of a file for which to compute hash.
         algorithm: function that computes hash.
+        cache: hash cache consulted before reading the file and updated after.
+        stat: `os.stat` of the file if already known, to save a system call.
+        blocks: blocks of the file if already being read.
 
     Returns:
         Hex value of hash.
     """
-    if not os.path.exists(filepath):
-        raise ValueError(f"{filepath:s} does not exist.")
-    if os.path.isdir(filepath):
-        raise ValueError(f"{filepath:s} is a directory.")
+    digests = compute_file_hashes(filepath, [algorithm], cache, stat,
+                                  blocks=blocks)
+    return next(iter(digests.values()))
 
-    assert os.path.isfile(filepath)
 
-    hash = algorithm()
-    with open(filepath, "rb") as f:
-        while (block := f.read(BLOCK_SIZE)):
-            hash.update(block)
+def _compute_hashes_if_file(filepath: str, algorithms: list[Callable],
+                            cache: HashCache = None,
+                            chunks: bool = False
+                            ) -> Union[tuple, OSError, None]:
+    """Computes hashes of a file or returns None for anything else.
 
-    return hash.hexdigest()
+    Returns:
+        Tuple of hashes by algorithm name, `os.stat` of the file taken
+        before it was read and sidecar records of tree hashes (None without
+        `chunks`), the error if the file cannot be read, or None.
+    """
+    try:
+        with phase("stat"):
+            stat = os.stat(filepath)
+        if not stat_module.S_ISREG(stat.st_mode):
+            return None
+        chunk_records = {} if chunks else None
+        digests = compute_file_hashes(filepath, algorithms, cache, stat,
+                                      chunk_records)
+    except FileNotFoundError:
+        return None  # removed since it was found
+    except OSError as e:
+        return e
+    return digests, stat, chunk_records
+
+
+def _iter_prefetched_hashes(filepaths: Iterable[str],
+                            algorithms: list[Callable],
+                            chunks: bool = False) -> Iterator[tuple]:
+    """Hashes files one at a time, reading the next blocks and the next file
+    on a background thread meanwhile.
+
+    Yields:
+        Tuples of path and result of `_compute_hashes_if_file`.
+    """
+    with Prefetcher(filepaths, BLOCK_SIZE) as prefetcher:
+        for filepath, stat, blocks in prefetcher:
+            if stat is None:
+                try:
+                    for _ in blocks:  # raises the error of opening the file
+                        pass
+                except (FileNotFoundError, IsADirectoryError):
+                    yield filepath, None  # removed, or not a file
+                except OSError as e:
+                    yield filepath, e
+                else:
+                    yield filepath, None
+                continue
+            if not stat_module.S_ISREG(stat.st_mode):
+                yield filepath, None
+                continue
+            chunk_records = {} if chunks else None
+            try:
+                digests = compute_file_hashes(filepath, algorithms, None,
+                                              stat, chunk_records, blocks)
+            except OSError as e:
+                yield filepath, e
+                continue
+            yield filepath, (digests, stat, chunk_records)
+
+
+def find_files(glob_patterns: list[str],
+               recursive: bool = False,
+               logger: logging.Logger = None) -> list[str]:
+    """Finds files matching any of the patterns, walking the tree once.
+
+    Args:
+        glob_patterns: glob patterns to match.
+        recursive: whether to match patterns recursively.
+        logger: logger instance.
+
+    Returns:
+        Sorted paths without duplicates.
+    """
+    filepaths = sorted(iter_files(glob_patterns, recursive))
+    if logger:
+        n_files = len(filepaths)
+        logger.debug(f"Total number of files for computing hash: {n_files:d}.")
+
+    return filepaths
 
 
 def compute_hashes(glob_patterns: list[str],
                    recursive: bool = False,
                    algorithm: str = "sha512",
-                   logger: logging.Logger = None) -> list[dict[str, str]]:
+                   logger: logging.Logger = None,
+                   jobs: int = 1,
+                   cache: HashCache = None,
+                   chunks: bool = False) -> list[dict[str, str]]:
     """Computes hashes for all files matching pattern.
     
     Args:
         glob_pattern: compute hash for files matching this pattern.
         recursive: whether to match pattern recursively.
-        algorithm: name of the algorithm, e.g., md5 or sha512.
+        algorithm: name of the algorithm, e.g., md5 or sha512, or several
+            comma-separated names, e.g., md5,sha512, computed in one pass.
         logger: logger instance.
+        jobs: number of files hashed concurrently. hashlib releases the GIL
+            while hashing, so threads scale with the number of cores. With
+            one job and no cache, the next file is read while the current
+            one is hashed.
+        cache: hash cache, so that unchanged files are not read again.
+        chunks: whether to keep chunk digests of blake2b-tree hashes.
 
     Returns:
-        Hash values, of the form `[{"filepath": ..., "hash":, ...}, ...]`.
+        Hash values, of the form
+        `[{"filepath": ..., "hash": ..., "hashes": {"md5": ..., ...},
+        "size": ..., "mtime_ns": ...}, ...]`, where "hash" is the value for
+        the first algorithm and size and modification time are from before
+        the file was read. With `chunks`, entries also have a "chunks" key
+        with the sidecar record of the tree hash.
     """
-    # Get filepaths of matching files and directories
-    filepaths = []
-    for glob_pattern in glob_patterns:
-        filepath_matches = glob.glob(glob_pattern, recursive=recursive)
-
-        if logger:
-            n_files = len(filepath_matches)
-            msg = (f"Added {n_files:d} files matching '{glob_pattern:s}'" +
-                " recursively." if recursive else ".")
-            logger.debug(msg)
-
-        filepaths.extend(filepath_matches)
-    filepaths = sorted(list(set(filepaths)))
-    if logger:
-        n_files = len(filepaths)
-        logger.debug(f"Total number of files for computing hash: {n_files:d}.")
-   
-
-    # Infer algorithm
-    algorithm = get_algorithm_from_str(algorithm)
+    # Infer algorithms
+    algorithms = get_algorithms_from_str(algorithm)
+
+    # Hash files as they are found, so that hashing overlaps the traversal
+    filepaths = timed_iter(iter_files(glob_patterns, recursive), "walk")
+    if jobs > 1:
+        file_hashes = _imap_unordered(
+            lambda filepath: (filepath, _compute_hashes_if_file(
+                filepath, algorithms, cache, chunks)),
+            filepaths, jobs)
+    elif cache is None:
+        file_hashes = _iter_prefetched_hashes(filepaths, algorithms, chunks)
+    else:
+        file_hashes = ((filepath, _compute_hashes_if_file(
+                            filepath, algorithms, cache, chunks))
+                       for filepath in filepaths)
+    from tqdm import tqdm  # imported here, it is slow to import
+    file_hashes = sorted(tqdm(file_hashes), key=lambda item: item[0])
 
-    # Compute hashes for files, skipping directories
+    # Collect results in the sorted order of file paths
     hashes = []
-    for filepath in tqdm(filepaths):
-        if os.path.isfile(filepath):
-            hash = compute_file_hash(filepath, algorithm)
-            hashes.append({"filepath": filepath, "hash": hash})
+    for filepath, result in file_hashes:
+        if isinstance(result, OSError):
+            if logger:
+                logger.warning(f"{filepath:s}: cannot be read: {result}")
+        elif result is not None:
+            digests, stat, chunk_records = result
+            hash = next(iter(digests.values()))
+            hashes.append({"filepath": filepath, "hash": hash,
+                           "hashes": digests, "size": stat.st_size,
+                           "mtime_ns": stat.st_mtime_ns})
+            if chunk_records:
+                hashes[-1]["chunks"] = next(iter(chunk_records.values()))
 
             if logger:
                 logger.debug(f"{filepath:s}: {hash:s}")
@@ -111,25 +302,87 @@ def compute_hashes(glob_patterns: list[str],
 
 def print_hashes(hashes: list[dict[str, str]], algorithm: str,
                  glob_pattern: str, recursive: bool,
-                 logger: logging.Logger) -> None:
+                 logger: logging.Logger,
+                 output: TextIO = None,
+                 with_stat: bool = False) -> None:
     """Writes hashes along with some metadata to file.
     
     Args:
+        hashes: hash values returned by `compute_hashes`.
+        algorithm: name of the algorithm whose hashes are written.
+        glob_pattern: glob pattern(s) used to find files.
+        recursive: whether pattern was matched recursively.
+        logger: logger instance.
+        output: file to write to, standard output by default.
+        with_stat: whether to precede each hash with a comment line with size
+            and modification time of the file, e.g.,
+            `#: size=1024 mtime_ns=1700000000000000000`. The file stays
+            readable by `sha512sum --check`, which skips comments.
     """
     local_time = str(datetime.datetime.now())
     utc_time = str(datetime.datetime.utcnow())
-    print(f"# Generated on (local time): {local_time:s}")
-    print(f"# Generated on (UTC):        {utc_time:s}")
-    print(f"# Algorithm used:            {algorithm:s}")
-    print(f"# Working directory:         {os.getcwd():s}")
-    print(f"# Glob pattern:              {glob_pattern:s}")
-    print(f"# Recursive:                 {str(recursive):s}")
+    print(f"# Generated on (local time): {local_time:s}", file=output)
+    print(f"# Generated on (UTC):        {utc_time:s}", file=output)
+    print(f"# Algorithm used:            {algorithm:s}", file=output)
+    print(f"# Working directory:         {os.getcwd():s}", file=output)
+    print(f"# Glob pattern:              {glob_pattern:s}", file=output)
+    print(f"# Recursive:                 {str(recursive):s}", file=output)
 
     # Write to output file
-    for file in hashes:
-        path = os.path.normpath(file["filepath"])
-        hash = file["hash"]
-        print(f"{hash:s}  {path:s}")
+    with phase("write"):
+        for file in hashes:
+            path = os.path.normpath(file["filepath"])
+            if "hashes" in file:
+                hash = file["hashes"][algorithm.lower()]
+            else:
+                hash = file["hash"]
+            if with_stat and "size" in file:
+                print(f"{STAT_PREFIX:s} size={file['size']:d} "
+                      f"mtime_ns={file['mtime_ns']:d}", file=output)
+            print(f"{hash:s}  {path:s}", file=output)
+
+
+def iter_hashes(filepath: str) -> Iterator[dict[str, str]]:
+    """Lazily reads hashes from file, one line at a time.
+
+    Args:
+        filepath: path to file with hashes.
+
+    Yields:
+        Files with their hashes, of the form `{"filepath": ..., "hash": ...}`.
+        Files preceded by a metadata line written by `print_hashes` also have
+        "size" and "mtime_ns" keys.
+    """
+    with open(filepath, "r") as f:
+        stat = None
+        for line in f:
+            # Strip return characters and skip empty and commented lines,
+            # keeping metadata for the next file
+            line = line.strip()
+            if line.startswith(STAT_PREFIX):
+                fields = dict(field.split("=", 1) for field in
+                              line[len(STAT_PREFIX):].split())
+                stat = {"size": int(fields["size"]),
+                        "mtime_ns": int(fields["mtime_ns"])}
+                continue
+            if not line or line[0] == "#":
+                continue
+
+            # Split line into hash and filename
+            fields = line.split(" ")
+            hash = {"hash": fields[0], "filepath": fields[-1]}
+
+            # Cover special cases:
+            # https://www.gnu.org/software/coreutils/manual/coreutils.html#md5sum-invocation
+            if hash["hash"][0] == "\\":
+                raise NotImplementedError()
+            if hash["filepath"] == "*":
+                raise NotImplementedError()
+
+            if stat is not None:
+                hash.update(stat)
+                stat = None
+            yield hash
 
 
 def read_hashes(filepath: str) -> list[dict[str, str]]:
@@ -141,28 +394,159 @@ def read_hashes(filepath: str) -> list[dict[str, str]]:
     Returns:
         List of files with their hashes.
     """
-    with open(filepath, "r") as f:
-        lines = f.readlines()
+    return list(iter_hashes(filepath))
 
-    # Strip return characters
-    lines = [line.strip() for line in lines]
 
-    # Filter out commented lines
-    lines = [line for line in lines if line[0] != "#"]
+def _imap_unordered(func: Callable, items: Iterable,
+                    jobs: int) -> Iterator:
+    """Applies function to items in a thread pool, yielding results as soon as
+    they are ready.
 
-    # Split line into hash and filename
-    hashes = [line.split(" ") for line in lines]
-    hashes = [{"hash": hash[0], "filepath": hash[-1]} for hash in hashes]
+    At most `2 * jobs` items are in flight, so items may come from a lazy
+    iterator of any length without being loaded into memory.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = set()
+        for item in items:
+            if len(pending) >= 2 * jobs:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(func, item))
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def _check_file_hash(file: dict[str, str], algorithm: Callable,
+                     logger: logging.Logger = None,
+                     quick: bool = False,
+                     chunk_record: dict = None,
+                     stat: os.stat_result = None,
+                     blocks: Iterable[memoryview] = None) -> dict:
+    """Checks hash of a single manifest entry.
+
+    With `quick`, a file with recorded size and modification time equal to
+    the current ones is reported as ok without being read. With the sidecar
+    record of a tree hash, chunks of a file that does not match are compared
+    with the recorded ones to locate the damage. `stat` and `blocks` are
+    given if the file is already being read by a `reader.Prefetcher`.
+    """
+    filepath = file["filepath"]
+    try:
+        if quick and "size" in file:
+            with phase("stat"):
+                stat = os.stat(filepath)
+            if (stat.st_size, stat.st_mtime_ns) == (file["size"],
+                                                    file["mtime_ns"]):
+                if logger:
+                    logger.debug(f"{filepath:s}: metadata matches.")
+                return {"filepath": filepath, "ok": True, "quick": True}
+        if chunk_record is not None and algorithm is TreeHash:
+            tree_hash = TreeHash(chunk_size=chunk_record["chunk_size"])
+            update_hashes(filepath, [tree_hash], BLOCK_SIZE, blocks)
+            current_hash = tree_hash.hexdigest()
+        else:
+            current_hash = compute_file_hash(filepath, algorithm, None, stat,
+                                             blocks)
+    except (OSError, ValueError) as e:
+        if logger:
+            logger.error(f"{filepath:s}: cannot be read: {e}")
+        return {"filepath": filepath, "ok": False, "error": str(e)}
 
-    # Cover special cases:
-    # https://www.gnu.org/software/coreutils/manual/coreutils.html#md5sum-invocation
-    for hash in hashes:
-        if hash["hash"][0] == "\\":
-            raise NotImplementedError()
-        if hash["filepath"] == "*":
-            raise NotImplementedError()
+    checksum_ok = file["hash"] == current_hash
 
-    return hashes
+    if logger:
+        if checksum_ok:
+            logger.debug(f"{filepath:s}: checksum matches.")
+        else:
+            logger.warning(f"{filepath:s}: checksum does not match.")
+
+    result = {"filepath": filepath, "ok": checksum_ok}
+    if not checksum_ok and chunk_record is not None and algorithm is TreeHash:
+        result["damaged_chunks"] = find_damaged_chunks(chunk_record,
+                                                       tree_hash)
+        result["chunk_size"] = chunk_record["chunk_size"]
+    return result
+
+
+def iter_check_hashes(hashes: Iterable[dict[str, str]],
+                      algorithm: str = "sha512",
+                      logger: logging.Logger = None,
+                      jobs: int = 1,
+                      quick: bool = False,
+                      sample: float = 0.0,
+                      seed: Optional[int] = None,
+                      chunk_records: dict[str, dict] = None
+                      ) -> Iterator[dict]:
+    """Checks whether hashsums from file match actual hashsums, yielding
+    results as they become available.
+
+    Args:
+        hashes: filepaths with corresponding hashes, may be a lazy iterator.
+        algorithm: name of the algorithm, e.g., md5 or sha512. Files of
+            hashes have one hash per file, so a single algorithm is checked.
+        logger: logger instance.
+        jobs: number of files checked concurrently. With more than one job,
+            results are yielded in the order of completion. With one job and
+            without `quick`, the next file is read while the current one is
+            hashed.
+        quick: only rehash files whose size or modification time differ from
+            the ones recorded by `print_hashes(..., with_stat=True)`, and
+            files without recorded metadata.
+        sample: with `quick`, fraction of files with matching metadata that
+            are rehashed anyway, chosen at random, to detect bit rot.
+        seed: seed of the random choice of the sample.
+        chunk_records: sidecar records of blake2b-tree hashes by normalized
+            file path, see `tree.load_sidecar`.
+
+    Yields:
+        Files and whether their hashes match, of the form
+        `{"filepath": ..., "ok": ...}`. Files that could not be read also
+        have an "error" key, files checked by metadata only a "quick" key.
+        Files that do not match their tree hash and have a sidecar record
+        also have "damaged_chunks" (indices) and "chunk_size" keys.
+
+    Raises:
+        ValueError: if several algorithms are given.
+    """
+    # Infer algorithm
+    if "," in algorithm:
+        raise ValueError(f"Cannot check {algorithm:s}, files of hashes have "
+                         "a single hash per file.")
+    algorithm = get_algorithm_from_str(algorithm)
+
+    # Choose files to rehash regardless of metadata in this thread, so that
+    # the sample does not depend on the order in which the checks finish
+    rng = random.Random(seed)
+    chunk_records = chunk_records or {}
+    tasks = ((file, quick and rng.random() >= sample,
+              chunk_records.get(os.path.normpath(file["filepath"])))
+             for file in timed_iter(hashes, "manifest"))
+
+    if jobs > 1:
+        yield from _imap_unordered(
+            lambda task: _check_file_hash(task[0], algorithm, logger,
+                                          task[1], task[2]),
+            tasks, jobs)
+    elif not quick:
+        # The prefetching thread takes tasks from the manifest and queues
+        # them in the order in which it reads their files
+        pending = deque()
+
+        def iter_filepaths():
+            for task in tasks:
+                pending.append(task)
+                yield task[0]["filepath"]
+
+        with Prefetcher(iter_filepaths(), BLOCK_SIZE) as prefetcher:
+            for filepath, stat, blocks in prefetcher:
+                file, file_quick, chunk_record = pending.popleft()
+                yield _check_file_hash(file, algorithm, logger, file_quick,
+                                       chunk_record, stat, blocks)
+    else:
+        for file, file_quick, chunk_record in tasks:
+            yield _check_file_hash(file, algorithm, logger, file_quick,
+                                   chunk_record)
 
 
 def check_hashes(hashes: list[dict[str, str]],
@@ -178,26 +562,57 @@ def check_hashes(hashes: list[dict[str, str]],
     Returns:
         List of files and whether their hashes match.
     """
-    # Infer algorithm
-    algorithm = get_algorithm_from_str(algorithm)
+    return list(iter_check_hashes(hashes, algorithm, logger))
 
-    # Create report
-    check_results = []
-    for file in hashes:
-        filepath = file["filepath"]
-        old_hash = file["hash"]
-        current_hash = compute_file_hash(filepath, algorithm)
 
-        checksum_ok = old_hash == current_hash
+def print_check_results(check_results: Iterable[dict]) -> bool:
+    """Prints check results line by line as they arrive, followed by summary.
 
-        if logger:
-            if checksum_ok:
-                logger.info(f"{filepath:s}: checksum matches.")
-            else:
-                logger.warning(f"{filepath:s}: checksum does not match.")
+    The lines have the same format as `sha512sum --check`. Only counters are
+    kept, so memory use does not depend on the number of files.
+
+    Args:
+        check_results: results from `iter_check_hashes`.
 
-        check_results.append({"filepath": filepath, "ok": checksum_ok})
-    return check_results
+    Returns:
+        True if all files have matching hashes.
+    """
+    n_ok = 0
+    n_quick = 0
+    n_failed = 0
+    n_unreadable = 0
+    for file in check_results:
+        if file["ok"]:
+            n_ok += 1
+            n_quick += "quick" in file
+            status = "OK"
+        elif "error" in file:
+            n_unreadable += 1
+            status = "FAILED open or read"
+        else:
+            n_failed += 1
+            status = "FAILED"
+            if file.get("damaged_chunks"):
+                ranges = chunk_ranges(file["damaged_chunks"],
+                                      file["chunk_size"])
+                status += " at bytes " + ", ".join(
+                    f"{start:d}-{end:d}" for start, end in ranges)
+        print(f"{file['filepath']:s}: {status:s}", flush=True)
+
+    n_problems = n_failed + n_unreadable
+    n_files = n_ok + n_problems
+    print()
+    if n_problems == 0:
+        print(f"Summary: no problems found in {n_files:d} file(s).")
+    else:
+        print(f"Summary: found {n_problems:d} file(s) with problems out of "
+              f"{n_files:d}: {n_failed:d} with NOT matching hashes, "
+              f"{n_unreadable:d} could not be read.")
+    if n_quick > 0:
+        print(f"{n_quick:d} of {n_files:d} file(s) were checked by size and "
+              "modification time only.")
+
+    return n_problems == 0
 
 
 def gen_report(check_results) -> str:
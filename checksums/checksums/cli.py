@@ -1,6 +1,10 @@
+import os
+import sys
 import logging
 import click
-from .checksums import compute_hashes, print_hashes, read_hashes, check_hashes, gen_report
+
+# Each command imports the modules it uses, so that starting one command,
+# e.g. for a small batch, does not import the modules of all the others.
 
 
 def get_logger_level_from_str(level=None):
@@ -41,6 +45,48 @@ def get_logger_level_from_str(level=None):
         raise TypeError(msg)
 
 
+def setup_logger(log_level=None, log_file=None):
+    """Set up logger writing to standard error and optionally to a file.
+
+    Args:
+        log_level: logging level: ERROR, WARNING, etc.
+        log_file: path to log file.
+
+    Returns:
+        Logger instance.
+    """
+    format_str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(format=format_str)
+
+    logger = logging.getLogger("ComputeFileHashes")
+
+    if log_level:
+        log_level = get_logger_level_from_str(log_level)
+        logger.setLevel(log_level)
+
+    if log_file:
+        fh = logging.FileHandler(log_file)
+        fh.setFormatter(logging.Formatter(format_str))
+        logger.addHandler(fh)
+        fh.setLevel(logging.DEBUG)
+
+    return logger
+
+
+def open_cache(cache, rebuild_cache=False, no_cache=False, logger=None):
+    """Opens hash cache unless it is disabled.
+
+    Returns:
+        HashCache instance or None.
+    """
+    if not cache or no_cache:
+        return None
+    from .cache import HashCache
+    if logger:
+        logger.debug(f"Using hash cache {cache:s}.")
+    return HashCache(cache, rebuild=rebuild_cache)
+
+
 @click.group()
 def cli():
     return
@@ -51,14 +97,69 @@ def cli():
                 metavar="PATTERN1,PATTERN2",
                 type=click.STRING)
 @click.option("--algorithm",
-              metavar="NAME",
+              metavar="NAME1,NAME2",
               default="sha512",
               type=str,
-              help="Hashing algorithm to use.")
+              help="Hashing algorithm(s) to use: md5, sha1, sha256, sha512 or "
+                   "blake2b-tree. Several comma-separated algorithms are "
+                   "computed reading each file once.")
+@click.option("-o",
+              "--output-prefix",
+              metavar="PREFIX",
+              default=None,
+              type=str,
+              help="Write hashes to PREFIX.<algorithm> files instead of the "
+                   "standard output. Required for several algorithms.")
 @click.option("-r",
               "--recursive",
               is_flag=True,
               help="Traverse PATH recursively.")
+@click.option("-j",
+              "--jobs",
+              metavar="N",
+              default=1,
+              type=click.IntRange(min=1),
+              help="Number of files to hash concurrently.")
+@click.option("--with-stat",
+              is_flag=True,
+              help="Record size and modification time of each file in a "
+                   "comment line, for `check --quick`.")
+@click.option("--chunks",
+              "chunks_path",
+              metavar="PATH",
+              default=None,
+              type=str,
+              help="Write chunk digests of blake2b-tree hashes to an NDJSON "
+                   "sidecar, to locate damage with `check --chunks` and "
+                   "`verify-chunks`.")
+@click.option("--cache",
+              metavar="PATH",
+              default=None,
+              type=str,
+              envvar="CHECKSUMS_CACHE",
+              help="Hash cache database, reused for files that did not "
+                   "change since they were hashed. Defaults to "
+                   "$CHECKSUMS_CACHE.")
+@click.option("--rebuild-cache",
+              is_flag=True,
+              help="Drop all cached hashes and hash every file again.")
+@click.option("--no-cache",
+              is_flag=True,
+              help="Do not use the hash cache, even if $CHECKSUMS_CACHE is set.")
+@click.option("--stats",
+              "stats_path",
+              metavar="PATH",
+              default=None,
+              type=str,
+              help="Write run statistics to a JSON file: throughput, time "
+                   "per phase (walk, stat, read, digest, write) and the "
+                   "slowest files.")
+@click.option("--profile",
+              metavar="PATH",
+              default=None,
+              type=str,
+              help="Profile the run with cProfile and save the statistics "
+                   "to PATH, e.g. for `python -m pstats PATH`.")
 @click.option("--log-level",
               metavar="LEVEL",
               default="info",
@@ -69,23 +170,26 @@ def cli():
               default=None,
               type=str,
               help="Path to log file.")
-def compute(glob_patterns, algorithm, recursive, log_level, log_file):
+def compute(glob_patterns, algorithm, output_prefix, recursive, jobs,
+            with_stat, chunks_path, cache, rebuild_cache, no_cache,
+            stats_path, profile, log_level, log_file):
     """Computes hashes for all files matching a pattern."""
-    # Set up logger
-    format_str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    logging.basicConfig(format=format_str)
-
-    logger = logging.getLogger("ComputeFileHashes")
+    from .stats import profiled, stats_to_json
+    from .tree import TREE_ALGORITHM, open_sidecar
+    from .checksums import (get_algorithms_from_str, compute_hashes,
+                            print_hashes)
 
-    if log_level:
-        log_level = get_logger_level_from_str(log_level)
-        logger.setLevel(log_level)
+    # Set up logger
+    logger = setup_logger(log_level, log_file)
 
-    if log_file:
-        fh = logging.FileHandler(log_file)
-        fh.setFormatter(logging.Formatter(format_str))
-        logger.addHandler(fh)
-        fh.setLevel(logging.DEBUG)
+    # Split algorithms
+    algorithms = [hash().name for hash in get_algorithms_from_str(algorithm)]
+    if len(algorithms) > 1 and output_prefix is None:
+        msg = "--output-prefix is required for several algorithms."
+        raise click.UsageError(msg)
+    if chunks_path is not None and TREE_ALGORITHM not in algorithms:
+        msg = f"--chunks requires the {TREE_ALGORITHM:s} algorithm."
+        raise click.UsageError(msg)
 
     # Split glob patterns
     glob_patterns_str = glob_patterns
@@ -94,11 +198,38 @@ def compute(glob_patterns, algorithm, recursive, log_level, log_file):
         logger.info(f"Interpreting {glob_patterns_str:s} as " +
                     f"{len(glob_patterns):d} different glob patterns.")
 
-    # Compute hashes
-    hashes = compute_hashes(glob_patterns, recursive, algorithm, logger)
+    with stats_to_json(stats_path), profiled(profile):
+        # Open hash cache
+        cache = open_cache(cache, rebuild_cache, no_cache, logger)
+
+        # Compute hashes
+        try:
+            hashes = compute_hashes(glob_patterns, recursive, algorithm,
+                                    logger, jobs, cache,
+                                    chunks_path is not None)
+        finally:
+            if cache is not None:
+                cache.close()
 
-    # Print hashes to standard output
-    print_hashes(hashes, algorithm, glob_patterns_str, recursive, logger)
+        # Save chunk digests
+        if chunks_path is not None:
+            logger.info(f"Writing chunk digests to {chunks_path:s}.")
+            with open_sidecar(chunks_path) as sidecar:
+                for file in hashes:
+                    if "chunks" in file:
+                        sidecar.write(file["chunks"])
+
+        # Print hashes to standard output or one file per algorithm
+        if output_prefix is None:
+            print_hashes(hashes, algorithms[0], glob_patterns_str, recursive,
+                         logger, with_stat=with_stat)
+        else:
+            for name in algorithms:
+                output_path = f"{output_prefix:s}.{name:s}"
+                logger.info(f"Writing {name:s} hashes to {output_path:s}.")
+                with open(output_path, "w") as output:
+                    print_hashes(hashes, name, glob_patterns_str, recursive,
+                                 logger, output, with_stat)
 
 
 @click.command()
@@ -107,7 +238,50 @@ def compute(glob_patterns, algorithm, recursive, log_level, log_file):
               metavar="NAME",
               default="sha512",
               type=str,
-              help="Hashing algorithm to use.")
+              help="Hashing algorithm to use, a single one as files of "
+                   "hashes have one hash per file.")
+@click.option("-j",
+              "--jobs",
+              metavar="N",
+              default=1,
+              type=click.IntRange(min=1),
+              help="Number of files to check concurrently.")
+@click.option("--quick",
+              is_flag=True,
+              help="Only rehash files whose size or modification time "
+                   "changed since `compute --with-stat`.")
+@click.option("--sample",
+              metavar="FRACTION",
+              default=0.0,
+              type=click.FloatRange(0.0, 1.0),
+              help="With --quick, fraction of unchanged files rehashed "
+                   "anyway, chosen at random.")
+@click.option("--seed",
+              metavar="N",
+              default=None,
+              type=int,
+              help="Seed of the random sample.")
+@click.option("--chunks",
+              "chunks_path",
+              metavar="PATH",
+              default=None,
+              type=click.Path(exists=True),
+              help="Sidecar of `compute --chunks`, used with blake2b-tree "
+                   "to report which byte ranges of a file are damaged.")
+@click.option("--stats",
+              "stats_path",
+              metavar="PATH",
+              default=None,
+              type=str,
+              help="Write run statistics to a JSON file: throughput, time "
+                   "per phase (walk, stat, read, digest, write) and the "
+                   "slowest files.")
+@click.option("--profile",
+              metavar="PATH",
+              default=None,
+              type=str,
+              help="Profile the run with cProfile and save the statistics "
+                   "to PATH, e.g. for `python -m pstats PATH`.")
 @click.option("--log-level",
               metavar="LEVEL",
               default="info",
@@ -118,36 +292,468 @@ def compute(glob_patterns, algorithm, recursive, log_level, log_file):
               default=None,
               type=str,
               help="Path to log file.")
-def check(checksums, algorithm, log_level, log_file):
+def check(checksums, algorithm, jobs, quick, sample, seed, chunks_path,
+          stats_path, profile, log_level, log_file):
     """Checks if file hashes match hashes from the previously generated file.
     
     Example usage:\n
-    $ hashes check --algorithm sha512 log-level INFO .checksums.sha512 > report.txt
+    $ checksums check --algorithm sha512 --jobs 4 .checksums.sha512 > report.txt\n
+    $ checksums check --quick --sample 0.05 .checksums.sha512
     """
+    from .stats import profiled, stats_to_json
+    from .tree import load_sidecar
+    from .checksums import (get_algorithm_from_str, iter_hashes,
+                            iter_check_hashes, print_check_results)
+
     # Set up logger
-    format_str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    logging.basicConfig(format=format_str)
+    logger = setup_logger(log_level, log_file)
 
-    logger = logging.getLogger("ComputeFileHashes")
+    # Check with a single algorithm
+    if "," in algorithm:
+        msg = ("--algorithm takes a single algorithm, files of hashes have "
+               "one hash per file.")
+        raise click.UsageError(msg)
+    try:
+        get_algorithm_from_str(algorithm)
+    except NotImplementedError as e:
+        raise click.UsageError(str(e))
 
-    if log_level:
-        log_level = get_logger_level_from_str(log_level)
-        logger.setLevel(log_level)
+    with stats_to_json(stats_path), profiled(profile):
+        chunk_records = None
+        if chunks_path is not None:
+            chunk_records = load_sidecar(chunks_path)
+        hashes = iter_hashes(checksums)
+        check_results = iter_check_hashes(hashes, algorithm, logger, jobs,
+                                          quick, sample, seed, chunk_records)
+        if not print_check_results(check_results):
+            sys.exit(1)
 
-    if log_file:
-        fh = logging.FileHandler(log_file)
-        fh.setFormatter(logging.Formatter(format_str))
-        logger.addHandler(fh)
-        fh.setLevel(logging.DEBUG)
 
-    hashes = read_hashes(".checksums.sha512")
-    check_results = check_hashes(hashes, "sha512")
-    report = gen_report(check_results)
-    print(report)
+@click.command()
+@click.argument("glob_patterns",
+                metavar="PATTERN1,PATTERN2",
+                type=click.STRING)
+@click.option("--algorithm",
+              metavar="NAME",
+              default="sha512",
+              type=str,
+              help="Hashing algorithm to use for full hashes.")
+@click.option("-r",
+              "--recursive",
+              is_flag=True,
+              help="Traverse PATH recursively.")
+@click.option("-j",
+              "--jobs",
+              metavar="N",
+              default=1,
+              type=click.IntRange(min=1),
+              help="Number of files to hash concurrently.")
+@click.option("--cache",
+              metavar="PATH",
+              default=None,
+              type=str,
+              envvar="CHECKSUMS_CACHE",
+              help="Hash cache database used for full hashes. Defaults to "
+                   "$CHECKSUMS_CACHE.")
+@click.option("--no-cache",
+              is_flag=True,
+              help="Do not use the hash cache, even if $CHECKSUMS_CACHE is set.")
+@click.option("--stats",
+              "stats_path",
+              metavar="PATH",
+              default=None,
+              type=str,
+              help="Write run statistics to a JSON file: throughput, time "
+                   "per phase (walk, stat, read, digest, write) and the "
+                   "slowest files.")
+@click.option("--profile",
+              metavar="PATH",
+              default=None,
+              type=str,
+              help="Profile the run with cProfile and save the statistics "
+                   "to PATH, e.g. for `python -m pstats PATH`.")
+@click.option("--log-level",
+              metavar="LEVEL",
+              default="info",
+              type=str,
+              help="Log level: DEBUG, INFO, WARNING, etc.")
+@click.option("--log-file",
+              metavar="PATH",
+              default=None,
+              type=str,
+              help="Path to log file.")
+def dupes(glob_patterns, algorithm, recursive, jobs, cache, no_cache,
+          stats_path, profile, log_level, log_file):
+    """Finds files with identical content among files matching a pattern.
+
+    Groups of duplicates are printed one path per line and separated by an
+    empty line. Files are compared by size first, then by a hash of their
+    first and last bytes, and only the remaining candidates are read in full.
+    """
+    from .stats import profiled, stats_to_json
+    from .dupes import find_duplicates
+    from .checksums import find_files
+
+    # Set up logger
+    logger = setup_logger(log_level, log_file)
+
+    with stats_to_json(stats_path), profiled(profile):
+        # Find duplicates
+        glob_patterns = list(set(glob_patterns.split(",")))
+        filepaths = find_files(glob_patterns, recursive, logger)
+        cache = open_cache(cache, no_cache=no_cache, logger=logger)
+        try:
+            groups = find_duplicates(filepaths, algorithm, logger, jobs, cache)
+        finally:
+            if cache is not None:
+                cache.close()
+
+        # Print groups to standard output
+        for i, group in enumerate(groups):
+            if i > 0:
+                print()
+            for filepath in group:
+                print(os.path.normpath(filepath))
+
+        n_duplicates = sum(len(group) - 1 for group in groups)
+        n_bytes = sum((len(group) - 1) * os.path.getsize(group[0])
+                      for group in groups)
+        logger.info(f"Found {len(groups):d} group(s) with {n_duplicates:d} "
+                    f"duplicate file(s) taking {n_bytes:d} bytes.")
+
+
+@click.command()
+@click.argument("reference", metavar="REFERENCE1,REFERENCE2", type=click.STRING)
+@click.argument("other", metavar="OTHER1,OTHER2", type=click.STRING)
+@click.option("--log-level",
+              metavar="LEVEL",
+              default="info",
+              type=str,
+              help="Log level: DEBUG, INFO, WARNING, etc.")
+@click.option("--log-file",
+              metavar="PATH",
+              default=None,
+              type=str,
+              help="Path to log file.")
+def diff(reference, other, log_level, log_file):
+    """Compares manifests of a copy against manifests of the master.
+
+    REFERENCE and OTHER are comma-separated manifests: get_hash.py volume
+    manifests (.json, .ndjson), directories containing them, or checksum
+    files of `checksums compute`. Files are reported as MISSING, CHANGED,
+    MOVED (same hash at another path) or EXTRA. Exits with a non-zero status
+    if any file is missing or changed.
+
+    Example usage:\n
+    $ checksums diff master/hashes__2024-01-01 backup/hashes__2024-02-01
+    """
+    from .diff import (find_manifests, load_manifests, diff_manifests,
+                       print_diff)
+
+    # Set up logger
+    logger = setup_logger(log_level, log_file)
+
+    # Load both sides
+    indexes = []
+    for paths in (reference, other):
+        filepaths = find_manifests(paths.split(","))
+        index = load_manifests(filepaths)
+        logger.info(f"Loaded {len(index):d} entries from "
+                    f"{len(filepaths):d} manifest(s).")
+        indexes.append(index)
+
+    try:
+        result = diff_manifests(*indexes)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    ok = print_diff(result)
+    logger.info(f"{len(result['missing']):d} missing, "
+                f"{len(result['changed']):d} changed, "
+                f"{len(result['moved']):d} moved, "
+                f"{len(result['extra']):d} extra file(s).")
+    if not ok:
+        sys.exit(1)
+
+
+@click.command()
+@click.argument("source", metavar="SOURCE1,SOURCE2", type=click.STRING)
+@click.argument("output", type=click.Path())
+@click.option("--algorithm",
+              metavar="NAME",
+              default=None,
+              type=str,
+              help="Hashing algorithm of the text manifests, required if "
+                   "they do not record it.")
+def convert(source, output, algorithm):
+    """Converts manifests between the text and the binary format.
+
+    A binary SOURCE is written to OUTPUT as a text checksum file that can be
+    checked by `sha512sum --check`. Otherwise the comma-separated SOURCE
+    manifests (checksum files, get_hash.py manifests or directories containing
+    them) are merged into the binary manifest OUTPUT, which can be searched by
+    `checksums lookup` without loading it.
+
+    Example usage:\n
+    $ checksums convert .checksums.sha512 .checksums.sha512.bin
+    """
+    from .diff import find_manifests, iter_entries, read_algorithm
+    from .binary import (BinaryManifest, is_binary_manifest,
+                         write_binary_manifest)
+
+    filepaths = find_manifests(source.split(","))
+    if len(filepaths) == 1 and is_binary_manifest(filepaths[0]):
+        with BinaryManifest(filepaths[0]) as manifest, open(output, "w") as f:
+            print(f"# Algorithm used:            {manifest.algorithm:s}",
+                  file=f)
+            for path, hash in manifest:
+                print(f"{hash:s}  {path:s}", file=f)
+            n_entries = len(manifest)
+    else:
+        if algorithm is None:
+            algorithms = {read_algorithm(filepath) for filepath in filepaths}
+            if None in algorithms or len(algorithms) != 1:
+                msg = ("Cannot tell the algorithm of the manifests, give it "
+                       "with --algorithm.")
+                raise click.UsageError(msg)
+            algorithm = algorithms.pop()
+        entries = (entry for filepath in filepaths
+                   for entry in iter_entries(filepath))
+        try:
+            n_entries = write_binary_manifest(entries, output, algorithm)
+        except (ValueError, NotImplementedError) as e:
+            raise click.UsageError(str(e))
+    print(f"Wrote {n_entries:d} entries to {output:s}.")
+
+
+@click.command()
+@click.argument("manifest", type=click.Path(exists=True))
+@click.option("--path",
+              "paths",
+              metavar="PATH",
+              multiple=True,
+              help="Look up the hash of a path listed in the manifest.")
+@click.option("--hash",
+              "hashes",
+              metavar="HASH",
+              multiple=True,
+              help="Look up the paths of files with this hash.")
+@click.option("--file",
+              "files",
+              metavar="PATH",
+              multiple=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help="Hash a local file and look up the paths of files with "
+                   "the same content.")
+def lookup(manifest, paths, hashes, files):
+    """Searches a binary manifest by path, by hash or by file content.
+
+    Each match is printed as a checksum line. Exits with a non-zero status if
+    anything was not found.
+
+    Example usage:\n
+    $ checksums lookup --file DSC_0001.NEF archive.sha512.bin
+    """
+    from .diff import normalize_path
+    from .binary import BinaryManifest
+    from .checksums import get_algorithm_from_str, compute_file_hash
+
+    n_missing = 0
+    with BinaryManifest(manifest) as index:
+        for path in paths:
+            hash = index.get(normalize_path(path))
+            if hash is None:
+                print(f"{path:s}: not found")
+                n_missing += 1
+            else:
+                print(f"{hash:s}  {normalize_path(path):s}")
+
+        queries = list(hashes)
+        if files:
+            algorithm = get_algorithm_from_str(index.algorithm)
+            queries.extend(compute_file_hash(file, algorithm)
+                           for file in files)
+        for query, hash in zip(list(hashes) + list(files), queries):
+            found = index.find(hash)
+            if not found:
+                print(f"{query:s}: not found")
+                n_missing += 1
+            for path in found:
+                print(f"{hash.lower():s}  {path:s}")
+    if n_missing > 0:
+        sys.exit(1)
+
+
+@click.command("verify-chunks")
+@click.argument("sidecar", type=click.Path(exists=True))
+@click.option("--path",
+              "paths",
+              metavar="PATH",
+              multiple=True,
+              help="Verify only this file of the sidecar.")
+@click.option("--range",
+              "byte_range",
+              metavar="START:END",
+              default=None,
+              type=str,
+              help="Verify only chunks overlapping these bytes of the files, "
+                   "e.g. a range restored from a backup.")
+@click.option("--root",
+              metavar="DIR",
+              default=None,
+              type=click.Path(exists=True, file_okay=False),
+              help="Directory that relative paths of the sidecar start from, "
+                   "e.g. the archive root for get_hash.py sidecars.")
+def verify_chunks_command(sidecar, paths, byte_range, root):
+    """Rereads chunks of files and compares them with their sidecar.
+
+    Only the chunks to verify are read, concurrently, so after a partial
+    restore only the restored ranges need to be read again. Damaged byte
+    ranges are printed per file. Exits with a non-zero status if any chunk
+    is damaged or a file cannot be read.
+
+    Example usage:\n
+    $ checksums verify-chunks --path clip.mp4 --range 0:67108864 chunks.ndjson
+    """
+    from .diff import normalize_path
+    from .tree import chunk_ranges, iter_sidecar, verify_chunks
+
+    start, end = 0, None
+    if byte_range is not None:
+        try:
+            start, end = (int(value) for value in byte_range.split(":"))
+        except ValueError:
+            raise click.UsageError("--range must be START:END in bytes.")
+
+    selected = {normalize_path(path) for path in paths}
+    n_problems = 0
+    for record in iter_sidecar(sidecar):
+        if selected and normalize_path(record["filepath"]) not in selected:
+            continue
+        filepath = record["filepath"]
+        if root is not None:
+            filepath = os.path.join(root, filepath)
+        chunk_size = record["chunk_size"]
+        indices = None
+        if end is not None:
+            indices = range(start // chunk_size, -(-end // chunk_size))
+        try:
+            damaged = verify_chunks(filepath, record, indices)
+        except OSError as e:
+            print(f"{filepath:s}: FAILED open or read: {e}")
+            n_problems += 1
+            continue
+        if damaged:
+            print(f"{filepath:s}: FAILED at bytes " + ", ".join(
+                f"{a:d}-{b:d}" for a, b in chunk_ranges(damaged, chunk_size)))
+            n_problems += 1
+        else:
+            print(f"{filepath:s}: OK")
+    if n_problems > 0:
+        sys.exit(1)
+
+
+@click.command()
+@click.option("--socket",
+              "socket_path",
+              metavar="PATH",
+              default=None,
+              type=str,
+              help="Answer clients of a Unix socket created at PATH instead "
+                   "of the standard input.")
+@click.option("--algorithm",
+              metavar="NAME1,NAME2",
+              default="sha512",
+              type=str,
+              help="Default hashing algorithm(s). Plain paths are answered "
+                   "with the first one, JSON requests may name others.")
+@click.option("-j",
+              "--jobs",
+              metavar="N",
+              default=1,
+              type=click.IntRange(min=1),
+              help="Number of files of a JSON request to hash concurrently.")
+@click.option("--cache",
+              metavar="PATH",
+              default=None,
+              type=str,
+              envvar="CHECKSUMS_CACHE",
+              help="Hash cache database, reused for files that did not "
+                   "change since they were hashed. Defaults to "
+                   "$CHECKSUMS_CACHE.")
+@click.option("--no-cache",
+              is_flag=True,
+              help="Do not use the hash cache, even if $CHECKSUMS_CACHE is set.")
+@click.option("--log-level",
+              metavar="LEVEL",
+              default="info",
+              type=str,
+              help="Log level: DEBUG, INFO, WARNING, etc.")
+@click.option("--log-file",
+              metavar="PATH",
+              default=None,
+              type=str,
+              help="Path to log file.")
+def serve(socket_path, algorithm, jobs, cache, no_cache, log_level,
+          log_file):
+    """Hashes files named by requests, one per line, until the end of input.
+
+    A plain line is a path and is answered by a checksum line, or
+    `FAILED  PATH`; an empty line is answered by an empty line. A JSON line
+    `{"paths": [...], "algorithm": ..., "id": ...}` is answered by a JSON
+    line per path and a final `{"done": true, ...}` line. Starting once
+    saves the startup of Python for every small batch.
+
+    Example usage:\n
+    $ find photos -name '*.NEF' | checksums serve --algorithm sha256\n
+    $ checksums serve --socket /tmp/checksums.sock --jobs 4 &
+    """
+    from .serve import HashServer, exit_on_sigterm, serve_socket
+
+    # Set up logger
+    logger = setup_logger(log_level, log_file)
+
+    try:
+        hash_server = HashServer(algorithm, logger, jobs)
+    except (ValueError, NotImplementedError) as e:
+        raise click.UsageError(str(e))
+    exit_on_sigterm()
+    hash_server.cache = open_cache(cache, no_cache=no_cache, logger=logger)
+    try:
+        if socket_path is None:
+            hash_server.serve_stream(sys.stdin, sys.stdout)
+        else:
+            logger.info(f"Listening on {socket_path:s}.")
+            serve_socket(hash_server, socket_path)
+    except KeyboardInterrupt:
+        pass
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    finally:
+        hash_server.close()
+        if hash_server.cache is not None:
+            hash_server.cache.close()
+
+
+@click.command("prune-cache")
+@click.argument("cache", type=click.Path(exists=True))
+def prune_cache(cache):
+    """Removes cached hashes of files that no longer exist."""
+    from .cache import HashCache
+
+    with HashCache(cache) as hash_cache:
+        n_evicted = hash_cache.evict_missing()
+    print(f"Removed {n_evicted:d} stale entries from {cache:s}.")
 
 
 cli.add_command(compute)
 cli.add_command(check)
+cli.add_command(dupes)
+cli.add_command(diff)
+cli.add_command(convert)
+cli.add_command(lookup)
+cli.add_command(verify_chunks_command)
+cli.add_command(serve)
+cli.add_command(prune_cache)
 
 if __name__ == "__main__":
     cli()
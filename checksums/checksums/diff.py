@@ -0,0 +1,209 @@
+"""Comparing manifests, e.g., of a backup drive against the master archive.
+
+Manifests are either `get_hash.py` volume manifests (`.json` or `.ndjson`,
+with paths relative to the archive root), checksum files written by
+`checksums compute` or binary manifests. Entries of both sides are joined by
+path and then by hash using dictionaries, so the comparison takes linear time
+in the number of entries. Digests are kept as bytes to halve the memory used
+for large manifests.
+"""
+import os
+import posixpath
+from collections import defaultdict
+from typing import Iterable, Iterator, Optional
+from .binary import BinaryManifest, is_binary_manifest
+from .cache import normalize_algorithm
+from .checksums import get_algorithm_from_str, iter_hashes
+from .manifest import iter_manifest, load_manifest
+
+# Extensions of get_hash.py manifests, other files are read as checksum files
+MANIFEST_EXTENSIONS = (".json", ".ndjson")
+# Suffix of get_hash.py manifest names before the extension, which tells them
+# from other files in `hashes__<timestamp>`, e.g. chunk sidecars
+MANIFEST_SUFFIX = "_hashes"
+# Comment line of checksum files naming the algorithm, see `print_hashes`
+ALGORITHM_COMMENT = "# Algorithm used:"
+
+
+def is_volume_manifest(filepath: str) -> bool:
+    """Returns whether path is a `get_hash.py` manifest."""
+    return os.path.splitext(filepath)[1].lower() in MANIFEST_EXTENSIONS
+
+
+def find_manifests(paths: Iterable[str]) -> list[str]:
+    """Expands directories, e.g. `hashes__<timestamp>`, into the manifests
+    they contain.
+
+    Args:
+        paths: paths to manifests or directories with manifests.
+
+    Returns:
+        Paths to manifests.
+    """
+    filepaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            filepaths.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if is_volume_manifest(name) and
+                os.path.splitext(name)[0].endswith(MANIFEST_SUFFIX)))
+        else:
+            filepaths.append(path)
+    return filepaths
+
+
+def read_algorithm(filepath: str) -> Optional[str]:
+    """Reads the name of the hashing algorithm of a manifest.
+
+    Binary manifests record it in their header. Checksum files record it in
+    their `# Algorithm used:` comment, or in their extension, e.g.,
+    `.checksums.sha512`. `get_hash.py` manifests only name it in records of
+    several algorithms.
+
+    Args:
+        filepath: path to the manifest.
+
+    Returns:
+        Name of the algorithm, e.g., sha512, or None if it is not recorded.
+    """
+    if is_binary_manifest(filepath):
+        with BinaryManifest(filepath) as manifest:
+            return manifest.algorithm or None
+    if is_volume_manifest(filepath):
+        for record in iter_manifest(filepath):
+            for name, hash in record.get("hashes", {}).items():
+                if hash == record["hash"]:
+                    return normalize_algorithm(name)
+            return None
+        return None
+
+    with open(filepath, "r") as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            if line.startswith(ALGORITHM_COMMENT):
+                return line[len(ALGORITHM_COMMENT):].strip().lower()
+    extension = os.path.splitext(filepath)[1][1:].lower()
+    try:
+        get_algorithm_from_str(extension)
+    except NotImplementedError:
+        return None
+    return extension
+
+
+def normalize_path(path: str) -> str:
+    """Normalizes path to the form stored by `get_hash.py`."""
+    return posixpath.normpath(path.replace("\\", "/"))
+
+
+def iter_entries(filepath: str) -> Iterator[tuple[str, str]]:
+    """Iterates over entries of a manifest of any supported format.
+
+    Args:
+        filepath: path to the manifest.
+
+    Yields:
+        Tuples `(path, hash)` with normalized paths.
+    """
+    if is_binary_manifest(filepath):
+        with BinaryManifest(filepath) as manifest:
+            yield from manifest
+    elif is_volume_manifest(filepath):
+        for record in load_manifest(filepath).values():
+            yield normalize_path(record["posixpath"]), record["hash"]
+    else:
+        for record in iter_hashes(filepath):
+            yield normalize_path(record["filepath"]), record["hash"]
+
+
+def load_manifests(filepaths: Iterable[str]) -> dict[str, bytes]:
+    """Loads entries of several manifests into one index by path.
+
+    Args:
+        filepaths: paths to manifests.
+
+    Returns:
+        Dictionary mapping paths to digests.
+    """
+    by_path = {}
+    for filepath in filepaths:
+        for path, hash in iter_entries(filepath):
+            by_path[path] = bytes.fromhex(hash)
+    return by_path
+
+
+def diff_manifests(reference: dict[str, bytes],
+                   other: dict[str, bytes]) -> dict[str, list]:
+    """Compares two indexes returned by `load_manifests`.
+
+    Args:
+        reference: entries of the master manifests.
+        other: entries of the manifests compared against the master.
+
+    Returns:
+        Dictionary with sorted lists:
+        - `"missing"`: paths of the reference that are not in the other
+          manifests, and whose content is not found at a new path either.
+        - `"changed"`: paths in both manifests with different hashes.
+        - `"moved"`: tuples `(reference path, other path)` of files with the
+          same hash found at a different path only in the other manifests.
+        - `"extra"`: paths only in the other manifests.
+
+    Raises:
+        ValueError: if the manifests use hashes of different lengths.
+    """
+    digest_sizes = {len(next(iter(index.values())))
+                    for index in (reference, other) if index}
+    if len(digest_sizes) > 1:
+        msg = ("Manifests use different hashing algorithms, digest sizes: "
+               f"{sorted(digest_sizes)}.")
+        raise ValueError(msg)
+
+    # Join by path
+    changed = []
+    missing = []
+    for path, digest in reference.items():
+        other_digest = other.get(path)
+        if other_digest is None:
+            missing.append(path)
+        elif other_digest != digest:
+            changed.append(path)
+    extra_by_hash = defaultdict(list)
+    for path, digest in other.items():
+        if path not in reference:
+            extra_by_hash[digest].append(path)
+
+    # Join the remaining paths by hash
+    moved = []
+    still_missing = []
+    for path in missing:
+        new_paths = extra_by_hash.get(reference[path])
+        if new_paths:
+            moved.append((path, new_paths.pop()))
+        else:
+            still_missing.append(path)
+    extra = [path for paths in extra_by_hash.values() for path in paths]
+
+    return {
+        "missing": sorted(still_missing),
+        "changed": sorted(changed),
+        "moved": sorted(moved),
+        "extra": sorted(extra),
+    }
+
+
+def print_diff(diff: dict[str, list]) -> bool:
+    """Prints result of `diff_manifests`, one file per line.
+
+    Returns:
+        True if no file is missing or changed.
+    """
+    for path in diff["missing"]:
+        print(f"MISSING  {path:s}")
+    for path in diff["changed"]:
+        print(f"CHANGED  {path:s}")
+    for path, new_path in diff["moved"]:
+        print(f"MOVED    {path:s} -> {new_path:s}")
+    for path in diff["extra"]:
+        print(f"EXTRA    {path:s}")
+    return not diff["missing"] and not diff["changed"]
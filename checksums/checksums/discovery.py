@@ -0,0 +1,174 @@
+"""Finding files matching glob patterns in a single pass over the tree.
+
+`glob.glob` walks the tree once per pattern, so `'**/*.jpg,**/*.JPG'` lists
+every directory twice. Here all patterns are matched together: each pattern is
+split into path components compiled to regular expressions, and the walk keeps,
+for every directory, the set of (pattern, component) positions that are still
+possible there. A directory is entered only if some pattern can match below
+it, and every entry is matched against all patterns at once.
+
+Directories are listed with `os.scandir`, whose entries tell files from
+directories without an extra `stat` call on most platforms. Matching follows
+`glob.glob`: `*` and `?` do not match names starting with a dot unless the
+pattern component starts with a dot, and `**` matches any number of
+directories only if `recursive` is set. A pattern ending with a separator,
+e.g. `**/`, matches only directories in `glob.glob`, so it finds no files.
+"""
+import os
+import re
+import fnmatch
+from typing import Iterable, Iterator
+
+_MAGIC = re.compile(r"[*?[]")
+_SEPARATORS = re.compile(r"[\\/]" if os.sep == "\\" else r"/")
+
+# Marker of a `**` component matched recursively
+_RECURSIVE = None
+
+
+class _Component:
+    """Compiled component of a pattern, e.g., `*.jpg`."""
+
+    def __init__(self, pattern: str) -> None:
+        self.allows_hidden = pattern.startswith(".")
+        self.regex = re.compile(fnmatch.translate(os.path.normcase(pattern)))
+
+    def match(self, name: str, hidden: bool) -> bool:
+        return ((self.allows_hidden or not hidden) and
+                self.regex.match(os.path.normcase(name)) is not None)
+
+
+def _split_pattern(pattern: str) -> tuple[str, list[str], list[str]]:
+    """Splits pattern into its anchor (drive and root), the leading components
+    without wildcards and the remaining components."""
+    drive, path = os.path.splitdrive(pattern)
+    root = path[:1] if _SEPARATORS.match(path[:1]) else ""
+    parts = [part for part in _SEPARATORS.split(path) if part]
+    n_literal = 0
+    while n_literal < len(parts) and not _MAGIC.search(parts[n_literal]):
+        n_literal += 1
+    return drive + root, parts[:n_literal], parts[n_literal:]
+
+
+def _group_patterns(glob_patterns: Iterable[str], recursive: bool
+                    ) -> tuple[list[str], dict[str, list[list]]]:
+    """Groups patterns by the directory from which they are matched.
+
+    A pattern whose base directory is below the base directory of another
+    pattern is matched in the same walk, its extra leading components becoming
+    literal components.
+
+    Returns:
+        Paths without wildcards, and compiled patterns by base directory.
+    """
+    literals = []
+    split = []
+    for pattern in dict.fromkeys(glob_patterns):
+        if _SEPARATORS.match(pattern[-1:]):
+            continue  # matches directories only, as in glob.glob
+        anchor, base, rest = _split_pattern(pattern)
+        if rest:
+            split.append((anchor, base, rest))
+        else:
+            literals.append(pattern)
+
+    groups = {}
+    bases = sorted({(anchor, tuple(base)) for anchor, base, rest in split},
+                   key=lambda key: len(key[1]))
+    for anchor, base, rest in split:
+        for group_anchor, group_base in bases:
+            extra = base[len(group_base):]
+            if (group_anchor == anchor and
+                    tuple(base[:len(group_base)]) == group_base and
+                    not any(part in (".", "..") for part in extra)):
+                break
+        base_dir = anchor + os.path.join(*group_base) if group_base else anchor
+        components = [_RECURSIVE if part == "**" and recursive
+                      else _Component(part) for part in extra + rest]
+        groups.setdefault(base_dir, []).append(components)
+    return literals, groups
+
+
+def _closure(patterns: list[list], states: set) -> frozenset:
+    """Adds the positions after `**` components, which may match no
+    directories. A last `**` matches at least one entry, as in `glob.glob`."""
+    states = set(states)
+    pending = list(states)
+    while pending:
+        p, i = pending.pop()
+        if i + 1 < len(patterns[p]) and patterns[p][i] is _RECURSIVE:
+            if (p, i + 1) not in states:
+                states.add((p, i + 1))
+                pending.append((p, i + 1))
+    return frozenset(states)
+
+
+def _advance(patterns: list[list], states: frozenset,
+             name: str) -> frozenset:
+    """Returns positions in the patterns after matching a directory entry."""
+    hidden = name.startswith(".")
+    next_states = set()
+    for p, i in states:
+        if i == len(patterns[p]):
+            continue
+        component = patterns[p][i]
+        if component is _RECURSIVE:
+            if not hidden:
+                next_states.add((p, i))
+                if i + 1 == len(patterns[p]):
+                    next_states.add((p, i + 1))
+        elif component.match(name, hidden):
+            next_states.add((p, i + 1))
+    return _closure(patterns, next_states)
+
+
+def _walk(base_dir: str, patterns: list[list]) -> Iterator[str]:
+    """Yields paths of files below base_dir matching any of the patterns."""
+    stack = [(base_dir, _closure(patterns, {(p, 0) for p in
+                                            range(len(patterns))}))]
+    while stack:
+        dirpath, states = stack.pop()
+        try:
+            with os.scandir(dirpath or os.curdir) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue  # like glob, skip directories that cannot be listed
+
+        subdirs = []
+        for entry in entries:
+            next_states = _advance(patterns, states, entry.name)
+            if not next_states:
+                continue
+            path = os.path.join(dirpath, entry.name) if dirpath else entry.name
+            if (any(i == len(patterns[p]) for p, i in next_states) and
+                    entry.is_file()):
+                yield path
+            if (any(i < len(patterns[p]) for p, i in next_states) and
+                    entry.is_dir()):
+                subdirs.append((path, next_states))
+        stack.extend(reversed(subdirs))
+
+
+def iter_files(glob_patterns: Iterable[str],
+               recursive: bool = False) -> Iterator[str]:
+    """Lazily finds files matching any of the patterns.
+
+    Each directory is listed at most once, however many patterns there are.
+
+    Args:
+        glob_patterns: glob patterns to match, as for `glob.glob`.
+        recursive: whether `**` matches any number of directories.
+
+    Yields:
+        Paths of regular files (or symbolic links to them), each once, in the
+        form of the patterns, e.g. relative if the patterns are relative.
+        Paths are sorted within each directory. Patterns ending with a
+        separator match directories only and yield nothing.
+    """
+    literals, groups = _group_patterns(glob_patterns, recursive)
+    literals = [path for path in literals if os.path.isfile(path)]
+    yield from literals
+    for base_dir, patterns in groups.items():
+        for path in _walk(base_dir, patterns):
+            if path not in literals:
+                yield path
@@ -0,0 +1,143 @@
+"""Finding duplicate files.
+
+Candidates are narrowed down in tiers, so that most files are never read:
+
+1. Files are grouped by size. A file with a unique size has no duplicates.
+2. Files of the same size are grouped by a cheap hash of their first and last
+   `PARTIAL_SIZE` bytes.
+3. Only files that still collide are hashed in full.
+
+A file that cannot be read, e.g. because it was removed meanwhile, is
+reported and dropped from its group.
+"""
+import os
+import stat as stat_module
+import hashlib
+import logging
+from collections import defaultdict
+from typing import Callable, Iterable
+from .cache import HashCache
+from .checksums import _imap_unordered, compute_file_hash, get_algorithm_from_str
+
+# Number of bytes hashed at the start and at the end of a file in tier 2
+PARTIAL_SIZE = 4096
+
+
+def compute_partial_hash(filepath: str, size: int,
+                         partial_size: int = PARTIAL_SIZE) -> str:
+    """Computes hash of the first and last bytes of a file.
+
+    Args:
+        filepath: path of a file for which to compute hash.
+        size: size of the file in bytes.
+        partial_size: number of bytes to hash at each end of the file.
+
+    Returns:
+        Hex value of hash. For files of up to `2 * partial_size` bytes the
+        whole content is hashed.
+    """
+    hash = hashlib.blake2b(digest_size=16)
+    with open(filepath, "rb") as f:
+        if size <= 2 * partial_size:
+            hash.update(f.read())
+        else:
+            hash.update(f.read(partial_size))
+            f.seek(size - partial_size)
+            hash.update(f.read(partial_size))
+    return hash.hexdigest()
+
+
+def _group_by(func: Callable, groups: Iterable[list[str]], jobs: int,
+              logger: logging.Logger = None) -> list[list[str]]:
+    """Splits each group of paths by the value of `func(path)`, dropping
+    paths that cannot be read and groups with a single path."""
+    def get_key(task):
+        try:
+            return task, func(task[1])
+        except (OSError, ValueError) as e:
+            return task, e
+
+    subgroups = defaultdict(list)
+    tasks = ((i, filepath) for i, group in enumerate(groups)
+             for filepath in group)
+    for (i, filepath), key in _imap_unordered(get_key, tasks, jobs):
+        if isinstance(key, Exception):
+            if logger:
+                logger.warning(f"{filepath:s}: cannot be read: {key}")
+            continue
+        subgroups[(i, key)].append(filepath)
+    return [sorted(group) for group in subgroups.values() if len(group) > 1]
+
+
+def find_duplicates(filepaths: Iterable[str],
+                    algorithm: str = "sha512",
+                    logger: logging.Logger = None,
+                    jobs: int = 1,
+                    cache: HashCache = None,
+                    partial_size: int = PARTIAL_SIZE) -> list[list[str]]:
+    """Finds groups of files with identical content.
+
+    Empty files are ignored. Several paths of the same file (hard links) are
+    reported once, as they do not take additional space.
+
+    Args:
+        filepaths: paths of files to compare, other paths are skipped.
+        algorithm: name of the algorithm for full hashes, e.g., md5 or sha512.
+        logger: logger instance.
+        jobs: number of files hashed concurrently.
+        cache: hash cache used for full hashes.
+        partial_size: number of bytes hashed at each end of a file in tier 2.
+
+    Returns:
+        Sorted groups of paths of identical files, each with 2 or more paths.
+    """
+    algorithm = get_algorithm_from_str(algorithm)
+
+    # Tier 1: group by size
+    by_size = defaultdict(list)
+    sizes = {}
+    seen_inodes = set()
+    n_files = 0
+    for filepath in filepaths:
+        try:
+            stat = os.stat(filepath)
+        except OSError as e:
+            if logger:
+                logger.warning(f"{filepath:s}: cannot be read: {e}")
+            continue
+        if not stat_module.S_ISREG(stat.st_mode):
+            continue
+        if stat.st_size == 0 or (stat.st_dev, stat.st_ino) in seen_inodes:
+            continue
+        seen_inodes.add((stat.st_dev, stat.st_ino))
+        by_size[stat.st_size].append(filepath)
+        sizes[filepath] = stat.st_size
+        n_files += 1
+    groups = [group for group in by_size.values() if len(group) > 1]
+    if logger:
+        n_candidates = sum(len(group) for group in groups)
+        logger.info(f"Size: {n_candidates:d} of {n_files:d} files have "
+                    "the same size as another file.")
+
+    # Tier 2: group by hash of the first and last bytes
+    groups = _group_by(
+        lambda filepath: compute_partial_hash(
+            filepath, sizes[filepath], partial_size),
+        groups, jobs, logger)
+    if logger:
+        n_candidates = sum(len(group) for group in groups)
+        logger.info(f"Partial hash: {n_candidates:d} files remain candidates.")
+
+    # Tier 3: group by full hash, unless partial hash covered the whole file
+    small_groups = [group for group in groups
+                    if sizes[group[0]] <= 2 * partial_size]
+    large_groups = [group for group in groups
+                    if sizes[group[0]] > 2 * partial_size]
+    if logger:
+        n_candidates = sum(len(group) for group in large_groups)
+        logger.info(f"Full hash: computing for {n_candidates:d} files.")
+    large_groups = _group_by(
+        lambda filepath: compute_file_hash(filepath, algorithm, cache),
+        large_groups, jobs, logger)
+
+    return sorted(small_groups + large_groups)
@@ -0,0 +1,177 @@
+"""Streaming reading and writing of `get_hash.py` volume manifests.
+
+Two formats are supported, chosen by file extension:
+
+- `.json`: a JSON array of records, as written by `get_hash.py` historically.
+- `.ndjson`: one JSON record per line. Records are appended as soon as files are
+  hashed, so a partial manifest survives a crash and can be read lazily.
+
+Records have the form `{"posixpath": ..., "hash": ...}`.
+
+An NDJSON manifest can also be updated in place by appending records:
+a record replaces earlier records of its path, and a tombstone
+`{"posixpath": ..., "deleted": true}` removes them. `load_manifest` applies
+such updates, `iter_manifest` yields the lines as they are.
+"""
+import os
+import json
+import time
+from typing import Iterator, TextIO
+
+# Pending records are flushed to disk after this many records or seconds
+FLUSH_RECORDS = 1000
+FLUSH_SECONDS = 5.0
+
+# Key of tombstones appended to NDJSON manifests for removed paths
+DELETED = "deleted"
+
+
+def is_ndjson(filepath: str) -> bool:
+    """Returns whether manifest at path uses the NDJSON format."""
+    return os.path.splitext(filepath)[1].lower() == ".ndjson"
+
+
+def _truncate_partial_line(filepath: str) -> None:
+    """Drops a last line left without its line break by a crash, so that
+    appended records start on a line of their own."""
+    with open(filepath, "rb+") as f:
+        end = position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(0, position - 4096)
+            f.seek(start)
+            block = f.read(position - start)
+            if position == end and block.endswith(b"\n"):
+                return
+            index = block.rfind(b"\n")
+            if index >= 0:
+                f.truncate(start + index + 1)
+                return
+            position = start
+        f.truncate(0)
+
+
+class ManifestWriter:
+    """Writes manifest records one at a time, keeping none of them in memory.
+
+    Use it as a context manager, or call `close` when done. For `.json` the
+    closing bracket of the array is only written on close.
+
+    Args:
+        filepath: path to the manifest, its extension selects the format.
+        flush_records: flush to disk after this many records.
+        flush_seconds: flush to disk when this many seconds have passed since
+            the last flush.
+        append: append records to an existing NDJSON manifest instead of
+            replacing it.
+
+    Raises:
+        ValueError: if `append` is set for a JSON manifest.
+    """
+
+    def __init__(self, filepath: str, flush_records: int = FLUSH_RECORDS,
+                 flush_seconds: float = FLUSH_SECONDS,
+                 append: bool = False) -> None:
+        self.filepath = filepath
+        self.ndjson = is_ndjson(filepath)
+        if append and not self.ndjson:
+            raise ValueError(f"Cannot append to {filepath:s}, "
+                             "only NDJSON manifests can be appended to.")
+        self.n_records = 0
+        self._flush_records = flush_records
+        self._flush_seconds = flush_seconds
+        self._n_pending = 0
+        self._last_flush = time.monotonic()
+        if append and os.path.exists(filepath):
+            _truncate_partial_line(filepath)
+        self._file: TextIO = open(filepath, "a" if append else "w",
+                                  encoding="utf-8")
+        if not self.ndjson:
+            self._file.write("[")
+
+    def write(self, record: dict) -> None:
+        """Appends a record to the manifest."""
+        if self.ndjson:
+            self._file.write(json.dumps(record) + "\n")
+        else:
+            separator = "," if self.n_records > 0 else ""
+            text = json.dumps(record, indent=4).replace("\n", "\n    ")
+            self._file.write(f"{separator:s}\n    {text:s}")
+        self.n_records += 1
+        self._n_pending += 1
+
+        if (self._n_pending >= self._flush_records or
+                time.monotonic() - self._last_flush >= self._flush_seconds):
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes pending records to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._n_pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        """Finishes the manifest and closes the file."""
+        if not self.ndjson:
+            self._file.write("\n]" if self.n_records > 0 else "]")
+        self.flush()
+        self._file.close()
+
+    def __enter__(self) -> "ManifestWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def iter_manifest(filepath: str) -> Iterator[dict]:
+    """Iterates over manifest records.
+
+    NDJSON manifests are read lazily, one line at a time, and a truncated last
+    line left by an interrupted run is ignored. JSON manifests are loaded at
+    once.
+
+    Args:
+        filepath: path to the manifest, its extension selects the format.
+
+    Yields:
+        Manifest records, of the form `{"posixpath": ..., "hash": ...}`.
+    """
+    with open(filepath, "r", encoding="utf-8") as f:
+        if not is_ndjson(filepath):
+            yield from json.load(f)
+            return
+
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                if not line.endswith("\n") and not f.read():
+                    return  # last record was being written during a crash
+                raise
+            yield record
+
+
+def load_manifest(filepath: str) -> dict[str, dict]:
+    """Loads the current records of a manifest, applying in-place updates.
+
+    Later records of a path replace earlier ones, and tombstones remove them.
+
+    Args:
+        filepath: path to the manifest, its extension selects the format.
+
+    Returns:
+        Dictionary mapping paths to records. Records are keyed by their
+        "posixpath", or by their "filepath" for chunk sidecars of
+        `checksums compute`.
+    """
+    records = {}
+    for record in iter_manifest(filepath):
+        path = record.get("posixpath", record.get("filepath"))
+        if record.get(DELETED):
+            records.pop(path, None)
+        else:
+            records[path] = record
+    return records
@@ -0,0 +1,303 @@
+"""Sequential file reading for hashing.
+
+Files are read with `readinto` into a single preallocated buffer, so that no
+new bytes object is created per block, and the kernel is told that the file
+will be read sequentially so it can read ahead aggressively.
+
+Reading and hashing can also overlap: a background thread reads the next
+blocks into a few preallocated buffers while the current block is digested
+(hashlib and file reads both release the GIL), so that the throughput gets
+close to the slower of the disk and the hash rather than their sum.
+`Prefetcher` does the same over a list of files, reading the beginning of
+the next file while the current one is finished.
+"""
+import os
+import time
+import queue
+import threading
+from typing import Iterable, Iterator, Optional
+from .stats import get_stats
+
+# Files up to MAX_BLOCK_SIZE are read in a single call, larger files in blocks
+# of MAX_BLOCK_SIZE. MIN_BLOCK_SIZE avoids tiny buffers for tiny files.
+MIN_BLOCK_SIZE = 64 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+
+# Number of blocks that may be read ahead of the consumer
+PREFETCH_BUFFERS = 4
+# Whether files of several blocks are read ahead on a background thread
+PREFETCH = True
+
+# Messages from the reading thread
+_START = "start"  # (_START, filepath, stat)
+_BLOCK = "block"  # (_BLOCK, buffer, n_bytes)
+_END = "end"  # (_END, exception or None), after each file
+_DONE = "done"  # (_DONE, exception or None), after all files
+
+
+def get_block_size(file_size: int) -> int:
+    """Returns read block size adapted to file size.
+
+    Args:
+        file_size: size of the file in bytes.
+
+    Returns:
+        Block size in bytes.
+    """
+    return min(MAX_BLOCK_SIZE, max(MIN_BLOCK_SIZE, file_size))
+
+
+def _open_for_reading(filepath: str, block_size: Optional[int]) -> tuple:
+    """Opens file for sequential reading.
+
+    Returns:
+        Unbuffered file object, its `os.fstat` and the block size.
+    """
+    f = open(filepath, "rb", buffering=0)
+    try:
+        stat = os.fstat(f.fileno())
+        if block_size is None:
+            block_size = get_block_size(stat.st_size)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except OSError:
+        f.close()
+        raise
+    return f, stat, block_size
+
+
+def _read_into_queue(f, block_size: int, free: queue.Queue,
+                     full: queue.Queue) -> bool:
+    """Reads a file into buffers taken from `free` and passes them to `full`.
+
+    Returns:
+        False if stopped by a None buffer, True at the end of the file.
+    """
+    while True:
+        buffer = free.get()
+        if buffer is None:
+            return False
+        n_bytes = f.readinto(memoryview(buffer)[:block_size])
+        if not n_bytes:
+            free.put(buffer)
+            return True
+        full.put((_BLOCK, buffer, n_bytes))
+
+
+def _iter_queued_blocks(free: queue.Queue,
+                        full: queue.Queue) -> Iterator[memoryview]:
+    """Yields blocks of one file from the reading thread, until its end."""
+    buffer = None
+    try:
+        while True:
+            message = full.get()
+            if message[0] == _END:
+                if message[1] is not None:
+                    raise message[1]
+                return
+            _, buffer, n_bytes = message
+            yield memoryview(buffer)[:n_bytes]
+            free.put(buffer)
+            buffer = None
+    finally:
+        if buffer is not None:
+            free.put(buffer)
+
+
+def _iter_read_ahead(f, block_size: int,
+                     n_buffers: int) -> Iterator[memoryview]:
+    """Yields blocks of an open file, reading the next ones meanwhile."""
+    free = queue.Queue()
+    full = queue.Queue()
+    for _ in range(n_buffers):
+        free.put(bytearray(block_size))
+
+    def read():
+        try:
+            _read_into_queue(f, block_size, free, full)
+        except Exception as e:
+            full.put((_END, e))
+        else:
+            full.put((_END, None))
+
+    thread = threading.Thread(target=read, name="read-ahead", daemon=True)
+    thread.start()
+    try:
+        yield from _iter_queued_blocks(free, full)
+    finally:
+        free.put(None)  # stops the thread if the consumer gave up early
+        thread.join()
+
+
+def iter_file_blocks(filepath: str, block_size: int = None,
+                     prefetch: bool = False) -> Iterator[memoryview]:
+    """Reads file block by block into a reused buffer.
+
+    The yielded memoryview points into the buffer and is only valid until the
+    next block is requested, so it should be consumed (e.g. passed to
+    `hash.update`) right away.
+
+    Args:
+        filepath: path of the file to read.
+        block_size: size of read blocks in bytes, adapted to the file size if
+            not specified.
+        prefetch: whether to read the next blocks on a background thread
+            while the current one is consumed. Only files of more than one
+            block are read ahead.
+
+    Yields:
+        Consecutive blocks of the file.
+    """
+    f, stat, block_size = _open_for_reading(filepath, block_size)
+    with f:
+        if prefetch and stat.st_size > block_size:
+            yield from _iter_read_ahead(f, block_size, PREFETCH_BUFFERS)
+            return
+
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        while (n_bytes := f.readinto(buffer)):
+            yield view[:n_bytes]
+
+
+class Prefetcher:
+    """Reads a list of files on a background thread, ahead of the consumer.
+
+    Blocks of the current file are read while the previous ones are digested,
+    and once the file is read, the thread goes on with the next file. At most
+    `n_buffers` blocks are in memory. Files are opened and stat'ed by the
+    thread before they are read.
+
+    Use it as a context manager, so that the thread is stopped if the
+    consumer gives up early:
+
+        with Prefetcher(filepaths) as prefetcher:
+            for filepath, stat, blocks in prefetcher:
+                ...
+
+    `stat` is None and `blocks` raises the error if the file cannot be read.
+    Blocks of a file that are not consumed are skipped.
+
+    Args:
+        filepaths: paths of the files to read, may be a lazy iterator, which
+            is then consumed on the background thread.
+        block_size: size of read blocks in bytes, adapted to the size of each
+            file if not specified.
+        n_buffers: number of blocks that may be read ahead.
+    """
+
+    def __init__(self, filepaths: Iterable[str], block_size: int = None,
+                 n_buffers: int = PREFETCH_BUFFERS) -> None:
+        self._filepaths = filepaths
+        self._block_size = block_size
+        self._free = queue.Queue()
+        self._full = queue.Queue()
+        for _ in range(n_buffers):
+            self._free.put(bytearray(block_size or MAX_BLOCK_SIZE))
+        self._stopped = False
+        self._thread = threading.Thread(target=self._read, name="prefetch",
+                                        daemon=True)
+
+    def _read(self) -> None:
+        try:
+            for filepath in self._filepaths:
+                if self._stopped:
+                    return
+                try:
+                    f, stat, block_size = _open_for_reading(filepath,
+                                                            self._block_size)
+                except OSError as e:
+                    self._full.put((_START, filepath, None))
+                    self._full.put((_END, e))
+                    continue
+                with f:
+                    self._full.put((_START, filepath, stat))
+                    try:
+                        if not _read_into_queue(f, block_size, self._free,
+                                                self._full):
+                            return
+                    except Exception as e:
+                        self._full.put((_END, e))
+                    else:
+                        self._full.put((_END, None))
+        except Exception as e:
+            # e.g. from a lazy iterator of paths
+            self._full.put((_DONE, e))
+        else:
+            self._full.put((_DONE, None))
+
+    def __iter__(self) -> Iterator[tuple]:
+        """Yields `(filepath, stat, blocks)` for each file, in order."""
+        self._thread.start()
+        while True:
+            message = self._full.get()
+            if message[0] == _DONE:
+                if message[1] is not None:
+                    raise message[1]
+                return
+            _, filepath, stat = message
+            blocks = _iter_queued_blocks(self._free, self._full)
+            yield filepath, stat, blocks
+            try:
+                for _ in blocks:  # skip blocks left by the consumer
+                    pass
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        """Stops the reading thread."""
+        if not self._stopped:
+            self._stopped = True
+            self._free.put(None)
+            if self._thread.is_alive():
+                self._thread.join()
+
+    def __enter__(self) -> "Prefetcher":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def update_hashes(filepath: str, hashes: Iterable,
+                  block_size: int = None,
+                  blocks: Iterable[memoryview] = None) -> None:
+    """Feeds contents of a file to hash objects, reading the file once.
+
+    Args:
+        filepath: path of the file to hash.
+        hashes: hashlib hash objects to update.
+        block_size: size of read blocks in bytes, adapted to the file size if
+            not specified.
+        blocks: blocks of the file if already being read, e.g. by a
+            `Prefetcher`. By default the file is read with `iter_file_blocks`,
+            ahead of hashing if `PREFETCH` is set.
+    """
+    hashes = list(hashes)
+    if blocks is None:
+        blocks = iter_file_blocks(filepath, block_size, PREFETCH)
+    stats = get_stats()
+    if stats is None:
+        for block in blocks:
+            for hash in hashes:
+                hash.update(block)
+        return
+
+    # Same loop, timing reads and digests separately
+    read_seconds = 0.0
+    digest_seconds = 0.0
+    n_bytes = 0
+    start = time.perf_counter()
+    for block in blocks:
+        read = time.perf_counter()
+        for hash in hashes:
+            hash.update(block)
+        n_bytes += len(block)
+        digested = time.perf_counter()
+        read_seconds += read - start
+        digest_seconds += digested - read
+        start = digested
+    read_seconds += time.perf_counter() - start
+    stats.add_time("read", read_seconds)
+    stats.add_time("digest", digest_seconds)
+    stats.add_file(filepath, n_bytes, read_seconds + digest_seconds)
@@ -0,0 +1,240 @@
+"""Long-lived hashing server for callers sending many small batches.
+
+Starting Python and importing the package costs more than hashing a few small
+files, so scripts that run `checksums compute` once per directory, e.g. from
+`find -exec`, spend most of their time starting up. `checksums serve` starts
+once and then answers requests, read line by line from the standard input or
+from clients of a local Unix socket:
+
+- A plain line is a path. The answer is a line `<hash>  <path>`, as written
+  by `sha512sum`, or `FAILED  <path>` if the file cannot be hashed. An empty
+  line is answered by an empty line, so a client can tell where the answers
+  to its batch end.
+- A line starting with `{` is a JSON request
+  `{"paths": [...], "algorithm": "md5,sha256", "id": ...}`, where the
+  algorithm and id are optional. Each path is answered, in order, by a JSON
+  line `{"id": ..., "filepath": ..., "hashes": {"md5": ..., ...}}` or
+  `{"id": ..., "filepath": ..., "error": ...}`, and the batch by
+  `{"id": ..., "done": true, "files": ..., "errors": ...}`.
+
+Relative paths are resolved against the working directory of the server.
+Answers are flushed after every request, and the hash cache is committed
+after every batch.
+"""
+import io
+import os
+import json
+import signal
+import socket
+import logging
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional, TextIO
+from .cache import HashCache
+from .checksums import compute_file_hashes, get_algorithms_from_str
+
+# Answer of a plain path that could not be hashed
+FAILED = "FAILED"
+
+
+class HashServer:
+    """Answers hashing requests from text streams.
+
+    The server may be shared by several streams, e.g. socket connections,
+    each served on its own thread.
+
+    Args:
+        algorithm: default algorithm name(s), comma-separated. Plain paths
+            are answered with the hash of the first one.
+        logger: logger instance.
+        jobs: number of files of a JSON request hashed concurrently.
+        cache: hash cache consulted before reading files and updated after.
+    """
+
+    def __init__(self, algorithm: str, logger: logging.Logger,
+                 jobs: int = 1, cache: HashCache = None) -> None:
+        self.algorithm = algorithm
+        self.logger = logger
+        self.cache = cache
+        # Hash functions by sorted tuple of valid algorithm names, so that
+        # requests cannot grow it beyond the combinations of the algorithms
+        self._algorithms = {}
+        self._executor = None
+        if jobs > 1:
+            self._executor = ThreadPoolExecutor(max_workers=jobs,
+                                                thread_name_prefix="serve")
+        # Raises for unknown algorithms. The order is kept, as plain paths
+        # are answered with the first algorithm.
+        self._default_algorithms = get_algorithms_from_str(algorithm)
+
+    def _get_algorithms(self, algorithm: Optional[str]) -> list:
+        if not algorithm:
+            return self._default_algorithms
+        names = tuple(sorted({name.strip().lower()
+                              for name in algorithm.split(",")} - {""}))
+        if names not in self._algorithms:
+            algorithms = get_algorithms_from_str(",".join(names))
+            self._algorithms[names] = algorithms
+        return self._algorithms[names]
+
+    def hash_file(self, filepath: str, algorithms: list) -> dict:
+        """Hashes a file, catching errors.
+
+        Returns:
+            `{"filepath": ..., "hashes": {...}}` or
+            `{"filepath": ..., "error": ...}`.
+        """
+        try:
+            hashes = compute_file_hashes(filepath, algorithms, self.cache)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Unable to hash {filepath:s}: {e}")
+            return {"filepath": filepath, "error": str(e)}
+        return {"filepath": filepath, "hashes": hashes}
+
+    def _commit_cache(self) -> None:
+        if self.cache is not None:
+            self.cache.commit()
+
+    def handle_line(self, line: str) -> Iterator[str]:
+        """Answers a request line.
+
+        Yields:
+            Answer lines, without line terminators.
+        """
+        if not line:
+            self._commit_cache()
+            yield ""
+        elif line.startswith("{"):
+            yield from self._handle_json(line)
+        else:
+            algorithms = self._get_algorithms(None)
+            result = self.hash_file(line, algorithms[:1])
+            if "hashes" in result:
+                hash = next(iter(result["hashes"].values()))
+                yield f"{hash:s}  {os.path.normpath(line):s}"
+            else:
+                yield f"{FAILED:s}  {os.path.normpath(line):s}"
+
+    def _handle_json(self, line: str) -> Iterator[str]:
+        try:
+            request = json.loads(line)
+            paths = request["paths"]
+            if not isinstance(paths, list):
+                raise TypeError("paths must be a list.")
+            request_id = request.get("id")
+            algorithms = self._get_algorithms(request.get("algorithm"))
+        except (ValueError, KeyError, TypeError, NotImplementedError) as e:
+            yield json.dumps({"error": f"Invalid request: {e}"})
+            return
+
+        if self._executor is None:
+            results = (self.hash_file(path, algorithms) for path in paths)
+        else:
+            results = self._executor.map(
+                lambda path: self.hash_file(path, algorithms), paths)
+        n_errors = 0
+        for result in results:
+            n_errors += "error" in result
+            yield json.dumps({"id": request_id, **result})
+        self._commit_cache()
+        yield json.dumps({"id": request_id, "done": True,
+                          "files": len(paths), "errors": n_errors})
+
+    def serve_stream(self, input: TextIO, output: TextIO) -> None:
+        """Answers request lines until the end of input."""
+        for line in input:
+            for answer in self.handle_line(line.rstrip("\r\n")):
+                output.write(answer + "\n")
+            output.flush()
+        self._commit_cache()
+
+    def close(self) -> None:
+        """Stops the worker threads."""
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+class _StreamHandler(socketserver.StreamRequestHandler):
+
+    def handle(self) -> None:
+        input = io.TextIOWrapper(self.rfile, encoding="utf-8")
+        output = io.TextIOWrapper(self.wfile, encoding="utf-8")
+        try:
+            self.server.hash_server.serve_stream(input, output)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            # The handler closes the socket files itself
+            input.detach()
+            output.detach()
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def _raise_system_exit(signum, frame):
+    raise SystemExit(0)
+
+
+def exit_on_sigterm() -> None:
+    """Makes SIGTERM exit through `finally` blocks, so that a server stopped
+    by a service manager commits its cache and removes its socket."""
+    signal.signal(signal.SIGTERM, _raise_system_exit)
+
+
+def _remove_stale_socket(socket_path: str) -> None:
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)  # left over by a killed server
+            return
+    raise ValueError(f"A server is already listening on {socket_path:s}.")
+
+
+def serve_socket(hash_server: HashServer, socket_path: str) -> None:
+    """Answers clients of a Unix socket, each on its own thread, until
+    interrupted.
+
+    The socket is created at `socket_path` and removed on exit. A socket
+    left over by a killed server is replaced.
+    """
+    _remove_stale_socket(socket_path)
+    with _UnixServer(socket_path, _StreamHandler) as server:
+        server.hash_server = hash_server
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+def request_hashes(socket_path: str, paths: Iterable[str],
+                   algorithm: Optional[str] = None) -> Iterator[dict]:
+    """Sends paths to a server on a Unix socket as one JSON request.
+
+    Args:
+        socket_path: path of the socket of `checksums serve --socket`.
+        paths: paths of the files to hash.
+        algorithm: algorithm name(s), the default of the server if None.
+
+    Yields:
+        Answers for the paths, in order, see the module docstring.
+    """
+    request = {"paths": list(paths)}
+    if algorithm is not None:
+        request["algorithm"] = algorithm
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        with client.makefile("rw", encoding="utf-8") as stream:
+            stream.write(json.dumps(request) + "\n")
+            stream.flush()
+            for line in stream:
+                answer = json.loads(line)
+                if "error" in answer and "filepath" not in answer:
+                    raise ValueError(answer["error"])
+                if answer.get("done"):
+                    return
+                yield answer
@@ -0,0 +1,199 @@
+"""Run statistics: throughput, time per phase and slowest files.
+
+Instrumented code reports to the collector installed with `enable`, so that
+nothing has to be passed down through every function. When no collector is
+installed, `phase` and `timed_iter` do nothing and cost one function call.
+
+Phases are named after what the time is spent on, e.g. `walk`, `stat`,
+`read`, `digest`, `write`, `exif`, `copy`. Their times are cumulative over
+all threads, so with several jobs they may add up to more than the elapsed
+time. Their relative size still shows the bottleneck.
+"""
+import json
+import time
+import heapq
+import threading
+import contextlib
+from typing import Iterable, Iterator, Optional
+
+# Number of slowest files reported
+N_SLOWEST = 10
+
+_active: Optional["Stats"] = None
+
+
+class Stats:
+    """Thread-safe collector of run statistics.
+
+    Args:
+        n_slowest: number of slowest files to keep.
+    """
+
+    def __init__(self, n_slowest: int = N_SLOWEST) -> None:
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._n_slowest = n_slowest
+        self.phases = {}  # name -> [seconds, calls]
+        self.counters = {}
+        self.n_files = 0
+        self.n_bytes = 0
+        self._slowest = []  # min-heap of (seconds, n_bytes, path)
+
+    def add_time(self, name: str, seconds: float, calls: int = 1) -> None:
+        """Adds time spent in a phase."""
+        with self._lock:
+            phase = self.phases.setdefault(name, [0.0, 0])
+            phase[0] += seconds
+            phase[1] += calls
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Increments a counter, e.g. of cache hits."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_file(self, path: str, n_bytes: int, seconds: float) -> None:
+        """Records a processed file, with time spent on it."""
+        with self._lock:
+            self.n_files += 1
+            self.n_bytes += n_bytes
+            item = (seconds, n_bytes, path)
+            if len(self._slowest) < self._n_slowest:
+                heapq.heappush(self._slowest, item)
+            elif item > self._slowest[0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def report(self) -> dict:
+        """Returns statistics as a JSON-serializable dictionary."""
+        with self._lock:
+            elapsed = time.perf_counter() - self._start
+            files_rate = self.n_files / elapsed if elapsed > 0 else None
+            bytes_rate = self.n_bytes / elapsed if elapsed > 0 else None
+            return {
+                "elapsed_seconds": elapsed,
+                "files": self.n_files,
+                "bytes": self.n_bytes,
+                "files_per_second": files_rate,
+                "bytes_per_second": bytes_rate,
+                "phases": {name: {"seconds": seconds, "calls": calls}
+                           for name, (seconds, calls) in
+                           sorted(self.phases.items(),
+                                  key=lambda item: -item[1][0])},
+                "counters": dict(self.counters),
+                "slowest_files": [
+                    {"path": path, "seconds": seconds, "bytes": n_bytes}
+                    for seconds, n_bytes, path in
+                    sorted(self._slowest, reverse=True)],
+            }
+
+    def write_json(self, filepath: str) -> None:
+        """Writes `report` to a JSON file."""
+        with open(filepath, "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+
+def enable(n_slowest: int = N_SLOWEST) -> Stats:
+    """Installs a new collector and returns it."""
+    global _active
+    _active = Stats(n_slowest)
+    return _active
+
+
+def disable() -> None:
+    """Removes the collector, so that instrumentation does nothing."""
+    global _active
+    _active = None
+
+
+def get_stats() -> Optional[Stats]:
+    """Returns the installed collector, or None."""
+    return _active
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Adds time spent in the block to the phase."""
+    stats = _active
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_time(name, time.perf_counter() - start)
+
+
+def timed_iter(items: Iterable, name: str) -> Iterator:
+    """Iterates over items, adding time spent producing them to the phase.
+
+    Useful for lazy producers, e.g. directory walks, whose work happens
+    between the consumer's steps.
+    """
+    stats = _active
+    if stats is None:
+        yield from items
+        return
+    iterator = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            stats.add_time(name, time.perf_counter() - start, calls=0)
+            return
+        stats.add_time(name, time.perf_counter() - start)
+        yield item
+
+
+@contextlib.contextmanager
+def stats_to_json(filepath: Optional[str]) -> Iterator[Optional[Stats]]:
+    """Collects statistics in the block and writes them to a JSON file.
+
+    Does nothing if filepath is None.
+    """
+    if filepath is None:
+        yield None
+        return
+    stats = enable()
+    try:
+        yield stats
+    finally:
+        disable()
+        stats.write_json(filepath)
+
+
+@contextlib.contextmanager
+def profiled(filepath: Optional[str]) -> Iterator[None]:
+    """Profiles the block with cProfile, including threads started in it,
+    and saves the statistics to a file for `pstats` or `snakeviz`.
+
+    Does nothing if filepath is None.
+    """
+    if filepath is None:
+        yield
+        return
+    import pstats
+    import cProfile
+    profiles = [cProfile.Profile()]
+    profiles_lock = threading.Lock()
+
+    def start_thread_profile(*args):
+        # Called on the first profiling event of each new thread
+        profile = cProfile.Profile()
+        with profiles_lock:
+            profiles.append(profile)
+        profile.enable()
+
+    threading.setprofile(start_thread_profile)
+    profiles[0].enable()
+    try:
+        yield
+    finally:
+        profiles[0].disable()
+        threading.setprofile(None)
+        with profiles_lock:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                profile.disable()
+                stats.add(profile)
+        stats.dump_stats(filepath)
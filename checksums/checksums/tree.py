@@ -0,0 +1,240 @@
+"""Chunked tree hashing of large files.
+
+A file is split into chunks of `CHUNK_SIZE` bytes, each chunk is hashed with
+BLAKE2b and the chunk digests are combined pairwise into a Merkle tree, whose
+root is the hash of the file. The file is still read once, sequentially, but
+chunks are hashed concurrently in a thread pool (hashlib releases the GIL), so
+hashing a multi-GB video scales with the number of cores.
+
+Leaves and inner nodes are hashed with different BLAKE2b personalizations, so
+that a node cannot be passed off as a chunk. A node without a sibling is
+carried to the next level unchanged; a file of one chunk (or an empty file)
+has the digest of that chunk as its hash.
+
+The digests of the chunks can be saved in a sidecar, an NDJSON manifest of
+records `{"filepath": ..., "size": ..., "chunk_size": ..., "root": ...,
+"chunks": [...]}`. When the root does not match, comparing chunk digests
+tells which byte ranges are damaged, and `verify_chunks` rereads only the
+chunks of interest, e.g. after a partial restore.
+"""
+import os
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+from .manifest import ManifestWriter, load_manifest
+
+TREE_ALGORITHM = "blake2b-tree"
+CHUNK_SIZE = 4 * 1024 * 1024
+DIGEST_SIZE = 32
+LEAF_PERSON = b"checksums-leaf"
+NODE_PERSON = b"checksums-node"
+
+# Number of threads hashing chunks, shared by all files
+JOBS = os.cpu_count() or 1
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=JOBS,
+                                       thread_name_prefix="tree-hash")
+    return _executor
+
+
+def leaf_digest(chunk: bytes) -> bytes:
+    """Returns the digest of a chunk."""
+    return hashlib.blake2b(chunk, digest_size=DIGEST_SIZE,
+                           person=LEAF_PERSON).digest()
+
+
+def merkle_root(leaves: list[bytes]) -> bytes:
+    """Combines chunk digests into the root of the tree.
+
+    Args:
+        leaves: digests of consecutive chunks, at least one.
+
+    Returns:
+        Root digest.
+    """
+    level = list(leaves)
+    while len(level) > 1:
+        next_level = [hashlib.blake2b(level[i] + level[i + 1],
+                                      digest_size=DIGEST_SIZE,
+                                      person=NODE_PERSON).digest()
+                      for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2 == 1:
+            next_level.append(level[-1])
+        level = next_level
+    return level[0]
+
+
+class TreeHash:
+    """Hash object computing the tree hash, with the interface of hashlib.
+
+    Data passed to `update` is collected into chunks, and every full chunk is
+    hashed in the shared thread pool while the caller reads on. At most
+    `2 * JOBS` chunks wait for a thread, which bounds memory use.
+
+    Args:
+        data: initial data, as for hashlib constructors.
+        chunk_size: size of the chunks in bytes.
+    """
+    name = TREE_ALGORITHM
+    digest_size = DIGEST_SIZE
+
+    def __init__(self, data: bytes = b"",
+                 chunk_size: int = CHUNK_SIZE) -> None:
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._buffer = bytearray()
+        self._leaves: list = []  # digests, or futures of digests
+        self._n_done = 0  # number of leading leaves that are digests
+        self._root: Optional[bytes] = None
+        if data:
+            self.update(data)
+
+    def _submit(self, chunk: bytearray) -> None:
+        self._leaves.append(_get_executor().submit(leaf_digest, chunk))
+        while len(self._leaves) - self._n_done > 2 * JOBS:
+            self._leaves[self._n_done] = self._leaves[self._n_done].result()
+            self._n_done += 1
+
+    def update(self, data: bytes) -> None:
+        """Feeds data, e.g. a block read from the file."""
+        if self._root is not None:
+            raise ValueError("Tree hash cannot be updated after digest.")
+        view = memoryview(data).cast("B")
+        self.size += len(view)
+        while len(view) > 0:
+            n_bytes = min(len(view), self.chunk_size - len(self._buffer))
+            self._buffer += view[:n_bytes]
+            view = view[n_bytes:]
+            if len(self._buffer) == self.chunk_size:
+                self._submit(self._buffer)
+                self._buffer = bytearray()
+
+    def chunk_digests(self) -> list[bytes]:
+        """Returns digests of the chunks, finishing the hash."""
+        if self._root is None:
+            if self._buffer or not self._leaves:
+                self._submit(self._buffer)
+                self._buffer = bytearray()
+            self._leaves = [leaf.result() if isinstance(leaf, Future)
+                            else leaf for leaf in self._leaves]
+            self._n_done = len(self._leaves)
+            self._root = merkle_root(self._leaves)
+        return self._leaves
+
+    def digest(self) -> bytes:
+        self.chunk_digests()
+        return self._root
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+    def record(self, filepath: str) -> dict:
+        """Returns the sidecar record of the hashed file."""
+        return {"filepath": filepath, "size": self.size,
+                "chunk_size": self.chunk_size, "root": self.hexdigest(),
+                "chunks": [leaf.hex() for leaf in self.chunk_digests()]}
+
+
+def is_tree_algorithm(name: str) -> bool:
+    """Returns whether algorithm name is the tree hash."""
+    return name.lower() == TREE_ALGORITHM
+
+
+def find_damaged_chunks(record: dict, tree_hash: TreeHash) -> list[int]:
+    """Compares chunk digests of a file with the ones in its sidecar record.
+
+    Returns:
+        Indices of chunks that differ, including chunks missing on either
+        side if the size changed.
+    """
+    expected = record["chunks"]
+    actual = [leaf.hex() for leaf in tree_hash.chunk_digests()]
+    n_chunks = max(len(expected), len(actual))
+    return [i for i in range(n_chunks)
+            if i >= len(expected) or i >= len(actual) or
+            expected[i] != actual[i]]
+
+
+def chunk_ranges(indices: Iterable[int],
+                 chunk_size: int) -> list[tuple[int, int]]:
+    """Returns byte ranges `(start, end)` of chunks, merging adjacent ones."""
+    ranges = []
+    for i in sorted(indices):
+        start, end = i * chunk_size, (i + 1) * chunk_size
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def _read_chunk(filepath: str, index: int, chunk_size: int) -> bytes:
+    with open(filepath, "rb", buffering=0) as f:
+        f.seek(index * chunk_size)
+        chunk = bytearray(chunk_size)
+        n_bytes = 0
+        while n_bytes < chunk_size:
+            n_read = f.readinto(memoryview(chunk)[n_bytes:])
+            if not n_read:
+                break
+            n_bytes += n_read
+        del chunk[n_bytes:]
+        return chunk
+
+
+def verify_chunks(filepath: str, record: dict,
+                  indices: Optional[Iterable[int]] = None) -> list[int]:
+    """Rereads chunks of a file and compares them with its sidecar record.
+
+    Only the requested chunks are read, concurrently in the shared thread
+    pool, so a check after a partial restore reads only the restored ranges.
+
+    Args:
+        filepath: path of the file.
+        record: sidecar record of the file.
+        indices: chunks to verify, all chunks by default.
+
+    Returns:
+        Indices of chunks that differ from the record.
+    """
+    chunk_size = record["chunk_size"]
+    expected = record["chunks"]
+    if indices is None:
+        indices = range(len(expected))
+    indices = sorted(set(indices))
+    futures = [_get_executor().submit(
+        lambda i: leaf_digest(_read_chunk(filepath, i, chunk_size)), i)
+        for i in indices if i < len(expected)]
+    damaged = [i for i, future in zip(indices, futures)
+               if future.result().hex() != expected[i]]
+    if (len(indices) == len(expected) and
+            os.path.getsize(filepath) > len(expected) * chunk_size):
+        damaged.append(len(expected))  # data after the last recorded chunk
+    return damaged
+
+
+def open_sidecar(filepath: str) -> ManifestWriter:
+    """Opens a sidecar for writing records returned by `TreeHash.record`."""
+    return ManifestWriter(filepath)
+
+
+def iter_sidecar(filepath: str) -> Iterator[dict]:
+    """Iterates over sidecar records, which may also come from `get_hash.py`,
+    whose records have a "posixpath" instead of a "filepath". Records
+    replaced or deleted by later updates are skipped."""
+    for record in load_manifest(filepath).values():
+        if "filepath" not in record:
+            record["filepath"] = record.get("posixpath")
+        yield record
+
+
+def load_sidecar(filepath: str) -> dict[str, dict]:
+    """Loads sidecar records by normalized file path."""
+    return {os.path.normpath(record["filepath"]): record
+            for record in iter_sidecar(filepath)}
@@ -1,8 +1,13 @@
 """
+Removes thumbnail caches and similar files left by viewers (CLEAN_LIST) from the archive.
+
+The cleaning is also a stage (CleanStage) of the single-walk maintenance in maintain_archive.py.
 """
 
 import os
 
+from archive_pipeline import Stage, run_stages
+
 CLEAN_ROOT = os.path.realpath(r"F:\Photo_archive_IntelPhoto")
 
 CLEAN_LIST = [
@@ -11,25 +16,45 @@ CLEAN_LIST = [
     ".picasa.ini"
 ]
 
-cleaned_cnt = 0
-processed_cnt = 0
-for path, directories, files in os.walk(CLEAN_ROOT):
-    for file in files:
-        processed_cnt += 1
-        if file in CLEAN_LIST:
-            file_realpath = os.path.join(os.path.realpath(path), file)
-            print ("cleaning file_realpath = [%s]" % file_realpath)
-            os.remove(file_realpath)
-            cleaned_cnt += 1
-
-print ("\n\n\n")
-
-print ("Processed [%d] files in total." % processed_cnt)
-print ("Cleaned [%d] files in total." % cleaned_cnt)
-
-
-
-
-
-
-
+class CleanStage(Stage):
+    """
+    Pipeline stage removing files named as in clean_list. With dry_run=True files are only counted.
+    Removed files are not passed to later stages.
+    """
+    name = "clean"
+
+    def __init__(self, clean_list=CLEAN_LIST, dry_run=False):
+        self.clean_list = clean_list
+        self.dry_run = dry_run
+        self.processed_cnt = 0
+        self.cleaned_cnt = 0
+
+    def process_file(self, entry):
+        self.processed_cnt += 1
+        if entry.name not in self.clean_list:
+            return True
+        self.cleaned_cnt += 1
+        if self.dry_run:
+            return True
+        print ("cleaning file_realpath = [%s]" % entry.path)
+        os.remove(entry.path)
+        return False
+
+def clean(clean_root, clean_list=CLEAN_LIST, dry_run=False):
+    """
+    Removes files named as in clean_list under clean_root. With dry_run=True files are only counted.
+    Returns (number of processed files, number of cleaned files).
+    """
+    stage = CleanStage(clean_list, dry_run)
+    run_stages(os.path.realpath(clean_root), [stage])
+    return stage.processed_cnt, stage.cleaned_cnt
+
+####################################################################################################
+
+if __name__ == "__main__":
+    processed_cnt, cleaned_cnt = clean(CLEAN_ROOT)
+
+    print ("\n\n\n")
+
+    print ("Processed [%d] files in total." % processed_cnt)
+    print ("Cleaned [%d] files in total." % cleaned_cnt)
@@ -9,47 +9,162 @@ python get_hash.py <path_to_archive>
 To hash the one specific volume inside the archive:
 python get_hash.py <path_to_archive> <volume_dir_name_with_no_path>
 
+To write manifests as NDJSON, one record per line appended as files are hashed,
+so that memory use stays constant and a partial manifest survives a crash:
+python get_hash.py --format ndjson <path_to_archive>
+Such manifests can be read lazily with checksums.manifest.iter_manifest.
+
+To compute several hashes reading each file only once:
+python get_hash.py --algorithm SHA256,MD5,SHA512 <path_to_archive>
+
+BLAKE2B_TREE is a Merkle tree of BLAKE2b digests of 4 MiB chunks (see checksums/checksums/tree.py).
+Chunks of large files, e.g. videos, are hashed on all cores, and chunk digests are saved to
+<volume>_chunks.ndjson next to the manifest, so that damage can be located later with
+checksums verify-chunks --root <path_to_archive> <volume>_chunks.ndjson:
+python get_hash.py --algorithm BLAKE2B_TREE <path_to_archive>
+
+To reuse hashes of files that did not change since the previous run:
+python get_hash.py --cache <path_to_cache_db> <path_to_archive>
+
+Add --rebuild-cache to hash all files again and repopulate the cache,
+--no-cache to ignore the cache configured in HASH_CACHE_PATH and
+--prune-cache to drop cache entries of files that no longer exist.
+The cache is shared with the checksums package from this repository.
+
+To save run statistics (files/s, bytes/s, time spent walking, reading, hashing and
+writing, and the slowest files) or a cProfile profile of the run:
+python get_hash.py --stats stats.json --profile hash.prof <path_to_archive>
+
 The script was tested with Python 3.9
 """
 import os
 import sys
 import hashlib
-import json
 import datetime
 import posixpath
 import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "checksums"))
+from checksums.cache import HashCache
+from checksums.reader import update_hashes
+from checksums.manifest import ManifestWriter
+from checksums.tree import TreeHash
+from checksums.stats import phase, profiled, stats_to_json, timed_iter
+from archive_pipeline import Stage
 
 ####################################### Defines ####################################################
 MD5 = "MD5"
 SHA256 = "SHA256"
 SHA512 = "SHA512"
+BLAKE2B_TREE = "BLAKE2B_TREE"
 
 ####################################### Config #####################################################
 
-HASH_ALGORITHM = SHA256
-READ_BLOCK_SIZE = 4096
+HASH_ALGORITHM = SHA256  # or a list, e.g. [SHA256, MD5], to compute several hashes in one pass
+READ_BLOCK_SIZE = None  # None: adapt block size to file size
 LOG_LEVEL = logging.INFO
 LOG_ENCODING = "utf-8"
 FILTER_OUT_LR_CATALOG = True
+HASH_CACHE_PATH = None  # path to hash cache database, None to disable
+OUTPUT_FORMAT = "json"  # "json" or "ndjson": one record per line, readable after a crash
 
 ####################################### Globals ####################################################
 
 ####################################################################################################
 
-def get_file_hash(fname, hash_type):
+def new_hash(hash_type):
     if hash_type == MD5:
-        hash = hashlib.md5()
+        return hashlib.md5()
     elif hash_type == SHA256:
-        hash = hashlib.sha256()
+        return hashlib.sha256()
     elif hash_type == SHA512:
-        hash = hashlib.sha512()
+        return hashlib.sha512()
+    elif hash_type == BLAKE2B_TREE:
+        return TreeHash()
     else:
         logging.critical("Undefined alogrithm")
         raise Exception("Undefined alogrithm")
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
-            hash.update(chunk)
-    return hash.hexdigest()
+
+def get_file_hash(fname, hash_type, cache=None, stat=None, chunks=None):
+    """
+    hash_type is a single algorithm, e.g. SHA256, or a list of algorithms.
+    For a list, the file is read once and a dict {hash_type: hexdigest} is returned.
+    stat is os.stat of the file if already known, it is only needed with a cache.
+    chunks is a dict, updated with the chunk sidecar record if BLAKE2B_TREE is computed.
+    BLAKE2B_TREE is then never taken from the cache, which has no chunk digests.
+    """
+    hash_types = list(hash_type) if isinstance(hash_type, (list, tuple)) else [hash_type]
+    hashes = {ht: new_hash(ht) for ht in hash_types}
+    digests = {}
+    if cache is not None:
+        if stat is None:
+            with phase("stat"):
+                stat = os.stat(fname)
+        with phase("cache"):
+            for ht in hash_types:
+                if ht == BLAKE2B_TREE and chunks is not None:
+                    continue
+                digest = cache.get(fname, ht, stat)
+                if digest is not None:
+                    digests[ht] = digest
+                    del hashes[ht]
+    if len(hashes) > 0:
+        update_hashes(fname, hashes.values(), READ_BLOCK_SIZE)
+    for ht, hash in hashes.items():
+        digests[ht] = hash.hexdigest()
+        if cache is not None:
+            with phase("cache"):
+                cache.put(fname, ht, digests[ht], stat)
+        if ht == BLAKE2B_TREE and chunks is not None:
+            chunks.update(hash.record(fname))
+    if isinstance(hash_type, (list, tuple)):
+        return {ht: digests[ht] for ht in hash_types}
+    return digests[hash_type]
+
+def get_hash_record(posixpath_str, hash):
+    """
+    hash is either a single hexdigest or a dict {hash_type: hexdigest} from get_file_hash.
+    The first algorithm is always saved as "hash", so that the manifests stay comparable.
+    """
+    if isinstance(hash, dict):
+        return {"posixpath": posixpath_str, "hash": next(iter(hash.values())), "hashes": hash}
+    return {"posixpath": posixpath_str, "hash": hash}
+
+def get_chunks_file(hashes_file_abspath):
+    """
+    Returns path of the chunk sidecar of a manifest: <name>_chunks.ndjson for <name>_hashes.<format>.
+    """
+    name = os.path.splitext(hashes_file_abspath)[0]
+    if name.endswith("_hashes"):
+        name = name[:-len("_hashes")]
+    return name + "_chunks.ndjson"
+
+def open_chunks_file(hashes_file_abspath, hash_type):
+    """
+    Returns a writer of the chunk sidecar of a manifest if hash_type includes BLAKE2B_TREE, or None.
+    """
+    hash_types = hash_type if isinstance(hash_type, (list, tuple)) else [hash_type]
+    if BLAKE2B_TREE not in hash_types:
+        return None
+    chunks_file = get_chunks_file(hashes_file_abspath)
+    logging.info("Saving chunk digests to file... [%s]" % chunks_file)
+    return ManifestWriter(chunks_file)
+
+def hash_file_to_manifest(src_abspath, posixpath_str, manifest, chunks_manifest=None, cache=None, stat=None,
+                          hash_type=None):
+    """
+    Hashes a file and writes its record to manifest, and its chunk digests to chunks_manifest if given.
+    """
+    chunks = {} if chunks_manifest is not None else None
+    hash = get_file_hash(src_abspath, hash_type if hash_type is not None else HASH_ALGORITHM, cache, stat, chunks)
+    with phase("write"):
+        logging.debug("Processing file [%s]" % (src_abspath))
+        print("Processing file [%s]" % (src_abspath))
+        manifest.write(get_hash_record(posixpath_str, hash))
+        if chunks:
+            del chunks["filepath"]
+            chunks_manifest.write(dict(posixpath=posixpath_str, **chunks))
 
 def is_lightroom_catalog(files):
     for file in files:
@@ -58,46 +173,146 @@ def is_lightroom_catalog(files):
                 return True
     return False
 
-def save_hashes_for_files(root_dir_abspath, file_abspath_lst, hashes_file_abspath):
+def save_hashes_for_files(root_dir_abspath, file_abspath_lst, hashes_file_abspath, cache=None):
     logging.info("Saving hashes files in archive root")
-    hashes_lst = []
-    for src_abspath in file_abspath_lst:
-        src_relpath = os.path.relpath(src_abspath, root_dir_abspath) # path relative to root, which is easy to compare between different drives"
-        hash = get_file_hash(src_abspath, HASH_ALGORITHM)
-        logging.debug("Processing file [%s]" % (src_abspath))
-        print("Processing file [%s]" % (src_abspath))
-        hashes_lst.append({"posixpath": posixpath.normpath(src_relpath), "hash": hash})
-
     logging.info("Saving hashes to file... [%s]" % hashes_file_abspath)
-    with open(hashes_file_abspath, "w") as f:
-        json.dump(hashes_lst, f, indent=4)
+    chunks_manifest = open_chunks_file(hashes_file_abspath, HASH_ALGORITHM)
+    try:
+        with ManifestWriter(hashes_file_abspath) as manifest:
+            for src_abspath in file_abspath_lst:
+                src_relpath = os.path.relpath(src_abspath, root_dir_abspath) # path relative to root, which is easy to compare between different drives"
+                hash_file_to_manifest(src_abspath, posixpath.normpath(src_relpath), manifest, chunks_manifest, cache)
+    finally:
+        if chunks_manifest is not None:
+            chunks_manifest.close()
     logging.info("Done [%s]" % hashes_file_abspath)
 
-def save_hashes_for_volume(achive_root_abspath, volume_dir_abspath, hashes_file_abspath):
+def save_hashes_for_volume(achive_root_abspath, volume_dir_abspath, hashes_file_abspath, cache=None):
     logging.info("Saving hashes for directory at path [%s]" % volume_dir_abspath)
-    hashes_lst = []
-    for path, directories, files in os.walk(volume_dir_abspath):
-        if FILTER_OUT_LR_CATALOG and is_lightroom_catalog(files):
-            logging.debug("Skip hashing [%s]" % path)
-            directories.clear()
-            files.clear()
-            continue
-        for file in files:
-            filename, file_extension = os.path.splitext(file)
-            if file_extension.upper() == ".JSON":
-                continue
-            src_abspath = os.path.join(os.path.abspath(path), file)
-            src_relpath = os.path.relpath(src_abspath, achive_root_abspath) # path relative to root, which is easy to compare between different drives"
-            hash = get_file_hash(src_abspath, HASH_ALGORITHM)
-            logging.debug("Processing file [%s]" % (src_abspath))
-            print("Processing file [%s]" % (src_abspath))
-            hashes_lst.append({"posixpath": posixpath.normpath(src_relpath), "hash": hash})
-
     logging.info("Saving hashes to file... [%s]" % hashes_file_abspath)
-    with open(hashes_file_abspath, "w") as f:
-        json.dump(hashes_lst, f, indent=4)
+    chunks_manifest = open_chunks_file(hashes_file_abspath, HASH_ALGORITHM)
+    try:
+        with ManifestWriter(hashes_file_abspath) as manifest:
+            for path, directories, files in timed_iter(os.walk(volume_dir_abspath), "walk"):
+                if FILTER_OUT_LR_CATALOG and is_lightroom_catalog(files):
+                    logging.debug("Skip hashing [%s]" % path)
+                    directories.clear()
+                    files.clear()
+                    continue
+                for file in files:
+                    filename, file_extension = os.path.splitext(file)
+                    if file_extension.upper() in (".JSON", ".NDJSON"):
+                        continue
+                    src_abspath = os.path.join(os.path.abspath(path), file)
+                    src_relpath = os.path.relpath(src_abspath, achive_root_abspath) # path relative to root, which is easy to compare between different drives"
+                    hash_file_to_manifest(src_abspath, posixpath.normpath(src_relpath), manifest, chunks_manifest, cache)
+    finally:
+        if chunks_manifest is not None:
+            chunks_manifest.close()
     logging.info("Done [%s]" % hashes_file_abspath)
 
+class HashStage(Stage):
+    """
+    archive_pipeline stage saving the same manifests as hashing the whole archive by main:
+    <volume>_hashes.<format> for every top-level directory and files_hashes.<format>
+    for files in the archive root, all in hash_dir_root.
+    Relies on the pipeline finishing each top-level directory before the next one.
+    """
+    name = "hash"
+
+    def __init__(self, archieve_root, hash_dir_root, output_format=OUTPUT_FORMAT, cache=None, hash_type=None):
+        self.archieve_root = os.path.abspath(archieve_root)
+        self.hash_dir_root = hash_dir_root
+        self.output_format = output_format
+        self.cache = cache
+        self.hash_type = hash_type if hash_type is not None else HASH_ALGORITHM
+        self.prefix_len = len(os.path.join(self.archieve_root, ""))
+        self.volume = None  # top-level directory being hashed, None for the archive root
+        self.manifest = None
+        self.chunks_manifest = None
+
+    def open_manifest(self, name):
+        self.close()
+        hashes_file = os.path.join(self.hash_dir_root, name + "_hashes." + self.output_format)
+        logging.info("Saving hashes to file... [%s]" % hashes_file)
+        self.manifest = ManifestWriter(hashes_file)
+        self.chunks_manifest = open_chunks_file(hashes_file, self.hash_type)
+
+    def enter_directory(self, dirpath, entries):
+        relpath = dirpath[self.prefix_len:]
+        if dirpath == self.archieve_root:
+            self.volume = None
+        elif os.sep not in relpath:
+            if "hashes" in relpath:
+                return False
+            logging.info("Saving hashes for directory at path [%s]" % dirpath)
+            self.volume = relpath
+            self.open_manifest(relpath)
+        if FILTER_OUT_LR_CATALOG and is_lightroom_catalog([entry.name for entry in entries if entry.is_file()]):
+            logging.debug("Skip hashing [%s]" % dirpath)
+            return False
+        return True
+
+    def process_file(self, entry):
+        if self.volume is None:  # archive root
+            if "hashes" in entry.name:
+                return True
+            if self.manifest is None:
+                logging.info("Saving hashes files in archive root")
+                self.open_manifest("files")
+        else:
+            filename, file_extension = os.path.splitext(entry.name)
+            if file_extension.upper() in (".JSON", ".NDJSON"):
+                return True
+        src_relpath = entry.path[self.prefix_len:] # path relative to root, which is easy to compare between different drives"
+        hash_file_to_manifest(entry.path, posixpath.normpath(src_relpath), self.manifest, self.chunks_manifest,
+                              self.cache, entry.stat() if self.cache is not None else None, self.hash_type)
+        return True
+
+    def close(self):
+        if self.chunks_manifest is not None:
+            self.chunks_manifest.close()
+            self.chunks_manifest = None
+        if self.manifest is not None:
+            self.manifest.close()
+            logging.info("Done [%s]" % self.manifest.filepath)
+            self.manifest = None
+
+def make_hash_dir_root(archieve_root, start_datetime_txt):
+    hash_dir_root = os.path.join(os.path.abspath(archieve_root), "hashes__%s" % start_datetime_txt)
+
+    if not os.path.exists(hash_dir_root):
+        os.makedirs(hash_dir_root)
+    return hash_dir_root
+
+def get_hashing_tasks(archieve_root, hash_dir_root, volume_to_hash=None, output_format=OUTPUT_FORMAT):
+    """
+    Returns a list of tasks (source_path, function, args), one per volume of the archive
+    and one for files in the archive root. Run a task as function(*args, cache).
+    source_path is the directory (or archive root) that the task reads from.
+    """
+    tasks = []
+    if volume_to_hash is None:
+        logging.debug("Mode: all volumes in the archive")
+        files_and_dirs = [os.path.join(archieve_root, item) for item in os.listdir(archieve_root) if "hashes" not in item]
+        directories = [item for item in files_and_dirs if os.path.isdir(item)]
+        files = [item for item in files_and_dirs if os.path.isfile(item)]
+
+        for dir_abspath in directories:
+            dir = os.path.relpath(dir_abspath, archieve_root)
+            hashes_file = os.path.join(hash_dir_root, dir + "_hashes." + output_format)
+            tasks.append((dir_abspath, save_hashes_for_volume, (archieve_root, dir_abspath, hashes_file)))
+
+        if len(files) > 0:
+            hashes_file = os.path.join(hash_dir_root, "files_hashes." + output_format)
+            tasks.append((archieve_root, save_hashes_for_files, (archieve_root, files, hashes_file)))
+    else: # specific volume
+        logging.debug("Mode: specific volume: [%s]" % volume_to_hash)
+        dir_abspath = os.path.join(archieve_root, volume_to_hash)
+        dir = volume_to_hash
+        hashes_file = os.path.join(hash_dir_root, dir + "_hashes." + output_format)
+        tasks.append((dir_abspath, save_hashes_for_volume, (archieve_root, dir_abspath, hashes_file)))
+    return tasks
 
 ####################################################################################################
 
@@ -105,25 +320,34 @@ if __name__ == "__main__":
     start_datetime = datetime.datetime.now()
     start_datetime_txt = start_datetime.strftime("%Y-%m-%d__%H-%M-%S")
 
-    if len(sys.argv) < 2:
-        print ("Not enough arguments")
-        exit(0)
-    archieve_root = os.path.abspath(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Get hashes of files in the archive.")
+    parser.add_argument("archive_root", help="path to archive")
+    parser.add_argument("volume", nargs="?", default=None, help="volume dir name with no path, hash all volumes if omitted")
+    parser.add_argument("--algorithm", default=None, help="hash algorithm(s), e.g. SHA256, BLAKE2B_TREE or MD5,SHA256,SHA512 (default: HASH_ALGORITHM)")
+    parser.add_argument("--format", choices=("json", "ndjson"), default=OUTPUT_FORMAT, help="manifest format (default: OUTPUT_FORMAT)")
+    parser.add_argument("--cache", default=HASH_CACHE_PATH, help="path to hash cache database")
+    parser.add_argument("--rebuild-cache", action="store_true", help="hash all files again and repopulate the cache")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the hash cache")
+    parser.add_argument("--prune-cache", action="store_true", help="drop cache entries of files that no longer exist")
+    parser.add_argument("--stats", default=None, help="write run statistics (throughput, time per phase, slowest files) to this JSON file")
+    parser.add_argument("--profile", default=None, help="profile the run with cProfile and save the statistics to this file")
+    args = parser.parse_args()
+
+    if args.algorithm is not None:
+        hash_types = [ht.strip().upper() for ht in args.algorithm.split(",")]
+        HASH_ALGORITHM = hash_types[0] if len(hash_types) == 1 else hash_types
+
+    archieve_root = os.path.abspath(args.archive_root)
     if not os.path.isdir(archieve_root):
         print("There is no directory: [%s]" % archieve_root)
         exit(0)
-    if len(sys.argv) < 3:
-        volume_to_hash = None  # hash all volumes
-    else:
-        volume_to_hash = sys.argv[2]
+    volume_to_hash = args.volume  # None: hash all volumes
+    if volume_to_hash is not None:
         if not os.path.isdir(os.path.join(archieve_root, volume_to_hash)):
             print("There is no directory: [%s] in archieve_root [%s]" % (volume_to_hash, archieve_root))
 
 
-    hash_dir_root = os.path.join(os.path.abspath(archieve_root), "hashes__%s" % start_datetime_txt)
-
-    if not os.path.exists(hash_dir_root):
-        os.makedirs(hash_dir_root)
+    hash_dir_root = make_hash_dir_root(archieve_root, start_datetime_txt)
 
     logfile = os.path.join(hash_dir_root, "log.txt")
     logging.basicConfig(
@@ -137,25 +361,17 @@ if __name__ == "__main__":
     logging.info("hash_dir_root = [%s]" % hash_dir_root)
     logging.info("HASH_ALGORITHM = [%s]" % HASH_ALGORITHM)
     logging.info("READ_BLOCK_SIZE = [%s]" % READ_BLOCK_SIZE)
-    if volume_to_hash is None:
-        logging.debug("Mode: all volumes in the archive")
-        files_and_dirs = [os.path.join(archieve_root, item) for item in os.listdir(archieve_root) if "hashes" not in item]
-        directories = [item for item in files_and_dirs if os.path.isdir(item)]
-        files = [item for item in files_and_dirs if os.path.isfile(item)]
+    cache = None
+    if args.cache and not args.no_cache:
+        logging.info("Hash cache = [%s]" % args.cache)
+        cache = HashCache(args.cache, rebuild=args.rebuild_cache)
+    with stats_to_json(args.stats), profiled(args.profile):
+        for source_path, function, function_args in get_hashing_tasks(archieve_root, hash_dir_root, volume_to_hash, args.format):
+            function(*function_args, cache)
 
-        for dir_abspath in directories:
-            dir = os.path.relpath(dir_abspath, archieve_root)
-            hashes_file = os.path.join(hash_dir_root, dir + "_hashes.json")
-            save_hashes_for_volume(archieve_root, dir_abspath, hashes_file)
-
-        if len(files) > 0:
-            hashes_file = os.path.join(hash_dir_root, "files_hashes.json")
-            save_hashes_for_files(archieve_root, files, hashes_file)
-    else: # specific volume
-        logging.debug("Mode: specific volume: [%s]" % volume_to_hash)
-        dir_abspath = os.path.join(archieve_root, volume_to_hash)
-        dir = volume_to_hash
-        hashes_file = os.path.join(hash_dir_root, dir + "_hashes.json")
-        save_hashes_for_volume(archieve_root, dir_abspath, hashes_file)
+    if cache is not None:
+        if args.prune_cache:
+            logging.info("Pruned [%d] stale hash cache entries" % cache.evict_missing())
+        cache.close()
 
     logging.info("Hashing ended at: [%s]" % datetime.datetime.now().strftime("%Y-%m-%d__%H-%M-%S"))
@@ -3,15 +3,27 @@ Copy this script into HOME_DIR, which is the directory containing your archives
 It might be the root of your removable drive. Edit settings and run the script:
 
 $ python get_hash_walk.py
+
+All roots in ROOT_LIST are hashed in this process, by get_hash.py functions. Volumes on
+different physical devices (st_dev) are hashed in parallel, while at most PER_DEVICE_JOBS
+volumes are read at a time from one device, so a spinning disk is not thrashed by several
+readers. Hashes of each root are saved to hashes__<timestamp> in the root, as by get_hash.py.
+A failed volume does not stop the others: it is reported in the summary, and the script
+exits with status 1.
 """
 
 import os
+import sys
+import datetime
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 """
 Settings
 """
 PHOTO_UTILS_DIR = os.path.abspath(r"D:/git/photo_utils")
-GET_HASH_PY = os.path.join(PHOTO_UTILS_DIR, "get_hash.py")
 HOME_DIR = os.path.dirname(os.path.abspath(__file__))
 
 ROOT_LIST = (
@@ -22,12 +34,110 @@ ROOT_LIST = (
     # "root N"
 )
 
+PER_DEVICE_JOBS = 1  # volumes hashed at a time on one device; 1 for HDD, more for SSD
+HASH_CACHE_PATH = None  # path to hash cache database shared by all roots, None: no cache
+OUTPUT_FORMAT = "json"  # or "ndjson"
+
 """
 End of settings
 """
 
-for root_dir in ROOT_LIST:
-    root_dir_abs_path = os.path.join(HOME_DIR, root_dir)
-    print("Getting hashes for '%s'..." % root_dir_abs_path)
-    os.system("python %s %s" % (GET_HASH_PY, root_dir_abs_path))
-    print("Getting hashes for '%s' done." % root_dir_abs_path)
\ No newline at end of file
+sys.path.insert(0, PHOTO_UTILS_DIR)
+import get_hash
+
+
+def get_device(path):
+    return os.stat(path).st_dev
+
+def run_task(task, cache, results, results_lock):
+    """
+    Runs one hashing task of get_hash.get_hashing_tasks and records its outcome in results.
+    """
+    root_dir_abs_path, (source_path, function, function_args) = task
+    print("Getting hashes for [%s]..." % source_path)
+    logging.info("Getting hashes for [%s]" % source_path)
+    try:
+        function(*function_args, cache)
+        error = None
+        print("Getting hashes for [%s] done." % source_path)
+    except Exception as e:
+        error = "%s: %s" % (type(e).__name__, e)
+        print("Getting hashes for [%s] failed: %s" % (source_path, error))
+        logging.error("Getting hashes for [%s] failed:\n%s" % (source_path, traceback.format_exc()))
+    with results_lock:
+        results.append((root_dir_abs_path, source_path, error))
+
+def hash_roots(root_list, start_datetime_txt, per_device_jobs=PER_DEVICE_JOBS, cache=None,
+               output_format=OUTPUT_FORMAT):
+    """
+    Hashes all volumes of the roots, concurrently across devices.
+    Returns list of (root, source_path, error) with error None for succeeded tasks.
+    """
+    results = []
+    results_lock = threading.Lock()
+    tasks_by_device = {}
+    for root_dir_abs_path in root_list:
+        try:
+            if not os.path.isdir(root_dir_abs_path):
+                raise FileNotFoundError("There is no directory: [%s]" % root_dir_abs_path)
+            hash_dir_root = get_hash.make_hash_dir_root(root_dir_abs_path, start_datetime_txt)
+            tasks = get_hash.get_hashing_tasks(root_dir_abs_path, hash_dir_root, output_format=output_format)
+        except Exception as e:
+            results.append((root_dir_abs_path, root_dir_abs_path, "%s: %s" % (type(e).__name__, e)))
+            continue
+        for task in tasks:
+            tasks_by_device.setdefault(get_device(task[0]), []).append((root_dir_abs_path, task))
+
+    logging.info("[%d] devices, tasks per device: %s" % (
+        len(tasks_by_device), [len(tasks) for tasks in tasks_by_device.values()]))
+    executors = [ThreadPoolExecutor(max_workers=per_device_jobs) for device in tasks_by_device]
+    try:
+        for executor, tasks in zip(executors, tasks_by_device.values()):
+            for task in tasks:
+                executor.submit(run_task, task, cache, results, results_lock)
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=True)
+    return results
+
+def print_summary(results):
+    """
+    Prints number of hashed volumes and failures per root. Returns True if there were no failures.
+    """
+    print("Summary:")
+    for root_dir_abs_path in dict.fromkeys(root for root, source_path, error in results):
+        root_results = [(source_path, error) for root, source_path, error in results if root == root_dir_abs_path]
+        failed = [(source_path, error) for source_path, error in root_results if error is not None]
+        print("[%s]: [%d] of [%d] done" % (root_dir_abs_path, len(root_results) - len(failed), len(root_results)))
+        for source_path, error in failed:
+            print("    FAILED [%s]: %s" % (source_path, error))
+    return all(error is None for root, source_path, error in results)
+
+####################################################################################################
+
+if __name__ == "__main__":
+    start_datetime_txt = datetime.datetime.now().strftime("%Y-%m-%d__%H-%M-%S")
+    logging.basicConfig(
+        filename=os.path.join(HOME_DIR, "get_hash_walk__%s.log" % start_datetime_txt),
+        encoding=get_hash.LOG_ENCODING,
+        level=get_hash.LOG_LEVEL,
+        format="%(asctime)s - %(threadName)s - %(levelname)s - %(message)s"
+    )
+    root_list = [os.path.join(HOME_DIR, root_dir) for root_dir in ROOT_LIST]
+    logging.info("Hashing started at: [%s]" % start_datetime_txt)
+    logging.info("ROOT_LIST = %s" % root_list)
+    logging.info("HASH_ALGORITHM = [%s]" % get_hash.HASH_ALGORITHM)
+
+    cache = None
+    if HASH_CACHE_PATH:
+        logging.info("Hash cache = [%s]" % HASH_CACHE_PATH)
+        cache = get_hash.HashCache(HASH_CACHE_PATH)
+    try:
+        results = hash_roots(root_list, start_datetime_txt, PER_DEVICE_JOBS, cache, OUTPUT_FORMAT)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    ok = print_summary(results)
+    logging.info("Hashing finished, %s" % ("all done" if ok else "with failures"))
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,124 @@
+"""
+Minimal Linux inotify binding with ctypes, used by watch_archive.py.
+
+Only the calls needed to watch directory trees are wrapped: inotify_init1, inotify_add_watch
+and inotify_rm_watch. Events are read from the inotify file descriptor and parsed from
+struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[len];}.
+
+inotify watches single directories, so a tree needs a watch per directory. Their number is
+limited by /proc/sys/fs/inotify/max_user_watches, which may have to be raised for a large archive.
+"""
+
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from collections import namedtuple
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+Event = namedtuple("Event", ["wd", "mask", "cookie", "name"])
+
+_libc = None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return _libc
+
+def _check(result, what):
+    if result < 0:
+        error = ctypes.get_errno()
+        message = "%s: %s" % (what, os.strerror(error))
+        if error == errno.ENOSPC:
+            message += " (raise /proc/sys/fs/inotify/max_user_watches)"
+        raise OSError(error, message)
+    return result
+
+def parse_events(data):
+    """
+    Parses events read from an inotify file descriptor. Returns a list of Event.
+    """
+    events = []
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+        wd, mask, cookie, name_len = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        name = data[offset:offset + name_len].rstrip(b"\0")
+        offset += name_len
+        events.append(Event(wd, mask, cookie, os.fsdecode(name)))
+    return events
+
+class Inotify:
+    """
+    inotify instance. Use it as a context manager, or call close() when done.
+    """
+
+    def __init__(self):
+        self.fd = _check(_get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC), "inotify_init1")
+
+    def add_watch(self, path, mask):
+        """
+        Watches path for events in mask. Returns the watch descriptor, which is the same
+        for a directory already watched.
+        """
+        return _check(_get_libc().inotify_add_watch(self.fd, os.fsencode(path), mask),
+                      "inotify_add_watch [%s]" % path)
+
+    def rm_watch(self, wd):
+        """
+        Stops watching, the kernel then sends IN_IGNORED for wd. A watch already removed by the
+        kernel, e.g. of a deleted directory, is ignored.
+        """
+        if _get_libc().inotify_rm_watch(self.fd, wd) < 0 and ctypes.get_errno() != errno.EINVAL:
+            _check(-1, "inotify_rm_watch")
+
+    def read_events(self, timeout=None):
+        """
+        Waits up to timeout seconds (None: forever) for events and returns them, possibly none.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            return parse_events(os.read(self.fd, READ_SIZE))
+        except BlockingIOError:
+            return []
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
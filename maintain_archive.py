@@ -0,0 +1,143 @@
+"""
+Weekly maintenance of the archive in a single walk: cleaning, hashing and EXIF date indexing.
+
+Running garbage_clean.py, get_hash.py and sort_by_exif.py one after another lists every
+directory of the archive three times. Here the archive is walked once (see archive_pipeline.py)
+and each file is passed to the stages in this order:
+- clean: removes thumbnail caches (garbage_clean.CleanStage), removed files are not hashed,
+- hash:  saves volume manifests as get_hash.py does for the whole archive (get_hash.HashStage),
+- exif:  saves the EXIF date of every photo to exif_index.<format> (exif_index.ExifIndexStage).
+
+Manifests, the EXIF index and log.txt are saved to hashes__<timestamp> in the archive root.
+
+How to use this script:
+python maintain_archive.py <path_to_archive>
+
+To run only some stages, or see what would be cleaned without removing anything:
+python maintain_archive.py --stages clean,hash --dry-run <path_to_archive>
+
+To parse EXIF only of photos that are new or changed since the previous run, keep the dates
+in a catalog (see sort_by_exif/exif_catalog.py), e.g. the one sort_by_exif.py keeps in its dst_root:
+python maintain_archive.py --exif-catalog <path_to_archive>/.sort_by_exif_exif_catalog.sqlite <path_to_archive>
+
+Other options (--algorithm, --format, --cache, --stats, --profile) are as for get_hash.py.
+The script exits with status 1 if any file or directory could not be processed.
+"""
+
+import os
+import sys
+import datetime
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "sort_by_exif"))
+import get_hash
+from garbage_clean import CleanStage, CLEAN_LIST
+from archive_pipeline import run_stages
+from checksums.cache import HashCache
+from checksums.stats import profiled, stats_to_json
+
+####################################### Config #####################################################
+
+STAGES = ("clean", "hash", "exif")
+LOG_LEVEL = logging.INFO
+LOG_ENCODING = "utf-8"
+
+####################################################################################################
+
+def make_stages(names, archieve_root, hash_dir_root, output_format, cache=None, hash_type=None, dry_run=False,
+                exif_catalog=None):
+    """
+    Returns stages for names, in the order of STAGES.
+    """
+    stages = []
+    for name in STAGES:
+        if name not in names:
+            continue
+        if name == "clean":
+            stages.append(CleanStage(CLEAN_LIST, dry_run))
+        elif name == "hash":
+            stages.append(get_hash.HashStage(archieve_root, hash_dir_root, output_format, cache, hash_type))
+        elif name == "exif":
+            from exif_index import ExifIndexStage  # requires exifread
+            stages.append(ExifIndexStage(archieve_root, os.path.join(hash_dir_root, "exif_index." + output_format),
+                                         exif_catalog))
+    return stages
+
+def print_summary(stages, counts):
+    print("\n\n\n")
+    print("Walked [%d] directories, [%d] files." % (counts["directories"], counts["files"]))
+    for stage in stages:
+        if stage.name == "clean":
+            print("Cleaned [%d] files%s." % (stage.cleaned_cnt, " (dry run)" if stage.dry_run else ""))
+        elif stage.name == "exif":
+            print("Date was detected for [%d] of [%d] photos." % (stage.photo_with_date_cnt, stage.photo_cnt))
+    if counts["errors"] > 0:
+        print("[%d] errors, see log.txt." % counts["errors"])
+
+
+if __name__ == "__main__":
+    start_datetime = datetime.datetime.now()
+    start_datetime_txt = start_datetime.strftime("%Y-%m-%d__%H-%M-%S")
+
+    parser = argparse.ArgumentParser(description="Clean, hash and index the archive in a single walk.")
+    parser.add_argument("archive_root", help="path to archive")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated stages to run (default: %s)" % ",".join(STAGES))
+    parser.add_argument("--dry-run", action="store_true", help="only count files that would be cleaned")
+    parser.add_argument("--algorithm", default=None, help="hash algorithm(s), e.g. SHA256 or MD5,SHA256,SHA512 (default: get_hash.HASH_ALGORITHM)")
+    parser.add_argument("--format", choices=("json", "ndjson"), default=get_hash.OUTPUT_FORMAT, help="manifest format (default: get_hash.OUTPUT_FORMAT)")
+    parser.add_argument("--cache", default=get_hash.HASH_CACHE_PATH, help="path to hash cache database")
+    parser.add_argument("--exif-catalog", default=None, help="path to EXIF catalog database used by the exif stage (see sort_by_exif/exif_catalog.py)")
+    parser.add_argument("--stats", default=None, help="write run statistics (throughput, time per stage and phase, slowest files) to this JSON file")
+    parser.add_argument("--profile", default=None, help="profile the run with cProfile and save the statistics to this file")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = set(names) - set(STAGES)
+    if unknown:
+        parser.error("unknown stages: %s" % ", ".join(sorted(unknown)))
+    hash_type = None
+    if args.algorithm is not None:
+        hash_types = [ht.strip().upper() for ht in args.algorithm.split(",")]
+        hash_type = hash_types[0] if len(hash_types) == 1 else hash_types
+
+    archieve_root = os.path.abspath(args.archive_root)
+    if not os.path.isdir(archieve_root):
+        print("There is no directory: [%s]" % archieve_root)
+        sys.exit(1)
+    hash_dir_root = get_hash.make_hash_dir_root(archieve_root, start_datetime_txt)
+
+    logging.basicConfig(
+        filename=os.path.join(hash_dir_root, "log.txt"),
+        encoding=LOG_ENCODING,
+        level=LOG_LEVEL,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    logging.info("Maintenance started at: [%s]" % start_datetime_txt)
+    logging.info("archieve_root = [%s]" % archieve_root)
+    logging.info("hash_dir_root = [%s]" % hash_dir_root)
+    logging.info("stages = [%s]" % ",".join(names))
+
+    cache = None
+    if args.cache and "hash" in names:
+        logging.info("Hash cache = [%s]" % args.cache)
+        cache = HashCache(args.cache)
+    exif_catalog = None
+    if args.exif_catalog and "exif" in names:
+        from exif_catalog import ExifCatalog
+        logging.info("EXIF catalog = [%s]" % args.exif_catalog)
+        exif_catalog = ExifCatalog(args.exif_catalog)
+    try:
+        stages = make_stages(names, archieve_root, hash_dir_root, args.format, cache, hash_type, args.dry_run,
+                             exif_catalog)
+        with stats_to_json(args.stats), profiled(args.profile):
+            counts = run_stages(archieve_root, stages)
+    finally:
+        if cache is not None:
+            cache.close()
+        if exif_catalog is not None:
+            exif_catalog.close()
+
+    logging.info("Maintenance ended at: [%s]" % datetime.datetime.now().strftime("%Y-%m-%d__%H-%M-%S"))
+    print_summary(stages, counts)
+    sys.exit(1 if counts["errors"] > 0 else 0)
@@ -0,0 +1,179 @@
+"""
+Content index of the destination tree.
+
+Files under dst_root are indexed by size and SHA256 hash in an SQLite database,
+so that an incoming file whose content already exists anywhere in the destination
+is found without comparing files byte by byte.
+
+The index is built once by walking dst_root, which only needs stat calls: a file
+is hashed the first time another file of the same size is looked up, and the hash
+is then stored. Most incoming files have a size that is not in the index yet, so
+they are not read at all. The index is updated as files are imported.
+"""
+
+import os
+import hashlib
+import sqlite3
+import threading
+from transfer import PART_SUFFIX
+
+INTERNAL_FILE_PREFIX = ".sort_by_exif_"
+INDEX_FILENAME = INTERNAL_FILE_PREFIX + "index.sqlite"
+HASH_READ_SIZE = 1024 * 1024
+COMMIT_INTERVAL = 100  # number of changes after which the index is committed to disk
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    relpath TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def get_file_hash(fname):
+    hash = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_READ_SIZE), b""):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+class DestIndex:
+    """
+    Index of files under dest_root by size and hash. It may be shared between threads.
+    """
+    def __init__(self, dest_root, index_path=None):
+        self.dest_root = dest_root
+        if index_path is None:
+            index_path = os.path.join(dest_root, INDEX_FILENAME)
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._n_pending = 0
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        self._connection = sqlite3.connect(index_path, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+        if self._get_meta("built") is None:
+            self.refresh()
+
+    def _get_meta(self, key):
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _changed(self):
+        # must be called with self._lock held
+        self._n_pending += 1
+        if self._n_pending >= COMMIT_INTERVAL:
+            self._connection.commit()
+            self._n_pending = 0
+
+    def _relpath(self, path):
+        return os.path.relpath(path, self.dest_root)
+
+    def _is_internal_file(self, path):
+        """
+        Returns True for files of this script in dest_root: databases and partially written files.
+        """
+        file = os.path.basename(path)
+        return (file.startswith(INTERNAL_FILE_PREFIX) or file.startswith(os.path.basename(self.index_path))
+                or file.endswith(PART_SUFFIX))
+
+    def refresh(self):
+        """
+        Walks dest_root, adding files that are not indexed and dropping files that no longer exist.
+        Hashes of files whose size or modification time changed are dropped.
+        """
+        print("Indexing destination tree [%s]..." % self.dest_root)
+        with self._lock:
+            indexed = {relpath: (size, mtime_ns) for relpath, size, mtime_ns in
+                       self._connection.execute("SELECT relpath, size, mtime_ns FROM files")}
+        # walk without holding the lock, the changes are written at once below
+        found = set()
+        changed = []
+        for path, directories, files in os.walk(self.dest_root):
+            for file in files:
+                file_path = os.path.join(path, file)
+                if self._is_internal_file(file_path):
+                    continue
+                try:
+                    stat = os.stat(file_path)
+                except OSError as e:
+                    # e.g. a dangling symlink or a file removed during the walk
+                    print("Unable to index file [%s]. %s" % (file_path, e))
+                    continue
+                relpath = self._relpath(file_path)
+                found.add(relpath)
+                if indexed.get(relpath) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append((relpath, stat.st_size, stat.st_mtime_ns))
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, NULL)", changed)
+            self._connection.executemany("DELETE FROM files WHERE relpath = ?",
+                                         [(relpath,) for relpath in indexed.keys() - found])
+            self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('built', '1')")
+            self._connection.commit()
+            n_files = self._connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        print("Indexed [%d] files in destination tree." % n_files)
+
+    def add(self, path, hash=None):
+        """
+        Adds a file under dest_root to the index, with its hash if it is known.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                     (self._relpath(path), stat.st_size, stat.st_mtime_ns, hash))
+            self._changed()
+
+    def contains(self, path):
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM files WHERE relpath = ?",
+                                            (self._relpath(path),)).fetchone() is not None
+
+    def find(self, src_path, src_size=None, src_hash=None):
+        """
+        Looks for a file under dest_root with the same content as src_path.
+        The source file is only hashed if there are indexed files of the same size.
+        Returns (dest_path, src_hash): dest_path is None if there is no such file,
+        src_hash is None if the source file was not hashed.
+        """
+        if src_size is None:
+            src_size = os.path.getsize(src_path)
+        with self._lock:
+            candidates = self._connection.execute("SELECT relpath, mtime_ns, hash FROM files WHERE size = ?",
+                                                  (src_size,)).fetchall()
+        if len(candidates) == 0:
+            return None, src_hash
+
+        if src_hash is None:
+            src_hash = get_file_hash(src_path)
+        for relpath, mtime_ns, hash in candidates:
+            dest_path = os.path.join(self.dest_root, relpath)
+            try:
+                stat = os.stat(dest_path)
+            except FileNotFoundError:
+                with self._lock:
+                    self._connection.execute("DELETE FROM files WHERE relpath = ?", (relpath,))
+                    self._changed()
+                continue
+            if hash is None or stat.st_mtime_ns != mtime_ns or stat.st_size != src_size:
+                hash = get_file_hash(dest_path)
+                with self._lock:
+                    self._connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                             (relpath, stat.st_size, stat.st_mtime_ns, hash))
+                    self._changed()
+                if stat.st_size != src_size:
+                    continue
+            if hash == src_hash:
+                return dest_path, src_hash
+        return None, src_hash
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
@@ -0,0 +1,227 @@
+"""
+Persistent catalog of EXIF metadata of photos, so that EXIF is parsed once per file.
+
+The capture date and the fields of exif_date.METADATA_TAGS (camera make and model,
+orientation) are stored in an SQLite database, keyed by the path of the file. A file is
+matched by its path, size and modification time, as in import_journal.py, so a changed file
+is parsed again. Photos can then be found by date without reading them:
+
+python exif_catalog.py <catalog> 2019-07        # paths of photos taken in July 2019
+python exif_catalog.py <catalog> 2019-07-14     # or on a day, or in a year: 2019
+python exif_catalog.py <catalog> unknown        # photos without a date
+python exif_catalog.py --months <catalog>       # number of photos per month
+python exif_catalog.py --prune <catalog>        # drop entries of files that no longer exist
+
+Queries only cover photos below the directory of the catalog, or below the one given with
+--root (--root / for all photos).
+
+sort_by_exif.py keeps a catalog in dst_root: source files are looked up before parsing, and
+the entry of every placed file is moved to its destination path, so the catalog covers the
+sorted archive. Entries of source files that were not placed, e.g. duplicates, are left out of
+queries as they are outside dst_root. maintain_archive.py --exif-catalog uses the same catalog
+for the EXIF index.
+
+This module requires https://pypi.org/project/ExifRead/ to parse files not in the catalog.
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+import threading
+from dest_index import INTERNAL_FILE_PREFIX
+
+CATALOG_FILENAME = INTERNAL_FILE_PREFIX + "exif_catalog.sqlite"
+COMMIT_INTERVAL = 1000  # number of changes after which the catalog is committed to disk
+UNKNOWN_DATE = "unknown"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS photos (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    date TEXT,
+    datetime TEXT,
+    make TEXT,
+    model TEXT,
+    orientation INTEGER
+);
+CREATE INDEX IF NOT EXISTS photos_date ON photos (date);
+"""
+
+_FIELDS = ("date", "datetime", "make", "model", "orientation")
+
+
+def encode_date(date):
+    return None if date is None else "-".join(date)
+
+def decode_date(date):
+    return None if date is None else tuple(date.split("-"))
+
+def _to_metadata(row):
+    metadata = dict(zip(_FIELDS, row))
+    metadata["date"] = decode_date(metadata["date"])
+    return metadata
+
+
+class ExifCatalog:
+    """
+    Catalog of EXIF metadata by file path. It may be shared between threads.
+    Metadata are dictionaries returned by exif_date.get_metadata.
+    Queries cover photos below root, by default the directory of the catalog.
+    """
+    def __init__(self, catalog_path, root=None):
+        self.catalog_path = catalog_path
+        self.root = os.path.realpath(root if root is not None else os.path.dirname(os.path.abspath(catalog_path)))
+        self._lock = threading.Lock()
+        self._n_pending = 0
+        os.makedirs(os.path.dirname(os.path.abspath(catalog_path)), exist_ok=True)
+        self._connection = sqlite3.connect(catalog_path, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+
+    def _changed(self):
+        # must be called with self._lock held
+        self._n_pending += 1
+        if self._n_pending >= COMMIT_INTERVAL:
+            self._connection.commit()
+            self._n_pending = 0
+
+    def lookup(self, path, stat):
+        """
+        Returns metadata recorded for the file, or None if the file is not in the catalog
+        or has changed since it was recorded.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT size, mtime_ns, %s FROM photos WHERE path = ?" % ", ".join(_FIELDS),
+                                           (path,)).fetchone()
+        if row is None or tuple(row[:2]) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        return _to_metadata(row[2:])
+
+    def record(self, path, stat, metadata):
+        """
+        Records metadata of a file. stat is os.stat of the file taken before it was parsed.
+        """
+        values = [encode_date(metadata.get("date"))] + [metadata.get(field) for field in _FIELDS[1:]]
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                     [path, stat.st_size, stat.st_mtime_ns] + values)
+            self._changed()
+
+    def get_metadata(self, path, stat=None):
+        """
+        Returns metadata of a file from the catalog, parsing and recording it if needed.
+        """
+        from exif_date import get_metadata  # requires exifread
+        if stat is None:
+            stat = os.stat(path)
+        metadata = self.lookup(path, stat)
+        if metadata is None:
+            metadata = get_metadata(path)
+            self.record(path, stat, metadata)
+        return metadata
+
+    def get_date(self, path, stat=None):
+        """
+        Returns (year, month, day) of a file or None, as exif_date.get_date, using the catalog.
+        """
+        return self.get_metadata(path, stat)["date"]
+
+    def _path_range(self, root):
+        # paths below root sort between "<root>/" and "<root>0", as "0" follows "/"
+        prefix = os.path.join(os.path.realpath(root if root is not None else self.root), "")
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def record_transfer(self, src_path, dest_path, dest_stat=None):
+        """
+        Moves the entry of src_path to dest_path, where the file was copied or moved, so that
+        the photo is cataloged once. A source file parsed again later is recorded again.
+        """
+        if dest_stat is None:
+            dest_stat = os.stat(dest_path)
+        with self._lock:
+            row = self._connection.execute("SELECT %s FROM photos WHERE path = ?" % ", ".join(_FIELDS),
+                                           (src_path,)).fetchone()
+        if row is None:
+            return
+        self.record(dest_path, dest_stat, _to_metadata(row))
+        with self._lock:
+            self._connection.execute("DELETE FROM photos WHERE path = ?", (src_path,))
+            self._changed()
+
+    def find(self, date_prefix, root=None):
+        """
+        Returns [(path, metadata)] of photos taken on a date starting with date_prefix, e.g.
+        "2019", "2019-07" or "2019-07-14", sorted by capture time and path.
+        date_prefix None (or UNKNOWN_DATE) returns photos without a date.
+        Only photos below root (default: self.root) are returned.
+        """
+        with self._lock:
+            if date_prefix is None or date_prefix == UNKNOWN_DATE:
+                rows = self._connection.execute("SELECT path, %s FROM photos WHERE date IS NULL "
+                                                "AND path >= ? AND path < ? ORDER BY path" % ", ".join(_FIELDS),
+                                                self._path_range(root)).fetchall()
+            else:
+                # "~" sorts after digits and "-", so the range covers all dates with the prefix
+                rows = self._connection.execute("SELECT path, %s FROM photos WHERE date >= ? AND date < ? "
+                                                "AND path >= ? AND path < ? ORDER BY datetime, path"
+                                                % ", ".join(_FIELDS),
+                                                (date_prefix, date_prefix + "~") + self._path_range(root)).fetchall()
+        return [(row[0], _to_metadata(row[1:])) for row in rows]
+
+    def count_by_month(self, root=None):
+        """
+        Returns {"YYYY-MM": number of photos} of photos below root (default: self.root), with
+        UNKNOWN_DATE for photos without a date.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT substr(date, 1, 7), count(*) FROM photos "
+                                            "WHERE path >= ? AND path < ? "
+                                            "GROUP BY substr(date, 1, 7) ORDER BY 1",
+                                            self._path_range(root)).fetchall()
+        return {month if month is not None else UNKNOWN_DATE: count for month, count in rows}
+
+    def evict_missing(self):
+        """
+        Removes entries of files that no longer exist. Returns number of removed entries.
+        """
+        with self._lock:
+            paths = [path for path, in self._connection.execute("SELECT path FROM photos").fetchall()]
+        missing = [(path,) for path in paths if not os.path.exists(path)]
+        with self._lock:
+            self._connection.executemany("DELETE FROM photos WHERE path = ?", missing)
+            self._connection.commit()
+            self._n_pending = 0
+        return len(missing)
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+####################################################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the EXIF catalog of sort_by_exif.py.")
+    parser.add_argument("catalog", help="path to catalog, e.g. <dst_root>/%s" % CATALOG_FILENAME)
+    parser.add_argument("date", nargs="?", default=None, help="print photos taken on dates starting with this, e.g. 2019-07, or '%s'" % UNKNOWN_DATE)
+    parser.add_argument("--root", default=None, help="query photos under this directory (default: the directory of the catalog)")
+    parser.add_argument("--months", action="store_true", help="print number of photos per month")
+    parser.add_argument("--prune", action="store_true", help="drop entries of files that no longer exist")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.catalog):
+        print("There is no catalog: [%s]" % args.catalog)
+        sys.exit(1)
+    catalog = ExifCatalog(args.catalog, args.root)
+    try:
+        if args.prune:
+            print("Removed [%d] entries of missing files." % catalog.evict_missing())
+        if args.months:
+            for month, count in catalog.count_by_month().items():
+                print("%s %d" % (month, count))
+        if args.date is not None:
+            for path, metadata in catalog.find(args.date):
+                print(path)
+    finally:
+        catalog.close()
@@ -0,0 +1,108 @@
+"""
+Fast extraction of the capture date from EXIF data.
+
+Only the beginning of the file is read and parsed, and parsing stops as soon as
+the DateTimeOriginal tag is found. MakerNotes and thumbnails are skipped.
+If the date is not found in the header, the whole file is parsed as before.
+
+get_metadata also returns a few fields that are parsed before the date anyway
+(camera make and model, orientation), for the catalog in exif_catalog.py.
+
+This module requires https://pypi.org/project/ExifRead/
+"""
+
+import io
+import os
+import sys
+import exifread
+
+DATE_TAG = "EXIF DateTimeOriginal"
+STOP_TAG = "DateTimeOriginal"
+
+# EXIF data of JPEG and most RAW files is within the first few KiB
+HEADER_READ_SIZE = 256 * 1024
+
+XMP_EXTENSIONS = (".XMP", ".xmp")
+XMP_SOURCE_EXTENSIONS = (".nef", ".NEF", ".JPG", ".jpg", ".JPEG", ".jpeg")
+
+# Fields of get_metadata besides the date, by EXIF tag. They come before DateTimeOriginal.
+METADATA_TAGS = {
+    "datetime": DATE_TAG,
+    "make": "Image Make",
+    "model": "Image Model",
+    "orientation": "Image Orientation",
+}
+
+
+def parse_date(tags):
+    """
+    Returns (year, month, day) from exifread tags.
+    """
+    DateTimeOriginal = str(tags[DATE_TAG])
+    date, time = DateTimeOriginal.split(" ")
+    year, month, day = date.split(":")
+    return year, month, day
+
+
+def parse_metadata(tags):
+    """
+    Returns fields of METADATA_TAGS from exifread tags, None for missing tags.
+    """
+    metadata = dict.fromkeys(METADATA_TAGS)
+    for field, tag in METADATA_TAGS.items():
+        if tag not in tags:
+            continue
+        if field == "orientation":
+            metadata[field] = tags[tag].values[0]
+        else:
+            metadata[field] = str(tags[tag]).strip()
+    return metadata
+
+
+def read_date_tags(f, header_only):
+    """
+    Parses EXIF of an open file, stopping at DateTimeOriginal.
+    If header_only is True, only the first HEADER_READ_SIZE bytes are parsed.
+    """
+    if header_only:
+        f = io.BytesIO(f.read(HEADER_READ_SIZE))
+    return exifread.process_file(f, stop_tag=STOP_TAG, details=False)
+
+
+def get_metadata(file_realpath):
+    """
+    Returns {"date": (year, month, day) or None, and fields of METADATA_TAGS}.
+    The date of an XMP sidecar is taken from its source file if possible.
+    """
+    filename, file_extension = os.path.splitext(file_realpath)
+    if file_extension in XMP_EXTENSIONS:
+        for replaced_ext in XMP_SOURCE_EXTENSIONS:
+            if os.path.isfile(filename + replaced_ext):
+                metadata = get_metadata(filename + replaced_ext)
+                if metadata["date"] is not None:
+                    return metadata
+
+    tags = {}
+    date = None
+    try:
+        # Open image file for reading (binary mode)
+        with open(file_realpath, 'rb') as f:
+            try:
+                tags = read_date_tags(f, header_only=True)
+                date = parse_date(tags)
+            except Exception:
+                if f.tell() < HEADER_READ_SIZE:
+                    raise  # the whole file has already been parsed
+                # EXIF data may continue after the header
+                f.seek(0)
+                tags = read_date_tags(f, header_only=False)
+                date = parse_date(tags)
+    except Exception as e:
+        print ("Exception [%s] while getging EXIF DateTimeOriginal from file at path [%s]" % (e, file_realpath))
+    except:
+        print("Unexpected error:", sys.exc_info())
+    return dict(parse_metadata(tags), date=date)
+
+
+def get_date(file_realpath):
+    return get_metadata(file_realpath)["date"]
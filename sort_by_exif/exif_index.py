@@ -0,0 +1,59 @@
+"""
+EXIF date index of an archive, as a stage of the single-walk maintenance (see maintain_archive.py).
+
+The date of every photo (EXIF_EXTENSIONS) is extracted as by sort_by_exif.py and saved as a
+manifest record {"posixpath": path relative to the archive root, "date": "YYYY-MM-DD" or null},
+in the JSON or NDJSON format of get_hash.py (see checksums.manifest).
+With an EXIF catalog (see exif_catalog.py), only photos that are new or changed since the
+previous run are parsed.
+
+This module requires https://pypi.org/project/ExifRead/
+"""
+
+import os
+import sys
+import posixpath
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "checksums"))
+from exif_date import get_date
+from archive_pipeline import Stage
+from checksums.manifest import ManifestWriter
+
+EXIF_EXTENSIONS = (".JPG", ".JPEG", ".NEF", ".CR2", ".ARW", ".DNG", ".TIF", ".TIFF", ".XMP")
+
+
+class ExifIndexStage(Stage):
+    """
+    archive_pipeline stage saving the EXIF date of every photo under root to index_path.
+    If catalog (exif_catalog.ExifCatalog) is given, dates are looked up in it before parsing.
+    """
+    name = "exif"
+
+    def __init__(self, root, index_path, catalog=None):
+        self.prefix_len = len(os.path.join(os.path.abspath(root), ""))
+        self.index_path = index_path
+        self.manifest = ManifestWriter(index_path)
+        self.catalog = catalog
+        self.photo_cnt = 0
+        self.photo_with_date_cnt = 0
+
+    def process_file(self, entry):
+        filename, file_extension = os.path.splitext(entry.name)
+        if file_extension.upper() not in EXIF_EXTENSIONS:
+            return True
+        if self.catalog is not None:
+            date = self.catalog.get_date(entry.path, entry.stat())
+        else:
+            date = get_date(entry.path)
+        self.photo_cnt += 1
+        if date is not None:
+            self.photo_with_date_cnt += 1
+        self.manifest.write({"posixpath": posixpath.normpath(entry.path[self.prefix_len:]),
+                             "date": "-".join(date) if date is not None else None})
+        return True
+
+    def close(self):
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
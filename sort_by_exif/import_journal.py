@@ -0,0 +1,124 @@
+"""
+Journal of imported files, so that an interrupted import can be resumed.
+
+Every transfer is recorded in an SQLite database in dst_root, first as planned
+(with the extracted EXIF date and the destination) and then as done. On restart:
+- files that were done are skipped with a single lookup, without parsing EXIF again,
+- files that were planned reuse the recorded date and are placed again,
+- leftover partially written destination files of planned transfers are removed.
+
+A source file is matched by its path, size and modification time, so a changed
+file with the same path is imported again.
+"""
+
+import os
+import sqlite3
+import threading
+from dest_index import INTERNAL_FILE_PREFIX
+
+JOURNAL_FILENAME = INTERNAL_FILE_PREFIX + "journal.sqlite"
+COMMIT_INTERVAL = 100  # number of done transfers after which the journal is committed to disk
+
+STATE_PLANNED = "planned"
+STATE_DONE = "done"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transfers (
+    src_path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    date TEXT,
+    dest_path TEXT,
+    state TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transfers_state ON transfers (state);
+"""
+
+
+def encode_date(date):
+    return None if date is None else ":".join(date)
+
+def decode_date(date):
+    return None if date is None else tuple(date.split(":"))
+
+
+class ImportJournal:
+    """
+    Journal of transfers into dest_root. It may be shared between threads.
+    """
+    def __init__(self, dest_root, journal_path=None):
+        if journal_path is None:
+            journal_path = os.path.join(dest_root, JOURNAL_FILENAME)
+        self.journal_path = journal_path
+        self._lock = threading.Lock()
+        self._n_pending = 0
+        os.makedirs(os.path.dirname(os.path.abspath(journal_path)), exist_ok=True)
+        self._connection = sqlite3.connect(journal_path, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+
+    def _changed(self):
+        # must be called with self._lock held
+        self._n_pending += 1
+        if self._n_pending >= COMMIT_INTERVAL:
+            self._connection.commit()
+            self._n_pending = 0
+
+    def recover(self, part_suffix):
+        """
+        Removes partially written destination files (dest_path + part_suffix) of
+        transfers that were planned but not done. Returns number of removed files.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT dest_path FROM transfers WHERE state = ?",
+                                            (STATE_PLANNED,)).fetchall()
+        n_removed = 0
+        for dest_path, in rows:
+            if dest_path is not None and os.path.isfile(dest_path + part_suffix):
+                print("Removing partially written file [%s]" % (dest_path + part_suffix))
+                os.remove(dest_path + part_suffix)
+                n_removed += 1
+        return n_removed
+
+    def lookup(self, src_path, stat):
+        """
+        Returns (state, date) recorded for the source file, or (None, None) if the file
+        is not in the journal or has changed since it was recorded.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT size, mtime_ns, date, state FROM transfers WHERE src_path = ?",
+                                           (src_path,)).fetchone()
+        if row is None:
+            return None, None
+        size, mtime_ns, date, state = row
+        if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return None, None
+        return state, decode_date(date)
+
+    def _record(self, src_path, stat, date, dest_path, state, commit=False):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO transfers VALUES (?, ?, ?, ?, ?, ?)",
+                                     (src_path, stat.st_size, stat.st_mtime_ns, encode_date(date), dest_path, state))
+            if commit:
+                self._connection.commit()
+                self._n_pending = 0
+            else:
+                self._changed()
+
+    def plan(self, src_path, stat, date, dest_path):
+        """
+        Records a transfer that is about to start. stat is os.stat of the source file.
+        The record is committed at once, before the partially written destination file is
+        created, so that recover() finds that file after a crash.
+        """
+        self._record(src_path, stat, date, dest_path, STATE_PLANNED, commit=True)
+
+    def done(self, src_path, stat, date, dest_path):
+        """
+        Records a finished transfer, or a file skipped as identical to dest_path.
+        """
+        self._record(src_path, stat, date, dest_path, STATE_DONE)
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
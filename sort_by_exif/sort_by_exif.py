@@ -2,6 +2,20 @@
 The script copies photos and sorts the files by date based on EXIF data.
 It seems that it can get EXIF data out of JPEG and RAW files.
 In case the EXIF data cannot be detected, it puts the file in to a special 'unknown_date' folder.
+EXIF data is parsed once per file, reading only the file header when possible (see exif_date.py).
+
+The import runs as a pipeline, so that reading, parsing and writing overlap:
+a directory scanner feeds a pool of EXIF workers, which feed a pool of copy/move workers.
+The stages are connected by bounded queues. The number of workers per stage is set in config.yaml.
+
+Files whose content already exists anywhere under dst_root are skipped, whatever their name.
+The destination is indexed by size and hash (see dest_index.py) in a hidden database in dst_root.
+
+Transfers are recorded in a journal in dst_root (see import_journal.py). When an interrupted
+import is run again, files that were already imported are skipped without parsing EXIF again.
+
+Parsed EXIF metadata are kept in a catalog in dst_root (see exif_catalog.py), so a file is parsed
+once even across imports, and placed files can be found by date, e.g. all photos from 2019-07.
 
 Before first use:
 $ pip install exifread
@@ -11,6 +25,10 @@ How to use this script:
 1) Set all required settings in config.yaml.
 2) Run the script.
 
+To save run statistics (files/s, bytes/s, time spent walking, parsing EXIF, copying, ...
+and the slowest files) or a cProfile profile of all stages:
+python sort_by_exif.py --stats stats.json --profile import.prof
+
 The script was tested with Python 3.11
 At least Python 3.9 is required for the logger.
 
@@ -28,127 +46,354 @@ ARRANGE_YEAR_MONTH_DAY = 2
 
 ARRANGE_MODE = ARRANGE_YEAR_MONTH
 
+# How files are copied: "auto" tries reflink, copy_file_range and sendfile before
+# a buffered copy. Also "reflink", "copy_file_range", "sendfile" or "buffered".
+TRANSFER_BACKEND = "auto"
+# True: read back every copied file and compare its hash with the hash computed while copying
+VERIFY_TRANSFERS = False
+
 ####################################################################################################
 
 import os
+import sys
 import filecmp
 import yaml
-import exifread
 import os.path
-import shutil
 import time
+import queue
+import argparse
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from exif_date import get_date
+from dest_index import DestIndex
+from transfer import transfer_file, PART_SUFFIX
+from import_journal import ImportJournal, STATE_DONE, STATE_PLANNED
+from exif_catalog import ExifCatalog, CATALOG_FILENAME
 
-def get_date(file_realpath):
-    filename, file_extension = os.path.splitext(file_realpath)
-    if file_extension in (".XMP", ".xmp"):
-        for replaced_ext in (".nef", ".NEF", ".JPG", ".jpg" ".JPEG", ".jpeg"):
-            date = get_date(filename + replaced_ext)
-            if date is not None:
-                return date
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "checksums"))
+from checksums.stats import get_stats, phase, profiled, stats_to_json, timed_iter
 
-    try:
-        # Open image file for reading (binary mode)
-        with open(file_realpath, 'rb') as f:
-            # Return Exif tags
-            tags = exifread.process_file(f)
-            DateTimeOriginal = str(tags["EXIF DateTimeOriginal"])
-            date, time = DateTimeOriginal.split(" ")
-            year, month, day = date.split(":")
-            return year, month, day
-    except Exception as e:
-        print ("Exception [%s] while getging EXIF DateTimeOriginal from file at path [%s]" % (e, file_realpath))
-    except:
-        print("Unexpected error:", sys.exc_info())
+# Defaults for settings that are not present in config.yaml
+DEFAULT_EXIF_WORKERS = 4
+DEFAULT_COPY_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 256
 
-with open("config.yaml", "r") as f:
-    try:
-        config = yaml.safe_load(f)
-    except yaml.YAMLError as exc:
-        print(exc)
-        exit()
-
-SOURCE_ROOT = os.path.realpath(config['src_root'])
-DEST_ROOT = os.path.realpath(config['dst_root'])
-
-print("SOURCE_ROOT = [%s]" % SOURCE_ROOT)
-print("DEST_ROOT = [%s]" % DEST_ROOT)
-
-photo_cnt = 0
-photo_with_date_cnt = 0
-identical_photo_cnt = 0
-photo_with_errors_cnt = 0
-for path, directories, files in os.walk(SOURCE_ROOT):
-
-    files_with_dates = []
-    for file in files:
-        src_realpath = os.path.join(os.path.realpath(path), file)
-        date = get_date(src_realpath)
-        files_with_dates.append((file, src_realpath, date))
-
-    for file, src_realpath, date in files_with_dates:
-        # print ('found %s' % os.path.join(path, file))
-
-        date = get_date(src_realpath)
-        if date is not None:
-            year, month, day = date
-            # Year_Month_Day
-            if ARRANGE_MODE == ARRANGE_YEAR_MONTH_DAY:
-                dest_dir = os.path.join(DEST_ROOT, year, month, "%s_%s_%s" % (year, month, day))
-            elif ARRANGE_MODE == ARRANGE_YEAR_MONTH:
-                dest_dir = os.path.join(DEST_ROOT, year, month)
-            photo_with_date_cnt += 1
-        else:
-            dest_dir = os.path.join(DEST_ROOT, "unknown_date")
-
-        dest_file = os.path.join(dest_dir, file)
-
-        if not os.path.exists(dest_dir):
-            os.makedirs(dest_dir)
+_STOP = None  # queue sentinel: no more work for this worker
+
+####################################################################################################
+
+class PathLocks:
+    """
+    Locks by key, e.g. destination path, so that files with the same destination name
+    (or the same size) are placed one at a time, while other files are placed concurrently.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}  # key -> [lock, number of threads using it]
+
+    @contextmanager
+    def locked(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+class Counters:
+    """
+    Thread-safe counters of processed files.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = Counter()
+
+    def add(self, name, value=1):
+        with self._lock:
+            self._counter[name] += value
+
+    def __getitem__(self, name):
+        with self._lock:
+            return self._counter[name]
+
+def load_config(config_path="config.yaml"):
+    with open(config_path, "r") as f:
+        try:
+            config = yaml.safe_load(f)
+        except yaml.YAMLError as exc:
+            print(exc)
+            exit()
+    workers = config.get("workers") or {}
+    config["exif_workers"] = int(workers.get("exif", DEFAULT_EXIF_WORKERS))
+    config["copy_workers"] = int(workers.get("copy", DEFAULT_COPY_WORKERS))
+    config["queue_size"] = int(config.get("queue_size", DEFAULT_QUEUE_SIZE))
+    config["dest_index"] = bool(config.get("dest_index", True))
+    config["refresh_dest_index"] = bool(config.get("refresh_dest_index", False))
+    config["journal"] = bool(config.get("journal", True))
+    config["exif_catalog"] = bool(config.get("exif_catalog", True))
+    return config
+
+def get_dest_dir(dest_root, date):
+    if date is not None:
+        year, month, day = date
+        # Year_Month_Day
+        if ARRANGE_MODE == ARRANGE_YEAR_MONTH_DAY:
+            return os.path.join(dest_root, year, month, "%s_%s_%s" % (year, month, day))
+        elif ARRANGE_MODE == ARRANGE_YEAR_MONTH:
+            return os.path.join(dest_root, year, month)
+    return os.path.join(dest_root, "unknown_date")
+
+def place_file(dest_root, file, src_realpath, date, counters, dest_locks, dest_index=None, journal=None, src_stat=None,
+               catalog=None):
+    """
+    Copies or moves a single file into its place in the destination tree.
+    If dest_index is given, the file is skipped when its content exists anywhere in the destination.
+    If journal is given, the transfer is recorded in it; src_stat is os.stat of the source file.
+    If catalog is given, the EXIF metadata of the source file are recorded for the placed file.
+    """
+    if date is not None:
+        year, month, day = date
+        counters.add("photo_with_date")
+    dest_dir = get_dest_dir(dest_root, date)
+    dest_file = os.path.join(dest_dir, file)
+
+    os.makedirs(dest_dir, exist_ok=True)
+
+    # Files of the same size may have the same content, place them one at a time
+    if src_stat is None:
+        with phase("stat"):
+            src_stat = os.stat(src_realpath)
+    src_size = src_stat.st_size
+    with dest_locks.locked(("size", src_size)), dest_locks.locked(dest_file):
+        # Check if a file with the same content exists
+        src_hash = None
+        with phase("compare"):
+            if dest_index is not None:
+                if os.path.isfile(dest_file) and not dest_index.contains(dest_file):
+                    dest_index.add(dest_file)
+                identical_file, src_hash = dest_index.find(src_realpath, src_size)
+            elif os.path.isfile(dest_file) and filecmp.cmp(src_realpath, dest_file, shallow=False):
+                identical_file = dest_file
+            else:
+                identical_file = None
+
+        if identical_file is not None:
+            #equal
+            if date is not None:
+                print("File is identical skip [%s-%s-%s] from [%s] (same as [%s])" % (year, month, day, src_realpath, identical_file))
+            else:
+                print("File is identical skip [Unknown date] from [%s] (same as [%s])" % (src_realpath, identical_file))
+            counters.add("photo")
+            counters.add("identical_photo")
+            if journal is not None:
+                journal.done(src_realpath, src_stat, date, identical_file)
+            return
 
         # Check if such file exist
         if os.path.isfile(dest_file):
-            # TODO: check if hash is the same
-            if filecmp.cmp(src_realpath, dest_file, shallow=False):
-                #equal
-                if date is not None:
-                    print("File is identical skip [%s-%s-%s] from [%s]" % (year, month, day, src_realpath))
-                else:
-                    print("File is identical skip [Unknown date] from [%s]" % (src_realpath,))
-                photo_cnt += 1
-                identical_photo_cnt += 1
-                continue
-            else:
-                photo_with_errors_cnt += 1
-                #dest_file += "_" + str(time.time())
-                filename, file_extension = os.path.splitext(file)
-                filename += "_" + str(time.time())
-                dest_file = os.path.join(dest_dir, filename + file_extension)
+            counters.add("photo_with_errors")
+            #dest_file += "_" + str(time.time())
+            filename, file_extension = os.path.splitext(file)
+            filename += "_" + str(time.time())
+            dest_file = os.path.join(dest_dir, filename + file_extension)
 
         try:
             if date is not None:
                 print ("Copying/moving [%s-%s-%s] from [%s]" % (year, month, day, src_realpath))
             else:
                 print ("Copying/moving [%s]" % (src_realpath,))
-            if COPY_MODE:
-                shutil.copy(src_realpath, dest_file)
-            else:
-                os.rename(src_realpath, dest_file)
-            photo_cnt += 1
+            if journal is not None:
+                journal.plan(src_realpath, src_stat, date, dest_file)
+            start = time.perf_counter()
+            with phase("copy"):
+                copy_hash = transfer_file(src_realpath, dest_file, move=not COPY_MODE, backend=TRANSFER_BACKEND,
+                                          hash_name="sha256" if VERIFY_TRANSFERS else None, verify=VERIFY_TRANSFERS)
+            stats = get_stats()
+            if stats is not None:
+                stats.add_file(src_realpath, src_size, time.perf_counter() - start)
+            if dest_index is not None:
+                with phase("compare"):
+                    dest_index.add(dest_file, src_hash or copy_hash)
+            if journal is not None:
+                journal.done(src_realpath, src_stat, date, dest_file)
+            if catalog is not None:
+                catalog.record_transfer(src_realpath, dest_file)
+            counters.add("photo")
         except IOError as e:
             print("Unable to copy file. %s" % e)
+            counters.add("failed")
         except:
             print("Unexpected error:", sys.exc_info())
+            counters.add("failed")
 
-print ("\n\n\n")
+####################################### Pipeline stages ############################################
 
-print ("Processed [%d] files in total." % photo_cnt)
-print ("Date was detected for [%d] photoes." % photo_with_date_cnt)
-print ("Date was NOT detected for [%d] files." % (photo_cnt - photo_with_date_cnt))
-print ("[%d] identical photoes were found ." % (identical_photo_cnt))
-print ("Potential errors were found in [%d] photoes ." % (photo_with_errors_cnt))
+def scan_files(source_root, scan_queue, n_exif_workers, copy_queue, counters, stop, journal=None):
+    """
+    Stage 1: walks the source tree and queues files for EXIF extraction.
+    Files that the journal records as done are skipped. Files that it records as
+    planned are queued for copying/moving with the recorded date.
+    Files that cannot be read are reported and counted as failed. The walk ends early when stop is set.
+    """
+    try:
+        for path, directories, files in timed_iter(os.walk(source_root), "walk"):
+            path_realpath = os.path.realpath(path)
+            for file in files:
+                if stop.is_set():
+                    return
+                src_realpath = os.path.join(path_realpath, file)
+                try:
+                    with phase("stat"):
+                        src_stat = os.stat(src_realpath)
+                    if journal is not None:
+                        with phase("journal"):
+                            state, date = journal.lookup(src_realpath, src_stat)
+                except OSError as e:
+                    # e.g. a dangling symlink, or a file removed during the scan
+                    print("Unable to read file [%s]. %s" % (src_realpath, e))
+                    counters.add("failed")
+                    continue
+                if journal is not None:
+                    if state == STATE_DONE:
+                        counters.add("already_imported")
+                        continue
+                    elif state == STATE_PLANNED:
+                        copy_queue.put((file, src_realpath, date, src_stat))
+                        continue
+                scan_queue.put((file, src_realpath, src_stat))
+    except Exception as e:
+        print("Scanning [%s] failed. %s" % (source_root, e))
+        counters.add("failed")
+        stop.set()
+    finally:
+        for _ in range(n_exif_workers):
+            scan_queue.put(_STOP)
+
+def extract_dates(scan_queue, copy_queue, counters, stop, catalog=None):
+    """
+    Stage 2: gets EXIF date of queued files, from the catalog if given, and queues them for copying/moving.
+    An unexpected error sets stop, so that the scanner stops queueing, and the queue is drained
+    so that the scanner is not blocked on it.
+    """
+    try:
+        while (item := scan_queue.get()) is not _STOP:
+            file, src_realpath, src_stat = item
+            with phase("exif"):
+                if catalog is not None:
+                    date = catalog.get_date(src_realpath, src_stat)
+                else:
+                    date = get_date(src_realpath)
+            copy_queue.put((file, src_realpath, date, src_stat))
+    except Exception as e:
+        print("Extracting EXIF dates failed. %s" % e)
+        counters.add("failed")
+        stop.set()
+        while scan_queue.get() is not _STOP:
+            pass
+
+def place_files(dest_root, copy_queue, counters, dest_locks, dest_index, journal, catalog=None):
+    """
+    Stage 3: copies/moves queued files into the destination tree.
+    """
+    while (item := copy_queue.get()) is not _STOP:
+        file, src_realpath, date, src_stat = item
+        try:
+            place_file(dest_root, file, src_realpath, date, counters, dest_locks, dest_index, journal, src_stat, catalog)
+        except Exception as e:
+            print("Unable to place file [%s]. %s" % (src_realpath, e))
+            counters.add("failed")
 
+def run_pipeline(source_root, dest_root, exif_workers, copy_workers, queue_size, dest_index=None, journal=None,
+                 catalog=None):
+    counters = Counters()
+    dest_locks = PathLocks()
+    scan_queue = queue.Queue(maxsize=queue_size)
+    copy_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()  # set by a stage that failed, the scanner then stops queueing files
 
+    scanner = threading.Thread(target=scan_files, args=(source_root, scan_queue, exif_workers, copy_queue, counters, stop, journal), name="scan")
+    exif_threads = [threading.Thread(target=extract_dates, args=(scan_queue, copy_queue, counters, stop, catalog), name="exif-%d" % i)
+                    for i in range(exif_workers)]
+    copy_threads = [threading.Thread(target=place_files, args=(dest_root, copy_queue, counters, dest_locks, dest_index, journal, catalog), name="copy-%d" % i)
+                    for i in range(copy_workers)]
 
+    for thread in [scanner] + exif_threads + copy_threads:
+        thread.start()
+    scanner.join()
+    for thread in exif_threads:
+        thread.join()
+    for _ in copy_threads:
+        copy_queue.put(_STOP)
+    for thread in copy_threads:
+        thread.join()
+
+    return counters
+
+####################################################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy photos and sort them by EXIF date.")
+    parser.add_argument("--config", default="config.yaml", help="path to config file (default: config.yaml)")
+    parser.add_argument("--stats", default=None, help="write run statistics (throughput, time per phase, slowest files) to this JSON file")
+    parser.add_argument("--profile", default=None, help="profile the run with cProfile and save the statistics to this file")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+
+    SOURCE_ROOT = os.path.realpath(config['src_root'])
+    DEST_ROOT = os.path.realpath(config['dst_root'])
+
+    print("SOURCE_ROOT = [%s]" % SOURCE_ROOT)
+    print("DEST_ROOT = [%s]" % DEST_ROOT)
+
+    dest_index = None
+    if config["dest_index"]:
+        dest_index = DestIndex(DEST_ROOT)
+        if config["refresh_dest_index"]:
+            dest_index.refresh()
+
+    journal = None
+    if config["journal"]:
+        journal = ImportJournal(DEST_ROOT)
+        journal.recover(PART_SUFFIX)
+
+    catalog = None
+    if config["exif_catalog"]:
+        catalog = ExifCatalog(os.path.join(DEST_ROOT, CATALOG_FILENAME))
+
+    try:
+        with stats_to_json(args.stats), profiled(args.profile):
+            counters = run_pipeline(SOURCE_ROOT, DEST_ROOT, config["exif_workers"], config["copy_workers"],
+                                    config["queue_size"], dest_index, journal, catalog)
+    finally:
+        if dest_index is not None:
+            dest_index.close()
+        if journal is not None:
+            journal.close()
+        if catalog is not None:
+            catalog.close()
+    photo_cnt = counters["photo"]
+    photo_with_date_cnt = counters["photo_with_date"]
+    identical_photo_cnt = counters["identical_photo"]
+    photo_with_errors_cnt = counters["photo_with_errors"]
+    already_imported_cnt = counters["already_imported"]
+    failed_cnt = counters["failed"]
 
+    print ("\n\n\n")
 
+    print ("Processed [%d] files in total." % photo_cnt)
+    print ("Date was detected for [%d] photoes." % photo_with_date_cnt)
+    print ("Date was NOT detected for [%d] files." % (photo_cnt - photo_with_date_cnt))
+    print ("[%d] identical photoes were found ." % (identical_photo_cnt))
+    print ("Potential errors were found in [%d] photoes ." % (photo_with_errors_cnt))
+    print ("[%d] files were already imported by a previous run." % (already_imported_cnt))
+    if failed_cnt > 0:
+        print ("[%d] files could not be imported, see the messages above." % (failed_cnt))
+        sys.exit(1)
 
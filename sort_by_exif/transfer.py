@@ -0,0 +1,161 @@
+"""
+Copying and moving files into the destination tree.
+
+Copies are done by the kernel when possible, without passing the data through
+userspace buffers: a reflink (copy-on-write clone on Btrfs/XFS), then copy_file_range,
+then sendfile. If none of them is supported, e.g. on Windows, the file is copied through
+a large reused buffer.
+
+If a hash is requested, the file is copied through the buffer and hashed on the way,
+so the content is read only once. With verification the destination is then read back
+and compared against that hash.
+
+A move is a rename if source and destination are on the same filesystem, otherwise
+a copy followed by removing the source.
+
+Copies are written to dst + PART_SUFFIX and renamed to dst when complete, so an
+interrupted copy never leaves a truncated file under the final name.
+"""
+
+import os
+import errno
+import shutil
+import hashlib
+
+BACKEND_AUTO = "auto"
+BACKEND_REFLINK = "reflink"
+BACKEND_COPY_FILE_RANGE = "copy_file_range"
+BACKEND_SENDFILE = "sendfile"
+BACKEND_BUFFERED = "buffered"
+
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+KERNEL_COPY_SIZE = 1024 * 1024 * 1024  # max bytes per copy_file_range/sendfile call
+FICLONE = 0x40049409  # from linux/fs.h
+PART_SUFFIX = ".part"
+
+
+def _copy_reflink(src_fd, dst_fd, size):
+    import fcntl
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+def _copy_file_range(src_fd, dst_fd, size):
+    offset = 0
+    while offset < size:
+        n_bytes = os.copy_file_range(src_fd, dst_fd, min(size - offset, KERNEL_COPY_SIZE), offset, offset)
+        if n_bytes == 0:
+            break
+        offset += n_bytes
+
+def _copy_sendfile(src_fd, dst_fd, size):
+    offset = 0
+    while offset < size:
+        n_bytes = os.sendfile(dst_fd, src_fd, offset, min(size - offset, KERNEL_COPY_SIZE))
+        if n_bytes == 0:
+            break
+        offset += n_bytes
+
+def _copy_buffered(fsrc, fdst, size, hash=None):
+    buffer = bytearray(min(COPY_BUFFER_SIZE, max(size, 1)))
+    view = memoryview(buffer)
+    while (n_bytes := fsrc.readinto(buffer)):
+        block = view[:n_bytes]
+        if hash is not None:
+            hash.update(block)
+        while len(block) > 0:
+            block = block[fdst.write(block):]
+
+KERNEL_BACKENDS = {
+    BACKEND_REFLINK: _copy_reflink,
+    BACKEND_COPY_FILE_RANGE: _copy_file_range,
+    BACKEND_SENDFILE: _copy_sendfile,
+}
+
+def get_kernel_backends(backend):
+    """
+    Returns kernel copy functions to try, in order, for the backend name.
+    """
+    if backend == BACKEND_AUTO:
+        names = [BACKEND_REFLINK, BACKEND_COPY_FILE_RANGE, BACKEND_SENDFILE]
+    elif backend == BACKEND_BUFFERED:
+        names = []
+    elif backend in KERNEL_BACKENDS:
+        names = [backend]
+    else:
+        raise ValueError("Unknown transfer backend [%s]" % backend)
+    if os.name != "posix":
+        return []
+    return [KERNEL_BACKENDS[name] for name in names]
+
+def get_file_hash(fname, hash_name):
+    hash = hashlib.new(hash_name)
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+def copy_file(src, dst, backend=BACKEND_AUTO, hash_name=None):
+    """
+    Copies content and permission bits of src to dst, like shutil.copy.
+    If hash_name is given (e.g. "sha256"), returns hash of the content computed while copying.
+    """
+    with open(src, "rb", buffering=0) as fsrc, open(dst, "wb", buffering=0) as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(src_fd).st_size
+        hash = hashlib.new(hash_name) if hash_name is not None else None
+        if hash is None:
+            for kernel_copy in get_kernel_backends(backend):
+                try:
+                    kernel_copy(src_fd, dst_fd, size)
+                    if os.fstat(dst_fd).st_size != size:
+                        raise OSError(errno.EIO, "Incomplete copy")
+                    break
+                except (OSError, AttributeError):
+                    # not supported here: start over with the next backend
+                    os.ftruncate(dst_fd, 0)
+                    os.lseek(src_fd, 0, os.SEEK_SET)
+                    os.lseek(dst_fd, 0, os.SEEK_SET)
+            else:
+                _copy_buffered(fsrc, fdst, size)
+        else:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(src_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            _copy_buffered(fsrc, fdst, size, hash)
+    shutil.copymode(src, dst)
+    return hash.hexdigest() if hash is not None else None
+
+def transfer_file(src, dst, move=False, backend=BACKEND_AUTO, hash_name=None, verify=False):
+    """
+    Copies or moves src to dst. The copy is written to dst + PART_SUFFIX first,
+    which is removed on failure and renamed to dst on success.
+
+    If hash_name is given, returns hash of the content, computed during the copy.
+    It is None if the file was moved by a rename, as its content was not read.
+    With verify=True, dst is read back after copying and compared with that hash.
+    """
+    if move:
+        try:
+            os.rename(src, dst)
+            return None
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        # cross-device move: copy and remove the source
+
+    if verify and hash_name is None:
+        hash_name = "sha256"
+    part = dst + PART_SUFFIX
+    try:
+        hash = copy_file(src, part, backend, hash_name)
+        if move:
+            shutil.copystat(src, part)
+        if verify and get_file_hash(part, hash_name) != hash:
+            raise IOError("Verification failed, [%s] differs from [%s]" % (dst, src))
+        os.replace(part, dst)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+
+    if move:
+        os.remove(src)
+    return hash
@@ -0,0 +1,465 @@
+"""
+Keeps the volume manifests of get_hash.py current while files are added to the archive.
+
+Rehashing the whole archive after every imported shoot takes time proportional to the archive.
+This daemon watches the archive with Linux inotify (see linux_inotify.py) and applies changes
+to the manifests of the latest hashes__<timestamp> directory as they happen:
+- files that are created, written or moved in are hashed and their records added or replaced,
+- files that are deleted or moved out lose their records, and directories all records below them,
+- a new top-level directory gets a new <volume>_hashes.<format> manifest.
+Events of a file are debounced: it is hashed once no event arrived for DEBOUNCE_SECONDS, so a
+file being copied is hashed once, after the copy.
+
+Changes are saved once per batch. NDJSON manifests (and chunk sidecars) are updated in place:
+changed records and tombstones of removed paths are appended (see checksums.manifest), and the
+manifest is compacted, i.e. rewritten to a temporary file that is then renamed, once the appended
+lines outnumber its records. Saving thus costs time proportional to the changes, amortized. JSON
+manifests cannot be appended to and are rewritten on every batch, in time proportional to the
+volume, so use --format ndjson with get_hash.py for large volumes. Records are indexed by
+directory, so removing a directory only visits the records below it.
+
+Files are filtered as by get_hash.py: top-level names containing "hashes", .json and .ndjson
+files in volumes and directories with a Lightroom catalog are not hashed. With a hash cache
+(--cache), files moved inside the archive are not read again.
+
+Changes made while the daemon was not running are not seen. Start it with --rescan to queue
+every file of the archive once (cheap with a cache), which also drops records of missing files.
+
+How to use this script (Linux only):
+python watch_archive.py <path_to_archive>
+
+Other options:
+python watch_archive.py --hashes-dir <hashes__timestamp> --cache <path_to_cache_db> --rescan <path_to_archive>
+--algorithm is as for get_hash.py and should match the existing manifests. New manifests are
+written in the format of the existing ones, or in the one given with --format.
+Stop the daemon with Ctrl+C or SIGTERM, pending changes are applied first.
+"""
+
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import posixpath
+
+import get_hash
+import linux_inotify as inotify
+from checksums.cache import HashCache
+from checksums.manifest import DELETED, ManifestWriter, is_ndjson, iter_manifest
+
+####################################### Config #####################################################
+
+DEBOUNCE_SECONDS = 2.0
+COMPACT_MIN_LINES = 1000  # appended lines tolerated in an NDJSON manifest before it is compacted
+LOG_LEVEL = logging.INFO
+LOG_ENCODING = "utf-8"
+
+DIR_MASK = (inotify.IN_CLOSE_WRITE | inotify.IN_MODIFY | inotify.IN_CREATE | inotify.IN_DELETE |
+            inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO | inotify.IN_ONLYDIR | inotify.IN_DONT_FOLLOW |
+            inotify.IN_EXCL_UNLINK)
+
+####################################################################################################
+
+def find_latest_hash_dir(archieve_root):
+    """
+    Returns the latest hashes__<timestamp> directory of the archive, or None.
+    """
+    hash_dirs = sorted(item for item in os.listdir(archieve_root)
+                       if item.startswith("hashes__") and os.path.isdir(os.path.join(archieve_root, item)))
+    return os.path.join(archieve_root, hash_dirs[-1]) if hash_dirs else None
+
+def find_output_format(hash_dir_root):
+    """
+    Returns the format of the manifests in hash_dir_root, or get_hash.OUTPUT_FORMAT if there are none.
+    """
+    for item in sorted(os.listdir(hash_dir_root)):
+        for output_format in ("json", "ndjson"):
+            if item.endswith("_hashes." + output_format):
+                return output_format
+    return get_hash.OUTPUT_FORMAT
+
+class RecordIndex:
+    """
+    Records of a manifest (or chunk sidecar) by posixpath, loaded once and saved when changed.
+    Has the write() method of ManifestWriter, so that get_hash.hash_file_to_manifest can update it.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.records = {}
+        self.files_by_dir = {}  # directory posixpath ("" for the top) -> posixpaths of its files
+        self.subdirs = {}  # directory posixpath -> posixpaths of its directories with records
+        self.n_lines = 0  # lines of an NDJSON manifest, including replaced records and tombstones
+        self.updates = []  # records and tombstones not saved yet
+        if os.path.exists(filepath):
+            for record in iter_manifest(filepath):
+                self.n_lines += 1
+                if record.get(DELETED):
+                    self._discard(record["posixpath"])
+                else:
+                    self._add(record)
+
+    def _add(self, record):
+        path = record["posixpath"]
+        if path not in self.records:
+            dirpath = posixpath.dirname(path)
+            if dirpath not in self.files_by_dir:
+                self.files_by_dir[dirpath] = set()
+                self._add_dir(dirpath)
+            self.files_by_dir[dirpath].add(path)
+        self.records[path] = record
+
+    def _add_dir(self, dirpath):
+        child = None
+        while True:
+            known = dirpath in self.subdirs
+            self.subdirs.setdefault(dirpath, set())
+            if child is not None:
+                self.subdirs[dirpath].add(child)
+            if known or not dirpath:
+                return
+            child, dirpath = dirpath, posixpath.dirname(dirpath)
+
+    def _discard(self, path):
+        if self.records.pop(path, None) is not None:
+            self.files_by_dir[posixpath.dirname(path)].discard(path)
+
+    def _iter_dirs_below(self, dirpath):
+        stack = [dirpath] if dirpath in self.subdirs else []
+        while stack:
+            dirpath = stack.pop()
+            yield dirpath
+            stack.extend(self.subdirs[dirpath])
+
+    def write(self, record):
+        self._add(record)
+        self.updates.append(record)
+
+    def paths_below(self, posixpath_str):
+        """
+        Returns paths with records equal to posixpath_str or below it.
+        """
+        paths = [posixpath_str] if posixpath_str in self.records else []
+        for dirpath in self._iter_dirs_below(posixpath_str):
+            paths.extend(self.files_by_dir.get(dirpath, ()))
+        return paths
+
+    def remove(self, posixpath_str):
+        """
+        Removes the record of a file, or the records of all files below a directory.
+        """
+        for path in self.paths_below(posixpath_str):
+            self._discard(path)
+            self.updates.append({"posixpath": path, DELETED: True})
+        dirs = list(self._iter_dirs_below(posixpath_str))
+        for dirpath in dirs:
+            del self.subdirs[dirpath]
+            self.files_by_dir.pop(dirpath, None)
+        if dirs and posixpath_str:
+            self.subdirs[posixpath.dirname(posixpath_str)].discard(posixpath_str)
+
+    def save(self):
+        """
+        Appends pending updates to an NDJSON manifest, or rewrites the manifest if it is JSON
+        or if the appended lines would outnumber the records.
+        """
+        if not self.updates:
+            return
+        if is_ndjson(self.filepath) and self.n_lines + len(self.updates) <= 2 * len(self.records) + COMPACT_MIN_LINES:
+            with ManifestWriter(self.filepath, append=True) as manifest:
+                for record in self.updates:
+                    manifest.write(record)
+            self.n_lines += len(self.updates)
+            logging.info("Appended [%d] updates to [%s]" % (len(self.updates), self.filepath))
+        else:
+            name, ext = os.path.splitext(self.filepath)
+            tmp_filepath = name + ".tmp" + ext
+            with ManifestWriter(tmp_filepath) as manifest:
+                for record in self.records.values():
+                    manifest.write(record)
+            os.replace(tmp_filepath, self.filepath)
+            self.n_lines = len(self.records)
+            logging.info("Saved [%d] records to [%s]" % (len(self.records), self.filepath))
+        self.updates = []
+
+class ArchiveWatcher:
+    """
+    Watches archieve_root and applies changes to the manifests in hash_dir_root.
+    """
+
+    def __init__(self, archieve_root, hash_dir_root, output_format=None, cache=None,
+                 hash_type=None, debounce_seconds=DEBOUNCE_SECONDS):
+        self.archieve_root = os.path.abspath(archieve_root)
+        self.hash_dir_root = hash_dir_root
+        self.output_format = output_format if output_format is not None else find_output_format(hash_dir_root)
+        self.cache = cache
+        self.hash_type = hash_type if hash_type is not None else get_hash.HASH_ALGORITHM
+        self.debounce_seconds = debounce_seconds
+        self.prefix_len = len(os.path.join(self.archieve_root, ""))
+        self.inotify = inotify.Inotify()
+        self.watches = {}  # wd -> directory path
+        self.pending = {}  # path -> time of its last event
+        self.manifests = {}  # volume name ("files" for the archive root) -> (RecordIndex, RecordIndex or None)
+
+    def close(self):
+        self.inotify.close()
+
+    ################################ Watches #######################################################
+
+    def watch_tree(self, dirpath, queue_files=False):
+        """
+        Watches dirpath and all directories below it. With queue_files, files found are queued,
+        for directories that were created or moved in and may already have files.
+        """
+        for path, directories, files in os.walk(dirpath):
+            if path == self.archieve_root:
+                directories[:] = [item for item in directories if "hashes" not in item]
+                files = [item for item in files if "hashes" not in item]
+            try:
+                self.watches[self.inotify.add_watch(path, DIR_MASK)] = path
+            except FileNotFoundError:
+                continue  # removed meanwhile, its parent reports it
+            if queue_files:
+                for file in files:
+                    self.queue(os.path.join(path, file))
+
+    def unwatch_tree(self, dirpath):
+        """
+        Stops watching dirpath and directories below it, e.g. after it was moved out.
+        """
+        prefix = os.path.join(dirpath, "")
+        for wd, path in list(self.watches.items()):
+            if path == dirpath or path.startswith(prefix):
+                del self.watches[wd]
+                self.inotify.rm_watch(wd)
+
+    ################################ Events ########################################################
+
+    def queue(self, path):
+        self.pending[path] = time.monotonic()
+
+    def handle_event(self, event):
+        if event.mask & inotify.IN_Q_OVERFLOW:
+            logging.warning("inotify queue overflow, rescanning the archive")
+            self.rescan()
+            return
+        if event.mask & inotify.IN_IGNORED:
+            self.watches.pop(event.wd, None)
+            return
+        dirpath = self.watches.get(event.wd)
+        if dirpath is None or not event.name:
+            return
+        path = os.path.join(dirpath, event.name)
+        if dirpath == self.archieve_root and "hashes" in event.name:
+            return
+        if event.mask & inotify.IN_ISDIR:
+            if event.mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                self.unwatch_tree(path)  # moved inside the archive, its watches have stale paths
+                self.watch_tree(path, queue_files=True)
+            elif event.mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+                self.unwatch_tree(path)
+        self.queue(path)
+
+    def rescan(self):
+        """
+        Watches the whole archive and queues all files, and all paths with records.
+        """
+        self.watch_tree(self.archieve_root, queue_files=True)
+        for volume in os.listdir(self.hash_dir_root):
+            if volume.endswith(("_hashes.json", "_hashes.ndjson")):
+                records, chunks = self.get_manifest(volume.rsplit("_hashes.", 1)[0])
+                for posixpath_str in list(records.records):
+                    self.queue(os.path.join(self.archieve_root, *posixpath_str.split("/")))
+
+    ################################ Manifests #####################################################
+
+    def get_manifest(self, volume):
+        """
+        Returns (records, chunk records or None) of a volume, loading the manifest on first use.
+        """
+        if volume not in self.manifests:
+            hashes_file = None
+            for output_format in (self.output_format, "json", "ndjson"):
+                hashes_file = os.path.join(self.hash_dir_root, "%s_hashes.%s" % (volume, output_format))
+                if os.path.exists(hashes_file):
+                    break
+            else:
+                hashes_file = os.path.join(self.hash_dir_root, "%s_hashes.%s" % (volume, self.output_format))
+            logging.info("Using manifest [%s]" % hashes_file)
+            chunks = None
+            hash_types = self.hash_type if isinstance(self.hash_type, (list, tuple)) else [self.hash_type]
+            if get_hash.BLAKE2B_TREE in hash_types:
+                chunks = RecordIndex(get_hash.get_chunks_file(hashes_file))
+            self.manifests[volume] = (RecordIndex(hashes_file), chunks)
+        return self.manifests[volume]
+
+    def remove_manifest(self, volume):
+        """
+        Removes the manifest of a volume that was removed from the archive.
+        """
+        for index in self.manifests.pop(volume):
+            if index is not None and os.path.exists(index.filepath):
+                os.remove(index.filepath)
+                logging.info("Removed [%s]" % index.filepath)
+
+    def is_volume(self, name):
+        """
+        Returns whether a top-level name is a volume, which may have been removed already.
+        """
+        return (os.path.isdir(os.path.join(self.archieve_root, name)) or name in self.manifests or
+                any(os.path.exists(os.path.join(self.hash_dir_root, "%s_hashes.%s" % (name, output_format)))
+                    for output_format in ("json", "ndjson")))
+
+    def is_skipped_dir(self, dirpath, skipped_dirs):
+        """
+        Returns whether get_hash.py skips dirpath of a volume, because it or a directory above it
+        inside the volume has a Lightroom catalog. skipped_dirs memoizes the answers of a batch.
+        """
+        if len(dirpath) < self.prefix_len:
+            return False  # archive root
+        if dirpath not in skipped_dirs:
+            try:
+                files = os.listdir(dirpath)
+            except OSError:
+                files = []
+            skipped_dirs[dirpath] = (get_hash.FILTER_OUT_LR_CATALOG and get_hash.is_lightroom_catalog(files) or
+                                     self.is_skipped_dir(os.path.dirname(dirpath), skipped_dirs))
+        return skipped_dirs[dirpath]
+
+    def apply(self, path, skipped_dirs):
+        """
+        Hashes the file at path into the manifest of its volume, or removes its records.
+        """
+        parts = path[self.prefix_len:].split(os.sep)
+        volume = parts[0] if len(parts) > 1 or self.is_volume(parts[0]) else "files"
+        records, chunks = self.get_manifest(volume)
+        posixpath_str = posixpath.normpath("/".join(parts))
+        filename, file_extension = os.path.splitext(path)
+        hashed = False
+        removed = [posixpath_str]
+        if os.path.isdir(path):
+            # Files below are queued by their own events, only records of missing files are removed
+            removed = [path_below for path_below in records.paths_below(posixpath_str)
+                       if not os.path.exists(os.path.join(self.archieve_root, *path_below.split("/")))]
+        elif not os.path.isfile(path):
+            pass
+        elif volume == "files":
+            hashed = True
+        elif file_extension.upper() in (".JSON", ".NDJSON"):
+            pass
+        elif file_extension == ".lrcat" and get_hash.FILTER_OUT_LR_CATALOG:
+            removed = [posixpath.dirname(posixpath_str)]  # the directory is no longer hashed
+        else:
+            hashed = not self.is_skipped_dir(os.path.dirname(path), skipped_dirs)
+        if hashed:
+            try:
+                get_hash.hash_file_to_manifest(path, posixpath_str, records, chunks, self.cache,
+                                               None, self.hash_type)
+                removed = []
+            except OSError as e:
+                logging.warning("Unable to hash [%s]: %s" % (path, e))
+        for posixpath_str in removed:
+            records.remove(posixpath_str)
+            if chunks is not None:
+                chunks.remove(posixpath_str)
+
+    def apply_ready(self, force=False):
+        """
+        Applies changes of paths without events for debounce_seconds (all with force) and saves
+        changed manifests. Returns seconds until the next path is ready, or None.
+        """
+        now = time.monotonic()
+        ready = [path for path, last_event in self.pending.items()
+                 if force or now - last_event >= self.debounce_seconds]
+        if ready:
+            skipped_dirs = {}
+            for path in sorted(ready):
+                del self.pending[path]
+                self.apply(path, skipped_dirs)
+            for volume, (records, chunks) in list(self.manifests.items()):
+                if (volume != "files" and not records.records and
+                        not os.path.isdir(os.path.join(self.archieve_root, volume))):
+                    self.remove_manifest(volume)
+                    continue
+                records.save()
+                if chunks is not None:
+                    chunks.save()
+            if self.cache is not None:
+                self.cache.commit()
+        if not self.pending:
+            return None
+        return max(0.0, min(self.pending.values()) + self.debounce_seconds - time.monotonic())
+
+    def run(self, rescan=False):
+        """
+        Watches the archive until interrupted, then applies pending changes.
+        """
+        if rescan:
+            self.rescan()
+        else:
+            self.watch_tree(self.archieve_root)
+        logging.info("Watching [%d] directories" % len(self.watches))
+        print("Watching [%d] directories of [%s]" % (len(self.watches), self.archieve_root))
+        timeout = self.apply_ready()
+        try:
+            while True:
+                for event in self.inotify.read_events(timeout):
+                    self.handle_event(event)
+                timeout = self.apply_ready()
+        finally:
+            self.apply_ready(force=True)
+
+def raise_system_exit(signum, frame):
+    raise SystemExit(0)
+
+####################################################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep manifests of the archive current while it changes.")
+    parser.add_argument("archive_root", help="path to archive")
+    parser.add_argument("--hashes-dir", default=None, help="directory with the manifests to update (default: the latest hashes__<timestamp>)")
+    parser.add_argument("--algorithm", default=None, help="hash algorithm(s), e.g. SHA256 or MD5,SHA256,SHA512 (default: get_hash.HASH_ALGORITHM)")
+    parser.add_argument("--format", choices=("json", "ndjson"), default=None, help="format of new manifests (default: as the existing ones, else get_hash.OUTPUT_FORMAT)")
+    parser.add_argument("--cache", default=get_hash.HASH_CACHE_PATH, help="path to hash cache database")
+    parser.add_argument("--rescan", action="store_true", help="queue all files of the archive at start, to catch up with changes made meanwhile")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS, help="seconds without events before a file is hashed (default: %s)" % DEBOUNCE_SECONDS)
+    args = parser.parse_args()
+
+    hash_type = None
+    if args.algorithm is not None:
+        hash_types = [ht.strip().upper() for ht in args.algorithm.split(",")]
+        hash_type = hash_types[0] if len(hash_types) == 1 else hash_types
+
+    archieve_root = os.path.abspath(args.archive_root)
+    if not os.path.isdir(archieve_root):
+        print("There is no directory: [%s]" % archieve_root)
+        sys.exit(1)
+    hash_dir_root = os.path.abspath(args.hashes_dir) if args.hashes_dir else find_latest_hash_dir(archieve_root)
+    if hash_dir_root is None or not os.path.isdir(hash_dir_root):
+        print("There are no manifests to update in [%s], run get_hash.py first" % archieve_root)
+        sys.exit(1)
+
+    logging.basicConfig(
+        filename=os.path.join(hash_dir_root, "watch_log.txt"),
+        encoding=LOG_ENCODING,
+        level=LOG_LEVEL,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    logging.info("Watching started, archieve_root = [%s], hash_dir_root = [%s]" % (archieve_root, hash_dir_root))
+
+    signal.signal(signal.SIGTERM, raise_system_exit)
+    cache = None
+    if args.cache:
+        logging.info("Hash cache = [%s]" % args.cache)
+        cache = HashCache(args.cache)
+    watcher = ArchiveWatcher(archieve_root, hash_dir_root, args.format, cache, hash_type, args.debounce)
+    try:
+        watcher.run(args.rescan)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if cache is not None:
+            cache.close()
+    logging.info("Watching stopped")